@@ -1,12 +1,14 @@
 # -*- coding: utf-8 -*-
 """
-FastAPI — 產品化 API（含 /score /index/{date} /report/{date} — 完整版）
+FastAPI — 產品化 API（含 /score /score/batch /index/{date} /report/{date} — 完整版）
 """
-import os
+import os, json
 from fastapi import FastAPI, HTTPException, Query
+from fastapi.responses import StreamingResponse
 from pydantic import BaseModel
 from typing import List, Any
 from src.llm import rag_report_gemini as rag
+from src.models.length_bucket import iter_length_buckets, iter_windows
 
 app = FastAPI(title="FinNews Sentiment API", version="0.1.2")
 
@@ -44,6 +46,60 @@ def score(req: ScoreReq):
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"評分失敗: {e}")
 
+# ---------- /score/batch ----------
+SCORE_BATCH_MAX_ITEMS = int(os.environ.get("SCORE_BATCH_MAX_ITEMS", "5000"))
+SCORE_BATCH_CHUNK = int(os.environ.get("SCORE_BATCH_CHUNK", "32"))
+SCORE_BATCH_WINDOW = int(os.environ.get("SCORE_BATCH_WINDOW", "512"))
+
+class ScoreBatchReq(BaseModel):
+    texts: List[str]
+    stream: bool = True
+
+def _runtime_score_many(rt, texts: List[str]) -> List[float]:
+    """runtime 若提供 score_texts（批次）就用；否則逐筆 score_text。"""
+    if hasattr(rt, "score_texts") and callable(rt.score_texts):
+        return [float(x) for x in rt.score_texts(texts)]
+    return [float(rt.score_text(t)) for t in texts]
+
+def _iter_batch_scores(rt, texts: List[str]):
+    # 無 tokenizer 可用 -> 以字元長度近似 token 長度分桶；視窗內依原順序輸出
+    for win in iter_windows(len(texts), SCORE_BATCH_WINDOW):
+        part = [texts[i] for i in win]
+        scores = [0.0] * len(part)
+        for bucket in iter_length_buckets([len(t or "") for t in part], SCORE_BATCH_CHUNK):
+            for j, v in zip(bucket, _runtime_score_many(rt, [part[j] for j in bucket])):
+                scores[j] = v
+        for j, v in enumerate(scores):
+            yield win.start + j, v
+
+@app.post("/score/batch")
+def score_batch(req: ScoreBatchReq):
+    if not _transformer_ready():
+        raise HTTPException(status_code=503, detail="模型未載入")
+    if len(req.texts) > SCORE_BATCH_MAX_ITEMS:
+        raise HTTPException(status_code=413, detail=f"批次上限 {SCORE_BATCH_MAX_ITEMS} 筆")
+    if any(t is not None and len(t) > 8000 for t in req.texts):
+        raise HTTPException(status_code=422, detail="單筆文本上限 8000 字符")
+    try:
+        from src.models import runtime as rt
+        if not hasattr(rt, "score_text") or not callable(rt.score_text):
+            raise HTTPException(status_code=500, detail="runtime.score_text 不可用")
+        if not req.stream:
+            return {"n": len(req.texts), "scores": [v for _, v in _iter_batch_scores(rt, req.texts)]}
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"評分失敗: {e}")
+
+    def _gen():
+        # 串流中途失敗時狀態碼已送出，改以最後一行 {"error": ...} 告知呼叫端結果不完整
+        try:
+            for i, v in _iter_batch_scores(rt, req.texts):
+                yield json.dumps({"i": i, "score": v}) + "\n"
+        except Exception as e:
+            yield json.dumps({"error": f"評分失敗: {e}"}, ensure_ascii=False) + "\n"
+    return StreamingResponse(_gen(), media_type="application/x-ndjson")
+
 # ---------- /index/{date} ----------
 class IndexItem(BaseModel):
     news_id: Any
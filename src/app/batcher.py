@@ -0,0 +1,120 @@
+# -*- coding: utf-8 -*-
+"""動態微批次（micro-batching）推論引擎
+- 併發請求先進佇列，背景執行緒最多等待 max_wait_ms 或湊滿 max_batch 筆後，一次 padded forward。
+- 每個呼叫者拿回自己的分數（Future）；例外會原樣拋回給該批所有呼叫者（Strict：不回退）。
+  scorer 回傳筆數與批次不符時整批視為錯誤，不會有呼叫者永遠等不到結果。
+- 內建指標：請求數、批次數、平均批量、佇列等待與端到端延遲 p50/p99，供 CPU-only 主機調參。
+用法：
+    b = MicroBatcher(score_fn, max_batch=16, max_wait_ms=5)
+    val = b.submit("台積電上修資本支出")
+"""
+import threading, time, queue
+from collections import deque
+from concurrent.futures import Future
+from typing import Callable, List, Optional
+
+class MicroBatcher:
+    def __init__(self, fn: Callable[[List[str]], List[float]], max_batch: int = 16,
+                 max_wait_ms: float = 5.0, max_queue: int = 1024, window: int = 2048):
+        self.fn = fn
+        self.max_batch = max(int(max_batch), 1)
+        self.max_wait_ms = max(float(max_wait_ms), 0.0)
+        self._q: "queue.Queue" = queue.Queue(maxsize=max(int(max_queue), 1))
+        self._lock = threading.Lock()
+        self._lat_ms = deque(maxlen=window)
+        self._wait_ms = deque(maxlen=window)
+        self._sizes = deque(maxlen=window)
+        self._n_requests = 0
+        self._n_batches = 0
+        self._n_errors = 0
+        self._started_at = time.time()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._loop, name="score-microbatch", daemon=True)
+        self._thread.start()
+
+    # ---------------- 呼叫端 ----------------
+    def submit(self, text: str, timeout: Optional[float] = None) -> float:
+        """送出單筆文本並阻塞等待分數；佇列滿時拋 queue.Full（避免記憶體暴增）。"""
+        fut: Future = Future()
+        self._q.put((text, fut, time.perf_counter()), block=False)
+        return fut.result(timeout=timeout)
+
+    def close(self):
+        self._stop.set()
+        self._thread.join(timeout=1.0)
+
+    # ---------------- 背景批次迴圈 ----------------
+    def _collect(self):
+        try:
+            first = self._q.get(timeout=0.1)
+        except queue.Empty:
+            return []
+        batch = [first]
+        deadline = time.perf_counter() + self.max_wait_ms / 1000.0
+        while len(batch) < self.max_batch:
+            remain = deadline - time.perf_counter()
+            if remain <= 0:
+                break
+            try:
+                batch.append(self._q.get(timeout=remain))
+            except queue.Empty:
+                break
+        return batch
+
+    def _loop(self):
+        while not self._stop.is_set():
+            batch = self._collect()
+            if not batch:
+                continue
+            t0 = time.perf_counter()
+            texts = [b[0] for b in batch]
+            try:
+                scores = list(self.fn(texts))
+                if len(scores) != len(batch):
+                    raise RuntimeError(f"scorer 回傳 {len(scores)} 筆分數，但批次有 {len(batch)} 筆請求")
+                for (_, fut, _), s in zip(batch, scores):
+                    fut.set_result(s)
+                err = False
+            except Exception as e:
+                for _, fut, _ in batch:
+                    if not fut.done():
+                        fut.set_exception(e)
+                err = True
+            t1 = time.perf_counter()
+            with self._lock:
+                self._n_batches += 1
+                self._n_requests += len(batch)
+                self._n_errors += int(err)
+                self._sizes.append(len(batch))
+                for _, _, ts in batch:
+                    self._wait_ms.append((t0 - ts) * 1000.0)
+                    self._lat_ms.append((t1 - ts) * 1000.0)
+
+    # ---------------- 指標 ----------------
+    @staticmethod
+    def _pct(vals, p: float) -> Optional[float]:
+        if not vals:
+            return None
+        s = sorted(vals)
+        k = min(len(s) - 1, max(0, int(round(p * (len(s) - 1)))))
+        return round(s[k], 3)
+
+    def metrics(self) -> dict:
+        with self._lock:
+            lat = list(self._lat_ms); wait = list(self._wait_ms); sizes = list(self._sizes)
+            n_req, n_bat, n_err = self._n_requests, self._n_batches, self._n_errors
+        elapsed = max(time.time() - self._started_at, 1e-9)
+        return {
+            "max_batch": self.max_batch,
+            "max_wait_ms": self.max_wait_ms,
+            "queue_depth": self._q.qsize(),
+            "requests": n_req,
+            "batches": n_bat,
+            "errors": n_err,
+            "avg_batch_size": round(sum(sizes) / len(sizes), 3) if sizes else None,
+            "rps": round(n_req / elapsed, 3),
+            "queue_wait_ms_p50": self._pct(wait, 0.50),
+            "queue_wait_ms_p99": self._pct(wait, 0.99),
+            "latency_ms_p50": self._pct(lat, 0.50),
+            "latency_ms_p99": self._pct(lat, 0.99),
+        }
@@ -8,8 +8,9 @@ from src.app.model_registry import load_transformer
 def main():
     ap = argparse.ArgumentParser()
     ap.add_argument("--model_dir", type=str, default=None)
+    ap.add_argument("--backend", choices=["torch","int8","onnx","onnx-int8"], default=None)
     args = ap.parse_args()
-    path = load_transformer(args.model_dir)
+    path = load_transformer(args.model_dir, args.backend)
     print("模型已載入：", path)
 
 if __name__ == "__main__":
@@ -4,19 +4,27 @@
 - 只允許 Transformer 推論；若模型未載入 -> 直接 503。
 - 新增 Signals 查詢端點（entity/industry/market），欄位含 weighted_mean、surprise_src7。
 - 內建防護：CPU-only、批量查詢、DB 連線重試、超時、硬性輸入長度上限避免 OOM。
+- /score/batch：多筆文本依 token 長度分桶、分塊 forward，NDJSON 串流依原順序回傳。
+- 分數快取：模型版本 + 正規化文本雜湊（SCORE_CACHE_SIZE / SCORE_CACHE_DB），命中率見 /metrics/cache。
+- /score 走動態微批次（SCORE_MAX_BATCH / SCORE_MAX_WAIT_MS），指標見 /metrics/batcher。
 - 任何例外皆不做回退（Strict 原則）。
 """
 from fastapi import FastAPI, HTTPException, Body, Query
-from fastapi.responses import JSONResponse
+from fastapi.responses import JSONResponse, StreamingResponse
 from pydantic import BaseModel, Field
 from typing import Optional, List, Literal
-import os, time, math
+import os, time, math, queue, json
+from concurrent.futures import TimeoutError as FutureTimeout
 import torch
-from transformers import AutoTokenizer, AutoModelForSequenceClassification
 from sqlalchemy import create_engine, text
 from sqlalchemy.engine import Engine
 from sqlalchemy.exc import SQLAlchemyError
-from src.config import DB_URL
+from src.config import DB_URL, INFER_BACKEND
+from src.models.backend import load_classifier
+from src.models import score_cache
+from src.models.score_cache import ScoreCache
+from src.app.batcher import MicroBatcher
+from src.models.length_bucket import iter_length_buckets, iter_windows
 
 app = FastAPI(title="FinNews Strict API", version="1.0.0 (strict)")
 
@@ -29,20 +37,22 @@ _tokenizer = None
 _model = None
 _model_loaded = False
 _load_error: Optional[str] = None
+_cache: Optional[ScoreCache] = None  # 內容雜湊快取（key 含模型版本，重新載入即換新）
 
 def _load_model_strict():
-    global _tokenizer, _model, _model_loaded, _load_error
+    global _tokenizer, _model, _model_loaded, _load_error, _cache
     try:
         name = MODEL_DIR if MODEL_DIR else MODEL_NAME
-        _tokenizer = AutoTokenizer.from_pretrained(name)
-        _model = AutoModelForSequenceClassification.from_pretrained(name)
+        _tokenizer, _model = load_classifier(name, INFER_BACKEND)
         _model.to(DEVICE)
         _model.eval()
+        _cache = score_cache.from_env(name, INFER_BACKEND)
         _model_loaded = True
         _load_error = None
     except Exception as e:
         _tokenizer = None
         _model = None
+        _cache = None
         _model_loaded = False
         _load_error = f"{type(e).__name__}: {e}"
 
@@ -75,39 +85,87 @@ class ScoreOut(BaseModel):
     score: float
     model: str
 
-def _strict_score(text: str) -> float:
-    # 未載入 -> 503（嚴格）
-    if not _model_loaded or _tokenizer is None or _model is None:
-        raise HTTPException(status_code=503, detail="模型未載入（Strict）")
-    # 輸入清洗 & 長度限制
-    if not text or not text.strip():
-        return 0.0
-    tokens = _tokenizer(
-        text.strip(),
-        truncation=True,
-        max_length=512,
-        padding=False,
-        return_tensors="pt"
-    )
-    with torch.no_grad():
-        logits = _model(**{k: v.to(DEVICE) for k, v in tokens.items()}).logits
+def _logits_to_scores(logits) -> List[float]:
     # 通用：若是二分類，取第2維；若單一回歸，直接用
     if logits.shape[-1] == 1:
-        val = float(torch.tanh(logits.squeeze()).item())
         # tanh 將值壓到 [-1, 1]
-        return val
+        return [float(v) for v in torch.tanh(logits[:, 0]).tolist()]
     elif logits.shape[-1] == 2:
         # 二分類 -> positive 機率再映射到 [-1,1]
-        prob_pos = float(torch.softmax(logits, dim=-1)[0, 1].item())
-        return 2.0 * prob_pos - 1.0
+        prob_pos = torch.softmax(logits, dim=-1)[:, 1].tolist()
+        return [2.0 * float(p) - 1.0 for p in prob_pos]
     else:
         # 多分類：以極性軸近似（最後一類視為正向）
-        probs = torch.softmax(logits, dim=-1)[0].tolist()
-        idx = int(torch.argmax(logits, dim=-1).item())
+        n_cls = logits.shape[-1]
+        idx = torch.argmax(logits, dim=-1).tolist()
         # 線性映射到 [-1,1]：0 -> -1, last -> +1
-        if len(probs) <= 1:
-            return 0.0
-        return -1.0 + 2.0 * (idx / (len(probs) - 1))
+        return [-1.0 + 2.0 * (int(i) / (n_cls - 1)) for i in idx]
+
+def _strict_score_batch(texts: List[str], encoded: Optional[List[dict]] = None) -> List[float]:
+    """一次 padded forward pass；空字串直接 0.0，不進模型。
+    encoded：與 texts 對齊、已截斷未補齊的編碼（/score/batch 分桶時算過），有給就直接 pad，不重新斷詞。"""
+    # 未載入 -> 503（嚴格）
+    if not _model_loaded or _tokenizer is None or _model is None:
+        raise HTTPException(status_code=503, detail="模型未載入（Strict）")
+    out = [0.0] * len(texts)
+    # 輸入清洗 & 長度限制
+    idx = [i for i, t in enumerate(texts) if t and t.strip()]
+    if not idx:
+        return out
+    clean = [texts[i].strip() for i in idx]
+    cache = _cache
+    rows = cache.get_many(clean, ns="512") if cache is not None else [None] * len(clean)
+    miss = [j for j, r in enumerate(rows) if r is None]
+    if miss:
+        if encoded is not None:
+            tokens = _tokenizer.pad([encoded[idx[j]] for j in miss], padding=True, return_tensors="pt")
+        else:
+            tokens = _tokenizer(
+                [clean[j] for j in miss],
+                truncation=True,
+                max_length=512,
+                padding=True,
+                return_tensors="pt"
+            )
+        with torch.no_grad():
+            logits = _model(**{k: v.to(DEVICE) for k, v in tokens.items()}).logits
+        fresh = logits.float().cpu().tolist()
+        for j, r in zip(miss, fresh):
+            rows[j] = r
+        if cache is not None:
+            cache.put_many([clean[j] for j in miss], fresh, ns="512")
+    for i, v in zip(idx, _logits_to_scores(torch.tensor(rows))):
+        out[i] = v
+    return out
+
+def _strict_score(text: str) -> float:
+    return _strict_score_batch([text])[0]
+
+# ---------------------- Micro-batching ----------------------
+# 併發 /score 請求合併成一次 forward；SCORE_MICROBATCH=0 可關閉（每請求各自推論）
+MICROBATCH = os.getenv("SCORE_MICROBATCH", "1") == "1"
+MAX_BATCH = int(os.getenv("SCORE_MAX_BATCH", "16"))
+MAX_WAIT_MS = float(os.getenv("SCORE_MAX_WAIT_MS", "5"))
+MAX_QUEUE = int(os.getenv("SCORE_MAX_QUEUE", "1024"))
+SCORE_TIMEOUT_S = float(os.getenv("SCORE_TIMEOUT_S", "30"))
+
+_batcher: Optional[MicroBatcher] = (
+    MicroBatcher(_strict_score_batch, max_batch=MAX_BATCH, max_wait_ms=MAX_WAIT_MS, max_queue=MAX_QUEUE)
+    if MICROBATCH else None
+)
+
+def _score_one(text: str) -> float:
+    if _batcher is None:
+        return _strict_score(text)
+    # 未載入就不排隊，直接 503
+    if not _model_loaded:
+        raise HTTPException(status_code=503, detail="模型未載入（Strict）")
+    try:
+        return _batcher.submit(text, timeout=SCORE_TIMEOUT_S)
+    except queue.Full:
+        raise HTTPException(status_code=503, detail="評分佇列已滿，請稍後重試")
+    except FutureTimeout:
+        raise HTTPException(status_code=504, detail="評分逾時")
 
 @app.get("/health")
 def health():
@@ -116,14 +174,79 @@ def health():
         "strict": True,
         "model_loaded": _model_loaded,
         "model": (MODEL_DIR or MODEL_NAME) if _model_loaded else None,
+        "backend": INFER_BACKEND,
         "load_error": _load_error
     }
 
 @app.post("/score", response_model=ScoreOut)
 def score(payload: ScoreIn):
-    val = _strict_score(payload.text)
+    val = _score_one(payload.text)
     return ScoreOut(score=val, model=(MODEL_DIR or MODEL_NAME))
 
+# ---------------------- Batch Scoring ----------------------
+BATCH_MAX_ITEMS = int(os.getenv("SCORE_BATCH_MAX_ITEMS", "5000"))
+BATCH_CHUNK = int(os.getenv("SCORE_BATCH_CHUNK", "32"))
+BATCH_WINDOW = int(os.getenv("SCORE_BATCH_WINDOW", "512"))
+
+class ScoreBatchIn(BaseModel):
+    texts: List[str] = Field(..., description=f"要評分的文本清單（上限 {BATCH_MAX_ITEMS} 筆，每筆 8000 字符）")
+    stream: bool = Field(True, description="True：NDJSON 串流（依原順序逐行輸出）；False：一次回 JSON")
+
+def _encode(texts: List[str]) -> List[dict]:
+    """截斷、不補齊的逐筆編碼；長度用來分桶，同一份再交給 _strict_score_batch pad 後推論。"""
+    enc = _tokenizer([t.strip() if t else "" for t in texts], truncation=True, max_length=512, padding=False)
+    keys = list(enc.keys())
+    return [{k: enc[k][i] for k in keys} for i in range(len(texts))]
+
+def _iter_batch_scores(texts: List[str]):
+    """視窗內依 token 長度分桶 → 分塊 forward → 以原順序 yield (index, score)。"""
+    for win in iter_windows(len(texts), BATCH_WINDOW):
+        part = [texts[i] for i in win]
+        encoded = _encode(part)
+        scores = [0.0] * len(part)
+        for bucket in iter_length_buckets([len(e["input_ids"]) for e in encoded], BATCH_CHUNK):
+            vals = _strict_score_batch([part[j] for j in bucket], [encoded[j] for j in bucket])
+            for j, v in zip(bucket, vals):
+                scores[j] = v
+        for j, v in enumerate(scores):
+            yield win.start + j, v
+
+@app.post("/score/batch")
+def score_batch(payload: ScoreBatchIn):
+    if not _model_loaded or _tokenizer is None or _model is None:
+        raise HTTPException(status_code=503, detail="模型未載入（Strict）")
+    if len(payload.texts) > BATCH_MAX_ITEMS:
+        raise HTTPException(status_code=413, detail=f"批次上限 {BATCH_MAX_ITEMS} 筆")
+    if any(t is not None and len(t) > 8000 for t in payload.texts):
+        raise HTTPException(status_code=422, detail="單筆文本上限 8000 字符")
+    model_name = MODEL_DIR or MODEL_NAME
+    if not payload.stream:
+        scores = [v for _, v in _iter_batch_scores(payload.texts)]
+        return {"model": model_name, "n": len(scores), "scores": scores}
+
+    def _gen():
+        # 串流中途失敗時狀態碼已送出，改以最後一行 {"error": ...} 告知呼叫端結果不完整（Strict：不回退）
+        try:
+            for i, v in _iter_batch_scores(payload.texts):
+                yield json.dumps({"i": i, "score": v}) + "\n"
+        except HTTPException as e:
+            yield json.dumps({"error": str(e.detail)}, ensure_ascii=False) + "\n"
+        except Exception as e:
+            yield json.dumps({"error": f"{type(e).__name__}: {e}"}, ensure_ascii=False) + "\n"
+    return StreamingResponse(_gen(), media_type="application/x-ndjson", headers={"X-Model": model_name})
+
+@app.get("/metrics/cache", tags=["admin"])
+def cache_metrics():
+    if _cache is None:
+        return {"enabled": False}
+    return {"enabled": True, **_cache.stats()}
+
+@app.get("/metrics/batcher", tags=["admin"])
+def batcher_metrics():
+    if _batcher is None:
+        return {"enabled": False}
+    return {"enabled": True, **_batcher.metrics()}
+
 # ---------------------- Signals Endpoints ----------------------
 def _query_signals(kind: Literal["entity","industry","market"], key: Optional[str], start: Optional[str], end: Optional[str], limit: int = 5000):
     if kind in ("entity","industry") and not key:
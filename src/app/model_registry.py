@@ -1,25 +1,28 @@
 import os
 from typing import Optional
-from transformers import AutoTokenizer, AutoModelForSequenceClassification
 import threading
+from src.config import INFER_BACKEND
+from src.models.backend import load_classifier
+from src.models import score_cache
 
 # Singleton-like registry
 _LOCK = threading.Lock()
 _TOKENIZER = None
 _MODEL = None
 _MODEL_DIR = None
+_CACHE = None
 
-def load_transformer(model_dir: Optional[str] = None):
-    """Load transformer model/tokenizer from a directory. No fallback allowed."""
-    global _TOKENIZER, _MODEL, _MODEL_DIR
+def load_transformer(model_dir: Optional[str] = None, backend: Optional[str] = None):
+    """Load transformer model/tokenizer from a directory. No fallback allowed.
+    backend: torch | int8 | onnx | onnx-int8（None 則取 INFER_BACKEND）。"""
+    global _TOKENIZER, _MODEL, _MODEL_DIR, _CACHE
     with _LOCK:
         if model_dir is None:
             model_dir = os.getenv("MODEL_DIR", "models/bert_sentence_cls")
         if not os.path.isdir(model_dir):
             raise FileNotFoundError(f"模型目錄不存在：{model_dir}")
-        _TOKENIZER = AutoTokenizer.from_pretrained(model_dir)
-        _MODEL = AutoModelForSequenceClassification.from_pretrained(model_dir)
-        _MODEL.eval()
+        _TOKENIZER, _MODEL = load_classifier(model_dir, backend)
+        _CACHE = score_cache.from_env(model_dir, backend or INFER_BACKEND)
         _MODEL_DIR = model_dir
         return _MODEL_DIR
 
@@ -31,13 +34,22 @@ def predict(text: str, max_length: int = 128):
     if not is_loaded():
         raise RuntimeError("Transformer 模型尚未載入")
     import torch
-    inputs = _TOKENIZER(text, return_tensors="pt", truncation=True, max_length=max_length)
-    with torch.no_grad():
-        out = _MODEL(**inputs)
-        probs = torch.softmax(out.logits, dim=-1).squeeze(0).tolist()
-        pred = int(torch.argmax(out.logits, dim=-1).item())
+    cache = _CACHE
+    logits = cache.get(text, ns=str(max_length)) if cache is not None else None
+    if logits is None:
+        inputs = _TOKENIZER(text, return_tensors="pt", truncation=True, max_length=max_length)
+        with torch.no_grad():
+            logits = _MODEL(**inputs).logits.squeeze(0).float().tolist()
+        if cache is not None:
+            cache.put(text, logits, ns=str(max_length))
+    t = torch.tensor(logits)
+    probs = torch.softmax(t, dim=-1).tolist()
+    pred = int(torch.argmax(t).item())
     id2label = {0:"neg", 1:"neu", 2:"pos"}
     return {"pred": id2label[pred], "probs": {"neg": probs[0], "neu": probs[1], "pos": probs[2]}}
 
 def get_model_dir() -> Optional[str]:
     return _MODEL_DIR
+
+def cache_stats() -> Optional[dict]:
+    return _CACHE.stats() if _CACHE is not None else None
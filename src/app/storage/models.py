@@ -20,3 +20,13 @@ class Price(Base):
     code = Column(Unicode(16))
     date = Column(DateTime)
     close = Column(Float)
+
+class FeedState(Base):
+    """RSS 條件式 GET 狀態：上次的 ETag / Last-Modified 與抓取結果。"""
+    __tablename__ = "rss_feed_state"
+    url = Column(Unicode(512), primary_key=True)
+    etag = Column(Unicode(256))
+    last_modified = Column(Unicode(64))
+    last_status = Column(Integer)
+    fail_count = Column(Integer, default=0)
+    last_fetched_at = Column(DateTime)
@@ -6,6 +6,9 @@ Step 6：align_and_backtest 熱修補 v5（完整檔）
 - Keyset pagination（主鍵遞增）避免 SQL Server TOP+OFFSET 限制
 - 價格表支援 schema 與欄位自訂（以中括號安全包裹）
 - 保留 CPU-only / 分批 / 節流；對齊（T/T+1）、IC/RankIC、命中率、事件研究
+- 對齊預設走 set-based SQL（news_entity_ticker + SQL 內 T/T+1），--align json 可切回逐筆展開
+- 價格（年度分區）與對齊後訊號（fold 分區）快取為 out/cache 下的 Arrow 檔，依 MAX(id)/MAX(date)/COUNT 與內容 checksum 判斷是否過期
+- IC/RankIC/命中率走面板引擎（src/backtest/panel.py）：日期 × 股票矩陣 + NumPy 逐列歸約
 
 使用（若你的欄位名不同，可帶參數覆寫）:
 python -m src.backtest.align_and_backtest --start 2024-01-01 --end 2025-09-08 \
@@ -17,9 +20,12 @@ python -m src.backtest.align_and_backtest --start 2024-01-01 --end 2025-09-08 \
 import argparse, json, math, os, time, datetime, re
 from typing import List, Tuple, Optional
 import pandas as pd
-from sqlalchemy import create_engine, text
+from sqlalchemy import text
 from sqlalchemy.engine import Engine
 from src.config import DB_URL
+from src.backtest import panel
+from src.backtest.cache import ColumnarCache, DEFAULT_DIR as DEFAULT_CACHE_DIR
+from src.utils.bulk_upsert import make_engine
 # --- Safe DB numeric conversion: NaN/Inf -> None (SQL NULL) ---
 import math as _math
 def _to_db_float(x):
@@ -72,7 +78,7 @@ def _quote_column(col: str) -> str:
 
 def _make_engine() -> Engine:
     # 保持連線健康、限制連線池大小避免過多併發（防止機器溫度飆高 → 閃退）
-    return create_engine(DB_URL, pool_pre_ping=True, pool_size=4, max_overflow=4, future=True)
+    return make_engine(DB_URL, pool_pre_ping=True, pool_size=4, max_overflow=4)
 
 # ---------------- 基礎表（若無則建） ----------------
 def _ensure_tables(engine: Engine):
@@ -117,6 +123,10 @@ BEGIN
         created_at DATETIME2 NOT NULL DEFAULT SYSUTCDATETIME()
     );
 END
+IF COL_LENGTH('bt_event_study', 'fold') IS NULL
+    ALTER TABLE bt_event_study ADD fold NVARCHAR(32) NULL, year INT NULL;
+IF COL_LENGTH('bt_event_study', 'pct') IS NULL
+    ALTER TABLE bt_event_study ADD pct FLOAT NULL;
 IF OBJECT_ID('bt_params','U') IS NULL
 BEGIN
     CREATE TABLE bt_params (
@@ -179,6 +189,94 @@ def _t_or_t1(ts: datetime.datetime, cutoff_h: int, cutoff_m: int) -> datetime.da
         return local_date
 
 # ---------------- 迭代載入訊號（keyset） ----------------
+def _detect_sig_cols(conn, sig_table: str, sig_id_col: Optional[str], sig_time_col: Optional[str], sig_score_col: Optional[str]):
+    raw_table, raw_fk = _detect_news_table(conn)
+    if sig_id_col is None:
+        sig_id_col = _detect_first_existing_col(conn, sig_table, ["news_id","id","doc_id"])
+    if sig_time_col is None:
+        sig_time_col = _detect_first_existing_col(conn, sig_table, ["created_at","created","ts","timestamp","published_at"])
+    if sig_score_col is None:
+        sig_score_col = _detect_first_existing_col(conn, sig_table, ["doc_score","score","sent_score","sentiment"])
+    if not all([sig_id_col, sig_time_col, sig_score_col]):
+        raise RuntimeError(f"{sig_table} 無法偵測到必要欄位（id/time/score）；可用 --sig-id-col/--sig-time-col/--sig-score-col 覆寫。")
+    return raw_table, raw_fk, sig_id_col, sig_time_col, sig_score_col
+
+def _has_ticker_table(engine: Engine) -> bool:
+    with engine.begin() as conn:
+        try:
+            conn.execute(text("SELECT TOP 1 1 FROM news_entity_ticker"))
+            return True
+        except Exception:
+            return False
+
+def _iter_aligned_rows_sql(engine: Engine, start: str, end: str, cutoff: str, chunk_size: int, throttle_ms: int,
+                           sig_table: str, sig_id_col: Optional[str], sig_time_col: Optional[str], sig_score_col: Optional[str]):
+    """Set-based 對齊：JOIN 正規化的 news_entity_ticker，T/T+1 在 SQL 內以 CAST(ts AS TIME) 判斷；
+    以訊號主鍵 keyset 分頁（先定本頁主鍵上界，整篇的所有 ticker 一起取），產出 (ticker, ds, doc_score)。"""
+    with engine.begin() as conn:
+        raw_table, raw_fk, sig_id_col, sig_time_col, sig_score_col = _detect_sig_cols(
+            conn, sig_table, sig_id_col, sig_time_col, sig_score_col)
+    q_id, q_time, q_score = _quote_column(sig_id_col), _quote_column(sig_time_col), _quote_column(sig_score_col)
+    where = f"d.{q_time} >= :s AND d.{q_time} < :e AND d.{q_id} > :last_id"
+    page_sql = text(f"""
+        SELECT MAX(x.sig_id) FROM (
+            SELECT TOP (:n) d.{q_id} AS sig_id FROM {sig_table} d
+            WHERE {where} ORDER BY d.{q_id} ASC
+        ) x
+    """)
+    rows_sql = text(f"""
+        SELECT t.ticker,
+               CASE WHEN CAST(s.ts AS TIME) >= CAST(:cut AS TIME)
+                    THEN DATEADD(day, 1, CAST(s.ts AS DATE)) ELSE CAST(s.ts AS DATE) END AS ds,
+               s.doc_score
+        FROM (
+            SELECT d.{q_id} AS sig_id, COALESCE(r.published_at, d.{q_time}) AS ts, d.{q_score} AS doc_score
+            FROM {sig_table} d
+            LEFT JOIN {raw_table} r ON r.{raw_fk} = d.{q_id}
+            WHERE {where} AND d.{q_id} <= :hi
+        ) s
+        JOIN news_entity_ticker t ON t.news_id = s.sig_id
+    """)
+    params = {"s": pd.to_datetime(start), "e": pd.to_datetime(end) + pd.Timedelta(days=1),
+              "cut": f"{cutoff}:00", "n": int(chunk_size)}
+    last_id = 0
+    while True:
+        with engine.begin() as conn:
+            hi = conn.execute(page_sql, dict(params, last_id=last_id)).scalar()
+            if hi is None:
+                break
+            rows = conn.execute(rows_sql, dict(params, last_id=last_id, hi=int(hi))).fetchall()
+        last_id = int(hi)
+        if rows:
+            df = pd.DataFrame(rows, columns=["ticker", "ds", "doc_score"])
+            df["ds"] = pd.to_datetime(df["ds"]).dt.date
+            yield df.astype({"ticker": str})
+        if throttle_ms > 0:
+            time.sleep(throttle_ms/1000.0)
+
+def _load_aligned_signals(engine: Engine, start: str, end: str, cutoff: str, chunk_size: int, throttle_ms: int,
+                          min_docs: int, align: str = "sql", **sig_kw) -> pd.DataFrame:
+    """回傳 (ticker, ds, n_docs, mean_score)。align='sql' 且有 news_entity_ticker 時走 set-based 路徑，
+    跨頁累積後才聚合（區間內沒有資料就回空表，不再重掃）；只有缺 news_entity_ticker 時才回退
+    matched_json 逐筆展開的舊路徑。"""
+    empty = pd.DataFrame(columns=["ticker", "ds", "n_docs", "mean_score"])
+    if align == "sql" and _has_ticker_table(engine):
+        pages = list(_iter_aligned_rows_sql(engine, start, end, cutoff, chunk_size, throttle_ms,
+                                            sig_kw["sig_table"], sig_kw.get("sig_id_col"),
+                                            sig_kw.get("sig_time_col"), sig_kw.get("sig_score_col")))
+        if not pages:
+            return empty
+        df = pd.concat(pages, ignore_index=True)
+        g = df.groupby(["ticker", "ds"], as_index=False).agg(n_docs=("doc_score", "size"),
+                                                            mean_score=("doc_score", "mean"))
+        return g[g["n_docs"] >= int(min_docs)].reset_index(drop=True)
+    elif align == "sql":
+        print("[INFO] 找不到 news_entity_ticker，回退 matched_json 展開（可先跑 entity_link --backfill-tickers）。")
+    chunks = list(_iter_aligned_signals(engine, start, end, cutoff, chunk_size, throttle_ms, min_docs, **sig_kw))
+    if not chunks:
+        return empty
+    return pd.concat(chunks, ignore_index=True).drop_duplicates(subset=['ticker','ds'])
+
 def _iter_aligned_signals(engine: Engine, start: str, end: str, cutoff: str,
                           chunk_size: int, throttle_ms: int, min_docs: int,
                           sig_table: str, sig_id_col: Optional[str], sig_time_col: Optional[str], sig_score_col: Optional[str],
@@ -188,15 +286,8 @@ def _iter_aligned_signals(engine: Engine, start: str, end: str, cutoff: str,
     e_dt = pd.to_datetime(end) + pd.Timedelta(days=1)
 
     with engine.begin() as conn:
-        raw_table, raw_fk = _detect_news_table(conn)
-        if sig_id_col is None:
-            sig_id_col = _detect_first_existing_col(conn, sig_table, ["news_id","id","doc_id"])
-        if sig_time_col is None:
-            sig_time_col = _detect_first_existing_col(conn, sig_table, ["created_at","created","ts","timestamp","published_at"])
-        if sig_score_col is None:
-            sig_score_col = _detect_first_existing_col(conn, sig_table, ["doc_score","score","sent_score","sentiment"])
-        if not all([sig_id_col, sig_time_col, sig_score_col]):
-            raise RuntimeError(f"{sig_table} 無法偵測到必要欄位（id/time/score）；可用 --sig-id-col/--sig-time-col/--sig-score-col 覆寫。")
+        raw_table, raw_fk, sig_id_col, sig_time_col, sig_score_col = _detect_sig_cols(
+            conn, sig_table, sig_id_col, sig_time_col, sig_score_col)
 
         if ent_fk_col is None:
             ent_fk_col = _detect_first_existing_col(conn, ent_table, ["news_id","id","doc_id"])
@@ -276,6 +367,57 @@ def _iter_aligned_signals(engine: Engine, start: str, end: str, cutoff: str,
             df = pd.DataFrame(rows, columns=["ticker","ds","n_docs","mean_score"]).astype({"ticker":str})
             yield df
 
+def _signal_fingerprint(engine: Engine, start: str, end: str, align: str, sig_table: str, sig_id_col: Optional[str],
+                        sig_time_col: Optional[str], sig_score_col: Optional[str], ent_table: str = "news_entity",
+                        ent_fk_col: Optional[str] = None, ent_json_col: Optional[str] = None, **_):
+    """訊號分區指紋：區間內 MAX(id) / COUNT(*) / MAX(time) / CHECKSUM_AGG(id, score, time)（原地改分數也會變）；
+    實體對照只看本區間的 news_id：sql 對齊取 news_entity_ticker 的列數與 CHECKSUM_AGG(news_id, ticker)
+    加 news_entity_linked 的 MAX(linked_at)（刪除後重插、列數不變的重連結也會變），json 對齊取 matched_json 的 checksum。"""
+    params = {"s": pd.to_datetime(start), "e": pd.to_datetime(end) + pd.Timedelta(days=1)}
+    use_ticker = align == "sql" and _has_ticker_table(engine)
+    with engine.begin() as conn:
+        _, _, sig_id_col, sig_time_col, sig_score_col = _detect_sig_cols(conn, sig_table, sig_id_col, sig_time_col, sig_score_col)
+        q_id, q_time, q_score = _quote_column(sig_id_col), _quote_column(sig_time_col), _quote_column(sig_score_col)
+        fold = f"SELECT d.{q_id} AS sig_id FROM {sig_table} d WHERE d.{q_time} >= :s AND d.{q_time} < :e"
+        row = conn.execute(text(f"""
+            SELECT MAX({q_id}), COUNT(*), MAX({q_time}), CHECKSUM_AGG(CHECKSUM({q_id}, {q_score}, {q_time}))
+            FROM {sig_table}
+            WHERE {q_time} >= :s AND {q_time} < :e
+        """), params).fetchone()
+        fp = [str(row[0]), int(row[1]), str(row[2]), str(row[3])]
+        if use_ticker:
+            row = conn.execute(text(f"""
+                SELECT COUNT(*), CHECKSUM_AGG(CHECKSUM(t.news_id, t.ticker))
+                FROM news_entity_ticker t JOIN ({fold}) f ON f.sig_id = t.news_id
+            """), params).fetchone()
+            fp += [int(row[0]), str(row[1])]
+            if conn.execute(text("SELECT OBJECT_ID('news_entity_linked','U')")).scalar() is not None:
+                fp.append(str(conn.execute(text(f"""
+                    SELECT MAX(l.linked_at) FROM news_entity_linked l JOIN ({fold}) f ON f.sig_id = l.news_id
+                """), params).scalar()))
+        else:
+            ent_fk_col = ent_fk_col or _detect_first_existing_col(conn, ent_table, ["news_id","id","doc_id"])
+            ent_json_col = ent_json_col or _detect_first_existing_col(conn, ent_table, ["matched_json","entities_json","matched","json"])
+            if ent_fk_col and ent_json_col:
+                q_fk, q_js = _quote_column(ent_fk_col), _quote_column(ent_json_col)
+                row = conn.execute(text(f"""
+                    SELECT COUNT(*), CHECKSUM_AGG(CHECKSUM(e.{q_fk}, e.{q_js}))
+                    FROM {ent_table} e JOIN ({fold}) f ON f.sig_id = e.{q_fk}
+                """), params).fetchone()
+                fp += [int(row[0]), str(row[1])]
+    return fp
+
+def _load_aligned_signals_cached(engine: Engine, cache: Optional[ColumnarCache], part: str, start: str, end: str,
+                                 cutoff: str, chunk_size: int, throttle_ms: int, min_docs: int,
+                                 align: str = "sql", **sig_kw) -> pd.DataFrame:
+    """對齊後訊號以 fold 為分區快取；key 含來源表/欄位、cutoff、min_docs、對齊方式與區間。"""
+    load = lambda: _load_aligned_signals(engine, start, end, cutoff, chunk_size, throttle_ms, min_docs, align=align, **sig_kw)
+    if cache is None:
+        return load()
+    params = dict(sig_kw, start=start, end=end, cutoff=cutoff, min_docs=int(min_docs), align=align)
+    fp = _signal_fingerprint(engine, start, end, align, **sig_kw)
+    return cache.get_or_load("signals", params, part, fp, load)
+
 # ---------------- 價格載入 ----------------
 def _find_price_candidates(engine: Engine):
     sql = text("""
@@ -301,7 +443,7 @@ def _find_price_candidates(engine: Engine):
     return cands
 
 def _load_prices(engine: Engine, price_table: str, ticker_col: str, date_col: str, price_col: str,
-                 start: str, end: str) -> pd.DataFrame:
+                 start: str, end: str, allow_empty: bool = False) -> pd.DataFrame:
     table_sql = _quote_ident(price_table)
     t_sql = _quote_column(ticker_col)
     d_sql = _quote_column(date_col)
@@ -322,11 +464,45 @@ def _load_prices(engine: Engine, price_table: str, ticker_col: str, date_col: st
                                f"可能的候選表（含欄位跡象）:\n" +
                                "\n".join([f"  - {nm}  (ticker:{sc['ticker']}, date:{sc['date']}, close:{sc['close']})" for nm, sc in cands]) +
                                f"\n{hint}")
-    if not rows:
+    if not rows and not allow_empty:
         raise RuntimeError(f"價格表 {price_table} 在 {start}~{end} 無資料；請確認參數或日期區間。")
     df = pd.DataFrame(rows, columns=["ticker","ds","px"]).astype({"ticker":str})
     return df
 
+def _price_fingerprint(engine: Engine, price_table: str, date_col: str, start: str, end: str):
+    d_sql = _quote_column(date_col)
+    with engine.begin() as conn:
+        row = conn.execute(text(f"""
+            SELECT MAX({d_sql}), COUNT(*) FROM {_quote_ident(price_table)} WHERE {d_sql} BETWEEN :s AND :e
+        """), {"s": start, "e": end}).fetchone()
+    return [str(row[0]), int(row[1])]
+
+def _load_prices_cached(engine: Engine, cache: Optional[ColumnarCache], price_table: str, ticker_col: str,
+                        date_col: str, price_col: str, start: str, end: str) -> pd.DataFrame:
+    """價格依年度分區快取（整年存、用時再切區間）；指紋 = 該年 MAX(date) + COUNT(*)。"""
+    if cache is None:
+        return _load_prices(engine, price_table, ticker_col, date_col, price_col, start, end)
+    params = {"table": price_table, "ticker_col": ticker_col, "date_col": date_col, "price_col": price_col}
+    s = pd.to_datetime(start).date()
+    e = pd.to_datetime(end).date()
+    frames = []
+    for y in range(s.year, e.year + 1):
+        ys, ye = f"{y}-01-01", f"{y}-12-31"
+        try:
+            fp = _price_fingerprint(engine, price_table, date_col, ys, ye)
+        except Exception:
+            # 表/欄位不對：交給 _load_prices 產生含候選表的錯誤訊息
+            return _load_prices(engine, price_table, ticker_col, date_col, price_col, start, end)
+        frames.append(cache.get_or_load("prices", params, f"year={y}", fp,
+                                        lambda ys=ys, ye=ye: _load_prices(engine, price_table, ticker_col, date_col,
+                                                                          price_col, ys, ye, allow_empty=True)))
+    df = pd.concat(frames, ignore_index=True)
+    ds = pd.to_datetime(df["ds"]).dt.date
+    df = df[(ds >= s) & (ds <= e)].reset_index(drop=True)
+    if df.empty:
+        raise RuntimeError(f"價格表 {price_table} 在 {start}~{end} 無資料；請確認參數或日期區間。")
+    return df.astype({"ticker": str})
+
 # ---------------- 統計計算 ----------------
 def _p_value_from_r(r: float, n: int) -> float:
     try:
@@ -343,7 +519,33 @@ def _p_value_from_r(r: float, n: int) -> float:
         p = 2.0 * (1.0 - 0.5*(1.0 + erf(abs(z)/math.sqrt(2))))
         return float(p)
 
-def _calc_daily_cs_metrics(sig_df: pd.DataFrame, px_df: pd.DataFrame, horizons: List[int]) -> pd.DataFrame:
+def _summarize_cs(h: int, tmp: pd.DataFrame) -> dict:
+    return {"horizon": h,
+            "ic": float(tmp["ic"].mean()),
+            "ic_p": _p_value_from_r(float(tmp["ic"].mean()), len(tmp)),
+            "ric": float(tmp["ric"].mean()),
+            "ric_p": _p_value_from_r(float(tmp["ric"].mean()), len(tmp)),
+            "hitrate": float(tmp["hit"].mean()),
+            "n_days": int(len(tmp)),
+            "n_pairs": int(tmp["n_pairs"].sum())}
+
+def _calc_daily_cs_metrics(sig_df: pd.DataFrame, px_df: pd.DataFrame, horizons: List[int],
+                           fwd_df: Optional[pd.DataFrame] = None) -> pd.DataFrame:
+    """面板版：價格前瞻報酬一次算完，逐日截面統計以矩陣運算完成（見 src/backtest/panel.py）。
+    fwd_df：已算好的前瞻報酬長表（多 fold 共用時傳入，不再重算）。"""
+    if sig_df.empty:
+        return pd.DataFrame()
+    fwd = fwd_df if fwd_df is not None else panel.forward_returns(px_df, horizons)
+    _, S, Rs = panel.to_panel(sig_df, fwd, horizons)
+    out_rows = []
+    for h in horizons:
+        tmp = panel.daily_cs_metrics(S, Rs[h])
+        if not tmp.empty:
+            out_rows.append(_summarize_cs(h, tmp))
+    return pd.DataFrame(out_rows)
+
+def _calc_daily_cs_metrics_legacy(sig_df: pd.DataFrame, px_df: pd.DataFrame, horizons: List[int]) -> pd.DataFrame:
+    """逐 ds 分組的原始版本（保留作為面板引擎的對照基準）。"""
     out_rows = []
     px_panel = px_df.sort_values(["ticker","ds"]).copy()
     for h in horizons:
@@ -362,21 +564,26 @@ def _calc_daily_cs_metrics(sig_df: pd.DataFrame, px_df: pd.DataFrame, horizons:
         if not daily:
             continue
         tmp = pd.DataFrame(daily, columns=["ds","ic","ric","hit","n_pairs"])
-        out_rows.append({"horizon": h,
-                         "ic": float(tmp["ic"].mean()),
-                         "ic_p": _p_value_from_r(float(tmp["ic"].mean()), len(tmp)),
-                         "ric": float(tmp["ric"].mean()),
-                         "ric_p": _p_value_from_r(float(tmp["ric"].mean()), len(tmp)),
-                         "hitrate": float(tmp["hit"].mean()),
-                         "n_days": int(len(tmp)),
-                         "n_pairs": int(tmp["n_pairs"].sum())})
+        out_rows.append(_summarize_cs(h, tmp))
     return pd.DataFrame(out_rows)
 
-def _event_study(sig_df: pd.DataFrame, px_df: pd.DataFrame, horizons: List[int], pct: float) -> pd.DataFrame:
+def _event_study(sig_df: pd.DataFrame, px_df: pd.DataFrame, horizons: List[int], pct,
+                 fwd_df: Optional[pd.DataFrame] = None, car_days: int = 0,
+                 market_ticker: Optional[str] = None) -> Tuple[pd.DataFrame, pd.DataFrame]:
+    """向量化事件研究（見 panel.event_study）：pct 可為單一分位或清單；回傳 (evt, car)。"""
+    pcts = [float(pct)] if isinstance(pct, (int, float)) else [float(p) for p in pct]
+    ks = list(range(1, int(car_days) + 1))
+    fwd = fwd_df if fwd_df is not None else panel.forward_returns(px_df, sorted(set(horizons) | set(ks)))
+    return panel.event_study(sig_df, fwd, horizons, pcts, car_days=car_days, market_ticker=market_ticker)
+
+def _event_study_legacy(sig_df: pd.DataFrame, px_df: pd.DataFrame, horizons: List[int], pct: float,
+                        fwd_df: Optional[pd.DataFrame] = None) -> pd.DataFrame:
+    """逐日 apply 的原始版本（保留作為向量化引擎的對照基準）。"""
     rows = []
-    px_panel = px_df.sort_values(["ticker","ds"]).copy()
+    px_panel = fwd_df if fwd_df is not None else px_df.sort_values(["ticker","ds"]).copy()
     for h in horizons:
-        px_panel[f"ret_fwd_{h}"] = px_panel.groupby("ticker")["px"].transform(lambda s: s.shift(-h) / s - 1.0)
+        if fwd_df is None:
+            px_panel[f"ret_fwd_{h}"] = px_panel.groupby("ticker")["px"].transform(lambda s: s.shift(-h) / s - 1.0)
         df = sig_df.merge(px_panel[["ticker","ds",f"ret_fwd_{h}"]], on=["ticker","ds"], how="left").dropna(subset=[f"ret_fwd_{h}"])
         if df.empty:
             continue
@@ -397,13 +604,64 @@ def _event_study(sig_df: pd.DataFrame, px_df: pd.DataFrame, horizons: List[int],
             rows.append({"side":"short","horizon":h,"mean_ret":float(r_short.mean()),"n_events":int(r_short.count())})
     return pd.DataFrame(rows)
 
+# ---------------- Fold 執行器 ----------------
+def _parse_folds(start: str, end: str, folds: Optional[str]) -> List[Tuple[str, int, str, str]]:
+    """預設為年度切片；folds="2024-01-01:2024-06-30,2024-07-01:2024-12-31" 可自訂區間。
+    回傳 [(label, year, st, en)]。"""
+    s = pd.to_datetime(start).date()
+    e = pd.to_datetime(end).date()
+    if folds:
+        out = []
+        for part in [p.strip() for p in folds.split(",") if p.strip()]:
+            a, b = [pd.to_datetime(x).date() for x in part.split(":")]
+            a, b = max(a, s), min(b, e)
+            if a <= b:
+                out.append((f"{a:%Y%m%d}_{b:%Y%m%d}", a.year, a.isoformat(), b.isoformat()))
+        return out
+    return [(f"Y{y}", y, max(datetime.date(y,1,1), s).isoformat(), min(datetime.date(y,12,31), e).isoformat())
+            for y in range(s.year, e.year + 1)]
+
+def _eval_fold(engine: Engine, fold, fwd_df: pd.DataFrame, cutoff: str, horizons: List[int], percentile,
+               chunk_size: int, throttle_ms: int, min_docs: int, car_days: int = 0,
+               market_ticker: Optional[str] = None, cache_dir: Optional[str] = None, **sig_kw):
+    """單一 fold：載入該區間對齊後的訊號 → IC/RankIC + 事件研究 → CSV；回傳結果列（由呼叫端整批寫 DB）。"""
+    label, y, st, en = fold
+    cache = ColumnarCache(cache_dir) if cache_dir else None
+    sig_ent = _load_aligned_signals_cached(engine, cache, label, st, en, cutoff, chunk_size, throttle_ms, min_docs, **sig_kw)
+    if sig_ent.empty:
+        print(f"[{label}] 無訊號資料。跳過。")
+        return label, y, [], []
+    met_ent = _calc_daily_cs_metrics(sig_ent, None, horizons, fwd_df=fwd_df)
+    evt_ent, car_ent = _event_study(sig_ent, None, horizons, percentile, fwd_df=fwd_df,
+                                    car_days=car_days, market_ticker=market_ticker)
+
+    outdir = "out/backtest"; os.makedirs(outdir, exist_ok=True)
+    if not met_ent.empty:  met_ent.to_csv(os.path.join(outdir, f"metrics_entity_{label}.csv"), index=False, encoding="utf-8-sig")
+    if not evt_ent.empty:  evt_ent.to_csv(os.path.join(outdir, f"events_entity_{label}.csv"),  index=False, encoding="utf-8-sig")
+    if not car_ent.empty:  car_ent.to_csv(os.path.join(outdir, f"car_entity_{label}.csv"),    index=False, encoding="utf-8-sig")
+    return label, y, met_ent.to_dict("records"), evt_ent.to_dict("records")
+
+def _fold_worker(job: dict):
+    # spawn 子程序：自建連線，前瞻報酬從共用面板（memmap）取該 fold 區間
+    job = dict(job)
+    meta = job.pop("panel_meta")
+    fold = job.pop("fold")
+    fwd_df = panel.load_shared(meta, fold[2], None)
+    engine = _make_engine()
+    try:
+        return _eval_fold(engine, fold, fwd_df, **job)
+    finally:
+        engine.dispose()
+
 # ---------------- 主流程 ----------------
 def run(start: str, end: str, cutoff: str, horizons: List[int],
         price_table: str, ticker_col: str, date_col: str, price_col: str,
         sig_table: str, sig_id_col: Optional[str], sig_time_col: Optional[str], sig_score_col: Optional[str],
         ent_table: str, ent_fk_col: Optional[str], ent_json_col: Optional[str],
-        market_ticker: Optional[str], percentile: float,
-        chunk_size: int, throttle_ms: int, min_docs: int):
+        market_ticker: Optional[str], percentile,
+        chunk_size: int, throttle_ms: int, min_docs: int,
+        folds: Optional[str] = None, workers: int = 1, align: str = "sql", car_days: int = 0,
+        cache_dir: Optional[str] = DEFAULT_CACHE_DIR):
     engine = _make_engine()
     _ensure_tables(engine)
     with engine.begin() as conn:
@@ -413,52 +671,63 @@ def run(start: str, end: str, cutoff: str, horizons: List[int],
             "sig_table": sig_table, "sig_id_col": sig_id_col, "sig_time_col": sig_time_col, "sig_score_col": sig_score_col,
             "ent_table": ent_table, "ent_fk_col": ent_fk_col, "ent_json_col": ent_json_col,
             "market_ticker": market_ticker, "percentile": percentile,
-            "chunk_size": chunk_size, "throttle_ms": throttle_ms, "min_docs": min_docs
+            "chunk_size": chunk_size, "throttle_ms": throttle_ms, "min_docs": min_docs,
+            "folds": folds, "align": align, "car_days": car_days
         }, ensure_ascii=False)})
 
-    px_df = _load_prices(engine, price_table, ticker_col, date_col, price_col, start, end)
-
-    s = pd.to_datetime(start).date()
-    e = pd.to_datetime(end).date()
-    years = range(s.year, e.year + 1)
-    for y in years:
-        st = max(datetime.date(y,1,1), s).isoformat()
-        en = min(datetime.date(y,12,31), e).isoformat()
-        label = f"Y{y}"
-        sig_chunks = list(_iter_aligned_signals(engine, st, en, cutoff, chunk_size, throttle_ms, min_docs,
-                                                sig_table, sig_id_col, sig_time_col, sig_score_col,
-                                                ent_table, ent_fk_col, ent_json_col))
-        if not sig_chunks:
-            print(f"[{label}] 無訊號資料。跳過。"); continue
-        sig_ent = pd.concat(sig_chunks, ignore_index=True).drop_duplicates(subset=['ticker','ds'])
-        met_ent = _calc_daily_cs_metrics(sig_ent, px_df, horizons)
-        evt_ent = _event_study(sig_ent, px_df, horizons, percentile)
-
-        outdir = "out/backtest"; os.makedirs(outdir, exist_ok=True)
-        if not met_ent.empty:  met_ent.to_csv(os.path.join(outdir, f"metrics_entity_{label}.csv"), index=False, encoding="utf-8-sig")
-        if not evt_ent.empty:  evt_ent.to_csv(os.path.join(outdir, f"events_entity_{label}.csv"),  index=False, encoding="utf-8-sig")
-        with engine.begin() as conn:
-            for _, r in met_ent.iterrows():
-                conn.execute(text("""
-                    INSERT INTO bt_signal_ic(kind, horizon, fold, year, ic, ic_p, ric, ric_p, hitrate, n_days, n_pairs)
-                    VALUES ('entity', :h, :f, :y, :ic, :icp, :ric, :ricp, :hit, :nd, :np)
-                """), {"h": int(r["horizon"]), "f": label, "y": y, "ic": _to_db_float(r["ic"]), "icp": _to_db_float(r["ic_p"]),
-                       "ric": _to_db_float(r["ric"]), "ricp": _to_db_float(r["ric_p"]), "hit": _to_db_float(r["hitrate"]),
-                       "nd": int(r["n_days"]), "np": int(r["n_pairs"])})
-            for _, r in evt_ent.iterrows():
-                conn.execute(text("""
-                    INSERT INTO bt_event_study(kind, side, horizon, mean_ret, n_events)
-                    VALUES ('entity', :s, :h, :m, :n)
-                """), {"s": r["side"], "h": int(r["horizon"]), "m": r["mean_ret"], "n": int(r["n_events"])})
+    cache = ColumnarCache(cache_dir) if cache_dir else None
+    px_df = _load_prices_cached(engine, cache, price_table, ticker_col, date_col, price_col, start, end)
+    # 所有 horizon 與 CAR 路徑（1..car_days）的前瞻報酬一次算完
+    fwd_df = panel.forward_returns(px_df, sorted(set(horizons) | set(range(1, int(car_days) + 1))))
+    del px_df
+
+    fold_list = _parse_folds(start, end, folds)
+    common = dict(cutoff=cutoff, horizons=horizons, percentile=percentile, car_days=car_days, market_ticker=market_ticker,
+                  cache_dir=cache_dir,
+                  chunk_size=chunk_size, throttle_ms=throttle_ms, min_docs=min_docs,
+                  sig_table=sig_table, sig_id_col=sig_id_col, sig_time_col=sig_time_col, sig_score_col=sig_score_col,
+                  ent_table=ent_table, ent_fk_col=ent_fk_col, ent_json_col=ent_json_col, align=align)
+    workers = max(1, min(int(workers), len(fold_list)))
+    if workers > 1:
+        import multiprocessing as mp, shutil, tempfile
+        tmpdir = tempfile.mkdtemp(prefix="bt_panel_")
+        try:
+            meta = panel.save_shared(fwd_df, [int(c.rsplit("_", 1)[1]) for c in fwd_df.columns if c.startswith("ret_fwd_")], tmpdir)
+            jobs = [dict(common, fold=f, panel_meta=meta) for f in fold_list]
+            ctx = mp.get_context("spawn")
+            with ctx.Pool(processes=workers) as pool:
+                results = pool.map(_fold_worker, jobs)
+        finally:
+            shutil.rmtree(tmpdir, ignore_errors=True)
+    else:
+        results = [_eval_fold(engine, f, fwd_df, **common) for f in fold_list]
+
+    ic_rows, evt_rows = [], []
+    for label, y, met, evt in results:
+        ic_rows += [{"h": int(r["horizon"]), "f": label, "y": y, "ic": _to_db_float(r["ic"]), "icp": _to_db_float(r["ic_p"]),
+                     "ric": _to_db_float(r["ric"]), "ricp": _to_db_float(r["ric_p"]), "hit": _to_db_float(r["hitrate"]),
+                     "nd": int(r["n_days"]), "np": int(r["n_pairs"])} for r in met]
+        evt_rows += [{"s": r["side"], "h": int(r["horizon"]), "m": _to_db_float(r["mean_ret"]), "n": int(r["n_events"]),
+                      "p": _to_db_float(r["pct"]), "f": label, "y": y} for r in evt]
+    # 各 fold 結果彙整後整批寫入（executemany；pyodbc 下為 fast_executemany）
+    with engine.begin() as conn:
+        if ic_rows:
+            conn.execute(text("""
+                INSERT INTO bt_signal_ic(kind, horizon, fold, year, ic, ic_p, ric, ric_p, hitrate, n_days, n_pairs)
+                VALUES ('entity', :h, :f, :y, :ic, :icp, :ric, :ricp, :hit, :nd, :np)
+            """), ic_rows)
+        if evt_rows:
+            conn.execute(text("""
+                INSERT INTO bt_event_study(kind, side, horizon, mean_ret, n_events, pct, fold, year)
+                VALUES ('entity', :s, :h, :m, :n, :p, :f, :y)
+            """), evt_rows)
 
     print("Step 6 完成。")
 
-if __name__ == "__main__":
-    ap = argparse.ArgumentParser()
+def add_source_args(ap: argparse.ArgumentParser):
+    """價格/訊號/實體來源、快取與執行相關參數（align_and_backtest 與 sweep 共用）。"""
     ap.add_argument("--start", type=str, required=True)
     ap.add_argument("--end", type=str, required=True)
-    ap.add_argument("--cutoff", type=str, default="13:30", help="收盤 HH:MM；收盤後算 T+1")
-    ap.add_argument("--horizons", type=str, default="1,5,10")
 
     # 價格表與欄位（支援 schema.table）
     ap.add_argument("--price-table", type=str, default="prices_daily")
@@ -478,16 +747,34 @@ if __name__ == "__main__":
     ap.add_argument("--ent-json-col", type=str, default=None)
 
     ap.add_argument("--market-ticker", type=str, default=None)
-    ap.add_argument("--percentile", type=float, default=0.95)
+    ap.add_argument("--cache-dir", type=str, default=DEFAULT_CACHE_DIR, help="價格/對齊訊號的 Arrow 快取目錄")
+    ap.add_argument("--no-cache", action="store_true", help="不讀寫本地快取，一律查 DB")
     ap.add_argument("--chunk-size", type=int, default=2000)
     ap.add_argument("--throttle-ms", type=int, default=0)
+    ap.add_argument("--folds", type=str, default=None, help="自訂區間 start:end，逗號分隔；預設年度切片")
+    ap.add_argument("--workers", type=int, default=1, help=">1 時以多程序平行評估各 fold（價格面板共用）")
+    ap.add_argument("--align", choices=["sql", "json"], default="sql",
+                    help="sql：JOIN news_entity_ticker 並在 SQL 內判斷 T/T+1；json：逐筆展開 matched_json（舊路徑）")
+
+def source_kwargs(args) -> dict:
+    return dict(price_table=args.price_table, ticker_col=args.ticker_col, date_col=args.date_col, price_col=args.price_col,
+                sig_table=args.sig_table, sig_id_col=args.sig_id_col, sig_time_col=args.sig_time_col, sig_score_col=args.sig_score_col,
+                ent_table=args.ent_table, ent_fk_col=args.ent_fk_col, ent_json_col=args.ent_json_col,
+                market_ticker=args.market_ticker, chunk_size=args.chunk_size, throttle_ms=args.throttle_ms,
+                folds=args.folds, workers=args.workers, align=args.align,
+                cache_dir=None if args.no_cache else args.cache_dir)
+
+if __name__ == "__main__":
+    ap = argparse.ArgumentParser()
+    add_source_args(ap)
+    ap.add_argument("--cutoff", type=str, default="13:30", help="收盤 HH:MM；收盤後算 T+1")
+    ap.add_argument("--horizons", type=str, default="1,5,10")
+    ap.add_argument("--percentile", type=str, default="0.95", help="事件研究分位，可逗號分隔多個，例如 0.9,0.95")
+    ap.add_argument("--car-days", type=int, default=0, help=">0 時另輸出 1..N 日累積異常報酬路徑（car_entity_*.csv）")
     ap.add_argument("--min-docs", type=int, default=1)
     args = ap.parse_args()
 
     horizons = [int(x) for x in args.horizons.split(",") if x.strip()]
     run(start=args.start, end=args.end, cutoff=args.cutoff, horizons=horizons,
-        price_table=args.price_table, ticker_col=args.ticker_col, date_col=args.date_col, price_col=args.price_col,
-        sig_table=args.sig_table, sig_id_col=args.sig_id_col, sig_time_col=args.sig_time_col, sig_score_col=args.sig_score_col,
-        ent_table=args.ent_table, ent_fk_col=args.ent_fk_col, ent_json_col=args.ent_json_col,
-        market_ticker=args.market_ticker, percentile=args.percentile,
-        chunk_size=args.chunk_size, throttle_ms=args.throttle_ms, min_docs=args.min_docs)
\ No newline at end of file
+        percentile=[float(x) for x in args.percentile.split(",") if x.strip()],
+        min_docs=args.min_docs, car_days=args.car_days, **source_kwargs(args))
@@ -0,0 +1,60 @@
+"""回測本地欄式快取（Arrow IPC，可 memory-map）：重複回測 / 參數掃描不必每次重查 SQL Server。
+- 路徑：<root>/<kind>/<key>/<part>.arrow，旁邊的 .json 記錄查詢參數與資料指紋。
+- key = sha1(來源表 + 查詢參數)；part 為分區（價格：year=YYYY；訊號：fold 標籤）。
+- 指紋（例如該分區的 MAX(date)/MAX(id)/COUNT(*)）由呼叫端以一次輕量彙總查詢取得；
+  與快取記錄不同即視為過期，重新查 DB 並覆寫該分區。
+"""
+import hashlib, json, os
+from typing import Callable, Optional
+import pandas as pd
+import pyarrow as pa
+
+DEFAULT_DIR = "out/cache"
+
+def _fp(x) -> str:
+    return json.dumps(x, default=str, sort_keys=True, ensure_ascii=False)
+
+class ColumnarCache:
+    def __init__(self, root: str = DEFAULT_DIR):
+        self.root = root
+        self.hits = 0
+        self.misses = 0
+
+    def _paths(self, kind: str, params: dict, part: str):
+        key = hashlib.sha1(_fp(params).encode("utf-8")).hexdigest()[:16]
+        d = os.path.join(self.root, kind, key)
+        return d, os.path.join(d, f"{part}.arrow"), os.path.join(d, f"{part}.json")
+
+    def read(self, kind: str, params: dict, part: str, fingerprint) -> Optional[pd.DataFrame]:
+        _, data, meta = self._paths(kind, params, part)
+        try:
+            with open(meta, "r", encoding="utf-8") as f:
+                if json.load(f).get("fingerprint") != _fp(fingerprint):
+                    return None
+            with pa.memory_map(data, "r") as src:
+                return pa.ipc.open_file(src).read_all().to_pandas()
+        except (OSError, ValueError, pa.ArrowInvalid):
+            return None
+
+    def write(self, kind: str, params: dict, part: str, fingerprint, df: pd.DataFrame):
+        d, data, meta = self._paths(kind, params, part)
+        os.makedirs(d, exist_ok=True)
+        table = pa.Table.from_pandas(df, preserve_index=False)
+        tmp = data + ".tmp"
+        with pa.OSFile(tmp, "wb") as sink, pa.ipc.new_file(sink, table.schema) as w:
+            w.write_table(table)
+        os.replace(tmp, data)
+        with open(meta + ".tmp", "w", encoding="utf-8") as f:
+            json.dump({"params": params, "fingerprint": _fp(fingerprint), "rows": len(df)}, f, ensure_ascii=False, default=str)
+        os.replace(meta + ".tmp", meta)
+
+    def get_or_load(self, kind: str, params: dict, part: str, fingerprint,
+                    loader: Callable[[], pd.DataFrame]) -> pd.DataFrame:
+        df = self.read(kind, params, part, fingerprint)
+        if df is not None:
+            self.hits += 1
+            return df
+        self.misses += 1
+        df = loader()
+        self.write(kind, params, part, fingerprint, df)
+        return df
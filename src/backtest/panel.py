@@ -0,0 +1,148 @@
+"""Step 6 面板引擎：日期 × 股票矩陣一次建好，所有 horizon 的前瞻報酬與逐日 IC / RankIC / 命中率
+都以 NumPy 沿 axis=1 一次算完，不再對每個 ds 分組跑 Python 迴圈。
+- 前瞻報酬與舊版一致：同一檔股票「依列」位移 h 筆（遇缺價日即跳到下一筆有價日），不是日曆位移。
+- RankIC：逐列平均名次（ties 取平均）後再算 Pearson，等同 Spearman。
+"""
+import os
+from typing import Dict, List, Tuple
+import numpy as np
+import pandas as pd
+
+def forward_returns(px_df: pd.DataFrame, horizons: List[int]) -> pd.DataFrame:
+    """長表 (ticker, ds, px) → 加上 ret_fwd_{h} 欄（所有 horizon 一次算完）。"""
+    px = px_df.drop_duplicates(subset=["ticker", "ds"], keep="last").sort_values(["ticker", "ds"]).reset_index(drop=True)
+    v = px["px"].to_numpy(dtype=float)
+    codes = pd.factorize(px["ticker"])[0]
+    n = len(v)
+    for h in horizons:
+        fwd = np.full(n, np.nan)
+        if 0 < h < n:
+            same = codes[h:] == codes[:-h]
+            with np.errstate(divide="ignore", invalid="ignore"):
+                r = v[h:] / v[:-h] - 1.0
+            fwd[:-h] = np.where(same, r, np.nan)
+        px[f"ret_fwd_{h}"] = fwd
+    return px
+
+def to_panel(sig_df: pd.DataFrame, fwd_df: pd.DataFrame, horizons: List[int]) -> Tuple[pd.Index, np.ndarray, Dict[int, np.ndarray]]:
+    """訊號 (ticker, ds, mean_score) 對齊前瞻報酬 → (ds 索引, S[D×T], {h: R_h[D×T]})。"""
+    cols = [f"ret_fwd_{h}" for h in horizons]
+    df = sig_df[["ticker", "ds", "mean_score"]].merge(fwd_df[["ticker", "ds"] + cols], on=["ticker", "ds"], how="left")
+    d_codes, d_idx = pd.factorize(df["ds"], sort=True)
+    t_codes, t_idx = pd.factorize(df["ticker"], sort=True)
+    shape = (len(d_idx), len(t_idx))
+    def _mat(col):
+        m = np.full(shape, np.nan)
+        m[d_codes, t_codes] = pd.to_numeric(df[col], errors="coerce").to_numpy(dtype=float)
+        return m
+    return pd.Index(d_idx), _mat("mean_score"), {h: _mat(f"ret_fwd_{h}") for h in horizons}
+
+def _row_pearson(x: np.ndarray, y: np.ndarray, mask: np.ndarray) -> np.ndarray:
+    n = mask.sum(axis=1).astype(float)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        xm = np.where(mask, x, 0.0).sum(axis=1) / n
+        ym = np.where(mask, y, 0.0).sum(axis=1) / n
+        xc = np.where(mask, x - xm[:, None], 0.0)
+        yc = np.where(mask, y - ym[:, None], 0.0)
+        den = np.sqrt((xc * xc).sum(axis=1) * (yc * yc).sum(axis=1))
+        r = (xc * yc).sum(axis=1) / den
+    return np.where(den > 0, r, np.nan)
+
+def _row_rank(x: np.ndarray, mask: np.ndarray) -> np.ndarray:
+    return pd.DataFrame(np.where(mask, x, np.nan)).rank(axis=1, method="average").to_numpy()
+
+def daily_cs_metrics(S: np.ndarray, R: np.ndarray, min_pairs: int = 3) -> pd.DataFrame:
+    """逐日截面：ic / ric / hit / n_pairs（只保留配對數 >= min_pairs 的日子）。"""
+    mask = ~np.isnan(S) & ~np.isnan(R)
+    n = mask.sum(axis=1)
+    keep = n >= min_pairs
+    S, R, mask, n = S[keep], R[keep], mask[keep], n[keep]
+    ic = _row_pearson(S, R, mask)
+    ric = _row_pearson(_row_rank(S, mask), _row_rank(R, mask), mask)
+    hit = np.where(mask, (S * R) > 0, False).sum(axis=1) / np.maximum(n, 1)
+    return pd.DataFrame({"ic": ic, "ric": ric, "hit": hit, "n_pairs": n, "_row": np.flatnonzero(keep)})
+
+# ---------------- 事件研究 ----------------
+def _tail_masks(score: pd.Series, ds: pd.Series, pcts: List[float]) -> Dict[Tuple[str, float], np.ndarray]:
+    """單一 groupby quantile 取每日各分位門檻，再以布林遮罩選出長端（>= p 分位）/短端（<= 1-p 分位）。"""
+    qs = sorted({float(p) for p in pcts} | {1.0 - float(p) for p in pcts})
+    th = score.groupby(ds).quantile(qs).unstack()
+    out = {}
+    for p in pcts:
+        hi = ds.map(th[float(p)]).to_numpy(dtype=float)
+        lo = ds.map(th[1.0 - float(p)]).to_numpy(dtype=float)
+        v = score.to_numpy(dtype=float)
+        out[("long", p)] = v >= hi
+        out[("short", p)] = v <= lo
+    return out
+
+def event_study(sig_df: pd.DataFrame, fwd_df: pd.DataFrame, horizons: List[int], pcts: List[float],
+                car_days: int = 0, market_ticker=None) -> Tuple[pd.DataFrame, pd.DataFrame]:
+    """一次走完面板：各 horizon × 各分位的長/短端平均前瞻報酬（短端取負號），
+    以及 car_days > 0 時的累積異常報酬路徑（k = 1..car_days）。
+    異常報酬 = 前瞻報酬 - 基準；基準為 market_ticker 的同期報酬，未指定時為當日全市場等權平均。
+    回傳 (evt[side, horizon, pct, mean_ret, n_events], car[side, pct, k, car, n_events])。"""
+    ks = list(range(1, int(car_days) + 1))
+    cols = sorted({f"ret_fwd_{h}" for h in list(horizons) + ks}, key=lambda c: int(c.rsplit("_", 1)[1]))
+    df = sig_df[["ticker", "ds", "mean_score"]].merge(fwd_df[["ticker", "ds"] + cols], on=["ticker", "ds"], how="left")
+    rows = []
+    for h in horizons:
+        c = f"ret_fwd_{h}"
+        sub = df[df[c].notna()]
+        if sub.empty:
+            continue
+        r = sub[c].to_numpy(dtype=float)
+        for (side, p), m in _tail_masks(sub["mean_score"], sub["ds"], pcts).items():
+            if not m.any():
+                continue
+            x = r[m] if side == "long" else -r[m]
+            rows.append({"side": side, "horizon": h, "pct": float(p), "mean_ret": float(x.mean()), "n_events": int(m.sum())})
+    evt = pd.DataFrame(rows, columns=["side", "horizon", "pct", "mean_ret", "n_events"])
+
+    car_rows = []
+    if ks and not df.empty:
+        kc = [f"ret_fwd_{k}" for k in ks]
+        if market_ticker is not None and (fwd_df["ticker"] == str(market_ticker)).any():
+            bench = fwd_df[fwd_df["ticker"] == str(market_ticker)].set_index("ds")[kc]
+        else:
+            bench = fwd_df.groupby("ds")[kc].mean()
+        ab = df[kc].to_numpy(dtype=float) - bench.reindex(df["ds"]).to_numpy(dtype=float)
+        for (side, p), m in _tail_masks(df["mean_score"], df["ds"], pcts).items():
+            if not m.any():
+                continue
+            x = ab[m] if side == "long" else -ab[m]
+            n = (~np.isnan(x)).sum(axis=0)
+            mean = np.nansum(x, axis=0) / np.maximum(n, 1)
+            for j, k in enumerate(ks):
+                car_rows.append({"side": side, "pct": float(p), "k": k,
+                                 "car": float(mean[j]) if n[j] else float("nan"), "n_events": int(n[j])})
+    return evt, pd.DataFrame(car_rows, columns=["side", "pct", "k", "car", "n_events"])
+
+# ---------------- 共用唯讀面板（跨程序，np.memmap） ----------------
+def save_shared(fwd_df: pd.DataFrame, horizons: List[int], dirpath: str) -> dict:
+    """把前瞻報酬長表寫成 .npy（ticker 代碼 / 日期 / 各 horizon 報酬），回傳給 worker 的描述。
+    worker 以 mmap_mode='r' 開啟，同一份實體頁由 OS page cache 共用，不必各自載價與重算。"""
+    os.makedirs(dirpath, exist_ok=True)
+    codes, tickers = pd.factorize(fwd_df["ticker"])
+    np.save(os.path.join(dirpath, "ticker.npy"), codes.astype(np.int32))
+    np.save(os.path.join(dirpath, "ds.npy"), pd.to_datetime(fwd_df["ds"]).to_numpy(dtype="datetime64[D]"))
+    for h in horizons:
+        np.save(os.path.join(dirpath, f"ret_fwd_{h}.npy"), fwd_df[f"ret_fwd_{h}"].to_numpy(dtype=float))
+    return {"dir": dirpath, "tickers": [str(t) for t in tickers], "horizons": list(horizons)}
+
+def load_shared(meta: dict, start=None, end=None) -> pd.DataFrame:
+    """從共用面板取出 [start, end] 的前瞻報酬長表（只複製該區間的列）。"""
+    d = meta["dir"]
+    ds = np.load(os.path.join(d, "ds.npy"), mmap_mode="r")
+    sel = np.ones(len(ds), dtype=bool)
+    if start is not None:
+        sel &= ds >= np.datetime64(pd.to_datetime(start).date(), "D")
+    if end is not None:
+        sel &= ds <= np.datetime64(pd.to_datetime(end).date(), "D")
+    idx = np.flatnonzero(sel)
+    codes = np.load(os.path.join(d, "ticker.npy"), mmap_mode="r")[idx]
+    out = pd.DataFrame({"ticker": np.asarray(meta["tickers"], dtype=object)[codes],
+                        "ds": ds[idx].astype(object)})
+    for h in meta["horizons"]:
+        out[f"ret_fwd_{h}"] = np.load(os.path.join(d, f"ret_fwd_{h}.npy"), mmap_mode="r")[idx]
+    return out
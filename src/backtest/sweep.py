@@ -0,0 +1,174 @@
+"""Step 6 參數掃描：一次載入價格與訊號，對 cutoff × horizons × percentile × min_docs 網格批次回測。
+- 價格只載一次；所有 horizon 的前瞻報酬一次算完（多程序時以 memmap 共用）。
+- 對齊後訊號只跟 cutoff 有關：每個 (cutoff, fold) 讀一次（min_docs=1），min_docs 只是下游過濾。
+- horizons / percentile 純屬下游：每個 (cutoff, min_docs, fold) 以聯集一次算完 IC 與事件研究，再分給各組合。
+- 每個組合寫一列 bt_params（取回 id），結果以長表寫入 bt_sweep_results（一列一個指標值）。
+
+用法：
+python -m src.backtest.sweep --start 2023-01-01 --end 2025-06-30 \
+  --cutoffs 13:30,14:00 --horizon-sets "1,5,10;1,20" --percentiles 0.9,0.95 --min-docs 1,3 --workers 4
+"""
+import argparse, datetime, itertools, json, os, shutil, tempfile
+from typing import Dict, List, Optional, Tuple
+import pandas as pd
+from sqlalchemy import text
+from src.backtest import panel
+from src.backtest import align_and_backtest as ab
+from src.backtest.cache import ColumnarCache
+
+_CS_METRICS = ["ic", "ic_p", "ric", "ric_p", "hitrate", "n_pairs", "n_days"]
+_COUNT_METRICS = {"n_pairs", "n_days"}  # value 本身就是筆數，n 留空
+
+def _ensure_sweep_table(engine):
+    with engine.begin() as conn:
+        conn.execute(text("""
+IF OBJECT_ID('bt_sweep_results','U') IS NULL
+BEGIN
+    CREATE TABLE bt_sweep_results (
+        id INT IDENTITY(1,1) PRIMARY KEY,
+        sweep NVARCHAR(32) NOT NULL,
+        params_id INT NOT NULL,
+        kind NVARCHAR(16) NOT NULL,
+        fold NVARCHAR(32) NULL,
+        year INT NULL,
+        horizon INT NOT NULL,
+        side NVARCHAR(8) NULL,
+        metric NVARCHAR(16) NOT NULL,
+        value FLOAT NULL,
+        n INT NULL,
+        created_at DATETIME2 NOT NULL DEFAULT SYSUTCDATETIME()
+    );
+    CREATE INDEX ix_bt_sweep_results_params ON bt_sweep_results(sweep, params_id);
+END
+"""))
+
+def _eval_cutoff_fold(engine, fold, fwd_df: pd.DataFrame, cutoff: str, min_docs_list: List[int], horizons: List[int],
+                      pcts: List[float], chunk_size: int, throttle_ms: int, cache_dir: Optional[str], **sig_kw) -> List[dict]:
+    """單一 (cutoff, fold)：訊號讀一次，對每個 min_docs 以 horizon/分位聯集算完 IC 與事件研究。"""
+    label, y, st, en = fold
+    cache = ColumnarCache(cache_dir) if cache_dir else None
+    sig_all = ab._load_aligned_signals_cached(engine, cache, label, st, en, cutoff, chunk_size, throttle_ms, 1, **sig_kw)
+    out = []
+    for md in min_docs_list:
+        sig = sig_all[sig_all["n_docs"] >= int(md)] if not sig_all.empty else sig_all
+        if sig.empty:
+            continue
+        met = ab._calc_daily_cs_metrics(sig, None, horizons, fwd_df=fwd_df)
+        evt, _ = ab._event_study(sig, None, horizons, pcts, fwd_df=fwd_df)
+        out.append({"cutoff": cutoff, "min_docs": int(md), "fold": label, "year": y,
+                    "met": met.to_dict("records"), "evt": evt.to_dict("records")})
+    return out
+
+def _task_worker(job: dict) -> List[dict]:
+    job = dict(job)
+    meta = job.pop("panel_meta")
+    fold = job.pop("fold")
+    fwd_df = panel.load_shared(meta, fold[2], None)
+    engine = ab._make_engine()
+    try:
+        return _eval_cutoff_fold(engine, fold, fwd_df, **job)
+    finally:
+        engine.dispose()
+
+def _tidy_rows(sweep: str, pid: int, combo: dict, res: dict) -> List[dict]:
+    """組合結果 → bt_sweep_results 長表列。n 為該值的樣本數：IC 類指標 = 有效日數（n_days），
+    事件研究 = 事件數；n_pairs / n_days 本身就是筆數，n 為 None。"""
+    rows = []
+    hs = set(combo["horizons"])
+    for r in res["met"]:
+        if int(r["horizon"]) not in hs:
+            continue
+        for m in _CS_METRICS:
+            rows.append({"sw": sweep, "pid": pid, "f": res["fold"], "y": res["year"], "h": int(r["horizon"]), "s": None,
+                         "m": m, "v": ab._to_db_float(r[m]), "n": None if m in _COUNT_METRICS else int(r["n_days"])})
+    for r in res["evt"]:
+        if int(r["horizon"]) not in hs or abs(float(r["pct"]) - combo["percentile"]) > 1e-12:
+            continue
+        rows.append({"sw": sweep, "pid": pid, "f": res["fold"], "y": res["year"], "h": int(r["horizon"]), "s": r["side"],
+                     "m": "mean_ret", "v": ab._to_db_float(r["mean_ret"]), "n": int(r["n_events"])})
+    return rows
+
+def run(start: str, end: str, cutoffs: List[str], horizon_sets: List[List[int]], percentiles: List[float],
+        min_docs: List[int], price_table: str, ticker_col: str, date_col: str, price_col: str,
+        sig_table: str, sig_id_col: Optional[str], sig_time_col: Optional[str], sig_score_col: Optional[str],
+        ent_table: str, ent_fk_col: Optional[str], ent_json_col: Optional[str],
+        market_ticker: Optional[str], chunk_size: int, throttle_ms: int,
+        folds: Optional[str] = None, workers: int = 1, align: str = "sql",
+        cache_dir: Optional[str] = None) -> str:
+    engine = ab._make_engine()
+    ab._ensure_tables(engine)
+    _ensure_sweep_table(engine)
+    sweep = datetime.datetime.now(datetime.timezone.utc).strftime("SW%Y%m%d%H%M%S")
+    sig_kw = dict(sig_table=sig_table, sig_id_col=sig_id_col, sig_time_col=sig_time_col, sig_score_col=sig_score_col,
+                  ent_table=ent_table, ent_fk_col=ent_fk_col, ent_json_col=ent_json_col, align=align)
+    all_h = sorted({h for hs in horizon_sets for h in hs})
+
+    cache = ColumnarCache(cache_dir) if cache_dir else None
+    px_df = ab._load_prices_cached(engine, cache, price_table, ticker_col, date_col, price_col, start, end)
+    fwd_df = panel.forward_returns(px_df, all_h)
+    del px_df
+
+    fold_list = ab._parse_folds(start, end, folds)
+    common = dict(min_docs_list=sorted(set(min_docs)), horizons=all_h, pcts=sorted(set(percentiles)),
+                  chunk_size=chunk_size, throttle_ms=throttle_ms, cache_dir=cache_dir, **sig_kw)
+    tasks = [(c, f) for c in cutoffs for f in fold_list]
+    workers = max(1, min(int(workers), len(tasks)))
+    if workers > 1:
+        import multiprocessing as mp
+        tmpdir = tempfile.mkdtemp(prefix="bt_sweep_")
+        try:
+            meta = panel.save_shared(fwd_df, all_h, tmpdir)
+            jobs = [dict(common, cutoff=c, fold=f, panel_meta=meta) for c, f in tasks]
+            with mp.get_context("spawn").Pool(processes=workers) as pool:
+                parts = pool.map(_task_worker, jobs)
+        finally:
+            shutil.rmtree(tmpdir, ignore_errors=True)
+    else:
+        parts = [_eval_cutoff_fold(engine, f, fwd_df, cutoff=c, **common) for c, f in tasks]
+    by_key: Dict[Tuple[str, int], List[dict]] = {}
+    for part in parts:
+        for res in part:
+            by_key.setdefault((res["cutoff"], res["min_docs"]), []).append(res)
+
+    # 每個組合一列 bt_params，結果長表整批寫入
+    src = dict(start=start, end=end, price_table=price_table, ticker_col=ticker_col, date_col=date_col, price_col=price_col,
+               market_ticker=market_ticker, folds=folds, **sig_kw)
+    rows, csv_rows = [], []
+    with engine.begin() as conn:
+        for c, hs, p, md in itertools.product(cutoffs, horizon_sets, sorted(set(percentiles)), sorted(set(min_docs))):
+            combo = {"cutoff": c, "horizons": list(hs), "percentile": float(p), "min_docs": int(md)}
+            pid = int(conn.execute(text("INSERT INTO bt_params(params) OUTPUT INSERTED.id VALUES(:p)"),
+                                   {"p": json.dumps(dict(src, sweep=sweep, **combo), ensure_ascii=False)}).scalar())
+            for res in by_key.get((c, int(md)), []):
+                tidy = _tidy_rows(sweep, pid, combo, res)
+                rows += tidy
+                csv_rows += [dict(r, cutoff=c, horizons=",".join(map(str, hs)), percentile=p, min_docs=md) for r in tidy]
+        if rows:
+            conn.execute(text("""
+                INSERT INTO bt_sweep_results(sweep, params_id, kind, fold, year, horizon, side, metric, value, n)
+                VALUES (:sw, :pid, 'entity', :f, :y, :h, :s, :m, :v, :n)
+            """), rows)
+
+    outdir = "out/backtest"; os.makedirs(outdir, exist_ok=True)
+    if csv_rows:
+        (pd.DataFrame(csv_rows)
+           .rename(columns={"sw": "sweep", "pid": "params_id", "f": "fold", "y": "year", "h": "horizon", "s": "side", "m": "metric", "v": "value"})
+           .to_csv(os.path.join(outdir, f"sweep_{sweep}.csv"), index=False, encoding="utf-8-sig"))
+    n_combo = len(cutoffs) * len(horizon_sets) * len(set(percentiles)) * len(set(min_docs))
+    print(f"[{sweep}] {n_combo} 組參數、{len(tasks)} 個 (cutoff, fold) 任務；寫入 {len(rows)} 列 bt_sweep_results。")
+    return sweep
+
+if __name__ == "__main__":
+    ap = argparse.ArgumentParser()
+    ab.add_source_args(ap)
+    ap.add_argument("--cutoffs", type=str, default="13:30", help="逗號分隔，例如 13:30,14:00")
+    ap.add_argument("--horizon-sets", type=str, default="1,5,10", help="分號分隔多組 horizons，例如 \"1,5,10;1,20\"")
+    ap.add_argument("--percentiles", type=str, default="0.95", help="逗號分隔，例如 0.9,0.95")
+    ap.add_argument("--min-docs", type=str, default="1", help="逗號分隔，例如 1,3")
+    args = ap.parse_args()
+    run(start=args.start, end=args.end,
+        cutoffs=[x.strip() for x in args.cutoffs.split(",") if x.strip()],
+        horizon_sets=[[int(h) for h in hs.split(",") if h.strip()] for hs in args.horizon_sets.split(";") if hs.strip()],
+        percentiles=[float(x) for x in args.percentiles.split(",") if x.strip()],
+        min_docs=[int(x) for x in args.min_docs.split(",") if x.strip()],
+        **ab.source_kwargs(args))
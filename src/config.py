@@ -5,3 +5,9 @@ load_dotenv()
 DB_URL = os.getenv("DB_URL", "sqlite:///./finnews.db")
 MODEL_DIR = os.getenv("MODEL_DIR", "./models")
 ENV = os.getenv("ENV", "dev")
+INFER_BACKEND = os.getenv("INFER_BACKEND", "torch")  # torch | int8 | onnx | onnx-int8
+SCORE_CACHE_SIZE = int(os.getenv("SCORE_CACHE_SIZE", "50000"))  # 程序內 LRU 筆數；0 = 關閉
+SCORE_CACHE_DB = os.getenv("SCORE_CACHE_DB", "")  # 例如 ./cache/score_cache.sqlite；空 = 不用磁碟層
+SCORE_CACHE_DB_MAX_MB = float(os.getenv("SCORE_CACHE_DB_MAX_MB", "512"))
+TOKEN_CACHE_SIZE = int(os.getenv("TOKEN_CACHE_SIZE", "200000"))  # jieba 斷詞結果的程序內 LRU 筆數；0 = 關閉
+TOKEN_CACHE_DB = os.getenv("TOKEN_CACHE_DB", "")  # 例如 ./cache/token_cache.sqlite；空 = 不用磁碟層
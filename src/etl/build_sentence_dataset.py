@@ -4,7 +4,9 @@ from datetime import datetime
 from sqlalchemy import create_engine, text, Column, Integer, Unicode, UnicodeText, DateTime, Table, MetaData
 from sqlalchemy.orm import sessionmaker
 from src.config import DB_URL
-from src.label.weak_rules import load_lexicon, score_sentence_zh
+from src.label.weak_rules import load_lexicon, score_sentences_zh
+from src.etl.dedup_news import skip_dups_sql
+from src.nlp import zh_tokens
 
 def ensure_table(engine):
     meta = MetaData()
@@ -22,17 +24,19 @@ def ensure_table(engine):
     meta.create_all(engine)
     return table
 
-def run(lexicon_path: str, limit: int = 5000, days: int = 120, force_rebuild: bool = False):
+def run(lexicon_path: str, limit: int = 5000, days: int = 120, force_rebuild: bool = False,
+        batch_size: int = 5000, workers: int = 1):
     engine = create_engine(DB_URL, future=True)
     ensure_table(engine)
     Session = sessionmaker(bind=engine, future=True)
     cfg = load_lexicon(lexicon_path)
 
     with Session() as s:
-        q = text('''
+        q = text(f'''
             SELECT TOP (:limit) p.news_id, p.lang, p.sentences_json
             FROM news_proc p
             WHERE p.created_at >= DATEADD(day, -:days, GETUTCDATE())
+              {skip_dups_sql(s, "p.news_id")}
             ORDER BY p.news_id DESC
         ''')
         rows = s.execute(q, {"limit": limit, "days": days}).all()
@@ -41,7 +45,7 @@ def run(lexicon_path: str, limit: int = 5000, days: int = 120, force_rebuild: bo
             s.execute(text("DELETE FROM news_sent"))
             s.commit()
 
-        cnt = 0
+        items = []
         for news_id, lang, sjson in rows:
             try:
                 sents = json.loads(sjson) if sjson else []
@@ -50,25 +54,33 @@ def run(lexicon_path: str, limit: int = 5000, days: int = 120, force_rebuild: bo
             for i, sent in enumerate(sents):
                 if not sent or (lang != "zh"):
                     continue
-                label, info = score_sentence_zh(sent, cfg)
-                s.execute(
-                    text("""
-                        INSERT INTO news_sent (news_id, sent_id, lang, sentence, rule_label, rule_score, keywords_json, created_at)
-                        VALUES (:news_id, :sid, :lang, :sentence, :label, :score, :kw, :ts)
-                    """),
-                    {
-                        "news_id": news_id,
-                        "sid": i,
-                        "lang": lang,
-                        "sentence": sent,
-                        "label": label,
-                        "score": int(info["raw_score"]),
-                        "kw": json.dumps({k: info[k] for k in ["pos_hits","neg_hits","negations","intensifiers","dampeners"]}, ensure_ascii=False),
-                        "ts": datetime.utcnow()
-                    }
-                )
-                cnt += 1
+                items.append((news_id, i, lang, sent))
+
+        # 整批斷詞（句子雜湊快取、可平行），每 batch_size 句計分並 executemany 寫入
+        cnt = 0
+        for j in range(0, len(items), batch_size):
+            part = items[j:j + batch_size]
+            scored = score_sentences_zh([x[3] for x in part], cfg, workers=workers)
+            now = datetime.utcnow()
+            s.execute(
+                text("""
+                    INSERT INTO news_sent (news_id, sent_id, lang, sentence, rule_label, rule_score, keywords_json, created_at)
+                    VALUES (:news_id, :sid, :lang, :sentence, :label, :score, :kw, :ts)
+                """),
+                [{
+                    "news_id": news_id,
+                    "sid": i,
+                    "lang": lang,
+                    "sentence": sent,
+                    "label": label,
+                    "score": int(info["raw_score"]),
+                    "kw": json.dumps({k: info[k] for k in ["pos_hits","neg_hits","negations","intensifiers","dampeners"]}, ensure_ascii=False),
+                    "ts": now
+                } for (news_id, i, lang, sent), (label, info) in zip(part, scored)]
+            )
+            cnt += len(part)
         s.commit()
+    zh_tokens.close_all()
     print(f"完成 news_sent 生成，共 {cnt} 句（中文）。")
 
 if __name__ == "__main__":
@@ -77,5 +89,8 @@ if __name__ == "__main__":
     ap.add_argument("--limit", type=int, default=5000)
     ap.add_argument("--days", type=int, default=120)
     ap.add_argument("--force-rebuild", action="store_true")
+    ap.add_argument("--batch-size", type=int, default=5000, help="每批斷詞 / 寫入的句數")
+    ap.add_argument("--workers", type=int, default=1, help=">1 時未命中快取的句子以多程序斷詞")
     args = ap.parse_args()
-    run(lexicon_path=args.lexicon, limit=args.limit, days=args.days, force_rebuild=args.force_rebuild)
+    run(lexicon_path=args.lexicon, limit=args.limit, days=args.days, force_rebuild=args.force_rebuild,
+        batch_size=args.batch_size, workers=args.workers)
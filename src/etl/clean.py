@@ -6,3 +6,19 @@ def basic_clean(text: str) -> str:
     t = text.replace("\u3000", " ").replace("\xa0", " ")
     t = re.sub(r"\s+", " ", t)
     return t.strip()
+
+_TRACKING_PARAMS = {"fbclid", "gclid", "mc_cid", "mc_eid", "ref", "spm"}
+
+def normalize_url(url: str) -> str:
+    """新聞連結正規化（去重用）：scheme/host 小寫、去預設埠與 #fragment、去 utm_* 等追蹤參數。"""
+    from urllib.parse import urlsplit, urlunsplit, parse_qsl, urlencode
+    if not isinstance(url, str) or not url.strip():
+        return ""
+    p = urlsplit(url.strip())
+    scheme = p.scheme.lower()
+    host = (p.hostname or "").lower()
+    if p.port and not ((scheme == "http" and p.port == 80) or (scheme == "https" and p.port == 443)):
+        host = f"{host}:{p.port}"
+    q = [(k, v) for k, v in parse_qsl(p.query, keep_blank_values=True)
+         if not k.lower().startswith("utm_") and k.lower() not in _TRACKING_PARAMS]
+    return urlunsplit((scheme, host, p.path or "/", urlencode(q), ""))
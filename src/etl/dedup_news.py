@@ -0,0 +1,167 @@
+"""近似重複新聞偵測（MinHash + LSH）：同一則新聞被多個 feed 以不同 URL 轉載時，歸到同一個 cluster。
+- 簽章：news_proc.cleaned 去空白後的字元 3-gram 集合 → 128 個 MinHash（crc32 + 固定種子的 128 組
+  (a·h + b) mod p 排列，跨程序穩定），以 VARBINARY(512) 存 news_dup.minhash。
+- 候選查找：128 維切成 16 段 × 8 列（門檻約 (1/16)^(1/8) ≈ 0.71），每段一張 dict（段值 → 文件），
+  只對同段候選以 MinHash 估 Jaccard，>= --threshold（預設 0.8）才算重複，不必兩兩比較。
+- 寫入 news_dup(news_id, minhash, cluster_id)；cluster_id = 該群最早處理到的 news_id（代表文），
+  cluster_id <> news_id 即為重複文。下游（句級資料、實體連結、訊號聚合）跳過重複文。
+- 索引只保留最近 --window-days 天的簽章（轉載通常在數天內），每次執行從 news_dup 重建。
+
+用法：
+python -m src.etl.dedup_news --days 7 --window-days 3 --threshold 0.8
+"""
+import argparse, re, time, zlib
+from typing import Dict, Iterable, List, Optional, Tuple
+import numpy as np
+from sqlalchemy import text
+from src.config import DB_URL
+from src.utils.bulk_upsert import make_engine
+
+NUM_PERM = 128
+BANDS = 16
+_PRIME = np.uint64(4294967311)  # > 2^32 的質數
+_rng = np.random.RandomState(20240601)
+_A = _rng.randint(1, 1 << 31, size=NUM_PERM).astype(np.uint64)
+_B = _rng.randint(0, 1 << 31, size=NUM_PERM).astype(np.uint64)
+_WS = re.compile(r"\s+")
+
+def ensure_table(engine):
+    with engine.begin() as conn:
+        conn.execute(text("""
+IF OBJECT_ID('news_dup','U') IS NULL
+BEGIN
+    CREATE TABLE news_dup (
+        news_id INT NOT NULL PRIMARY KEY,
+        minhash VARBINARY(512) NULL,
+        cluster_id INT NOT NULL,
+        created_at DATETIME2 NOT NULL DEFAULT SYSUTCDATETIME()
+    );
+    CREATE INDEX ix_news_dup_cluster ON news_dup(cluster_id);
+    CREATE INDEX ix_news_dup_created ON news_dup(created_at);
+END
+"""))
+
+def has_table(conn) -> bool:
+    return conn.execute(text("SELECT OBJECT_ID('news_dup','U')")).scalar() is not None
+
+def skip_dups_sql(conn, col: str) -> str:
+    """回傳「排除重複文」的 WHERE 片段（news_dup 不存在時為空字串），col 為 news_id 欄（例如 p.news_id）。"""
+    if not has_table(conn):
+        return ""
+    return f"AND NOT EXISTS (SELECT 1 FROM news_dup dd WHERE dd.news_id = {col} AND dd.cluster_id <> dd.news_id)"
+
+# ---------------- MinHash / LSH ----------------
+def _shingles(text_: str, k: int) -> set:
+    t = _WS.sub("", (text_ or "").lower())
+    return {t[i:i + k] for i in range(len(t) - k + 1)}
+
+def minhash(text_: str, k: int = 3, min_shingles: int = 8) -> Optional[np.ndarray]:
+    """NUM_PERM 維 uint32 簽章；shingle 太少（極短文）回傳 None，不參與比對。"""
+    sh = _shingles(text_, k)
+    if len(sh) < min_shingles:
+        return None
+    h = np.fromiter((zlib.crc32(s.encode("utf-8")) for s in sh), dtype=np.uint64, count=len(sh))
+    return ((_A[:, None] * h[None, :] + _B[:, None]) % _PRIME).min(axis=1).astype(np.uint32)
+
+class MinHashIndex:
+    """LSH：BANDS 段 × (NUM_PERM / BANDS) 列；query 回傳估計 Jaccard >= threshold 的最相似 cluster_id
+    （同分取較小 id）。"""
+    def __init__(self, threshold: float = 0.8, bands: int = BANDS):
+        self.threshold = float(threshold)
+        self.rows = NUM_PERM // bands
+        self._buckets: List[Dict[bytes, List[int]]] = [dict() for _ in range(bands)]
+        self._sigs: List[np.ndarray] = []
+        self._cids: List[int] = []
+
+    def _keys(self, sig: np.ndarray):
+        for i in range(len(self._buckets)):
+            yield sig[i * self.rows:(i + 1) * self.rows].tobytes()
+
+    def add(self, sig: np.ndarray, cluster_id: int):
+        j = len(self._sigs)
+        self._sigs.append(sig)
+        self._cids.append(int(cluster_id))
+        for b, key in zip(self._buckets, self._keys(sig)):
+            b.setdefault(key, []).append(j)
+
+    def query(self, sig: np.ndarray) -> Optional[int]:
+        cand = set()
+        for b, key in zip(self._buckets, self._keys(sig)):
+            cand.update(b.get(key, ()))
+        best = None
+        for j in cand:
+            jac = float((self._sigs[j] == sig).mean())
+            if jac >= self.threshold and (best is None or (-jac, self._cids[j]) < best):
+                best = (-jac, self._cids[j])
+        return None if best is None else best[1]
+
+def assign_clusters(docs: Iterable[Tuple[int, str]], index: MinHashIndex, k: int = 3,
+                    min_shingles: int = 8) -> List[dict]:
+    """依序處理 (news_id, cleaned)：命中既有 cluster 就沿用，否則自成一群（cluster_id = news_id）。"""
+    out = []
+    for nid, cleaned in docs:
+        sig = minhash(cleaned, k, min_shingles)
+        cid = index.query(sig) if sig is not None else None
+        if cid is None:
+            cid = int(nid)
+        if sig is not None:
+            index.add(sig, cid)
+        out.append({"nid": int(nid), "sig": None if sig is None else sig.tobytes(), "cid": cid})
+    return out
+
+# ---------------- 執行 ----------------
+def _load_index(engine, index: MinHashIndex, window_days: int) -> int:
+    with engine.begin() as conn:
+        rows = conn.execute(text("""
+            SELECT minhash, cluster_id FROM news_dup
+            WHERE minhash IS NOT NULL AND created_at >= DATEADD(day, -:w, SYSUTCDATETIME())
+            ORDER BY news_id ASC
+        """), {"w": window_days}).fetchall()
+    for sig, cid in rows:
+        index.add(np.frombuffer(bytes(sig), dtype=np.uint32), int(cid))
+    return len(rows)
+
+def run(days: int, window_days: int, threshold: float, shingle: int, min_shingles: int,
+        batch_size: int, limit: int, throttle_ms: int = 0):
+    engine = make_engine(DB_URL)
+    ensure_table(engine)
+    index = MinHashIndex(threshold)
+    n_idx = _load_index(engine, index, window_days)
+
+    last_id, total, dups = 0, 0, 0
+    while total < limit:
+        with engine.begin() as conn:
+            rows = conn.execute(text("""
+                SELECT TOP (:n) p.news_id, p.cleaned
+                FROM news_proc p
+                WHERE p.created_at >= DATEADD(day, -:days, GETUTCDATE())
+                  AND p.news_id > :last
+                  AND NOT EXISTS (SELECT 1 FROM news_dup d WHERE d.news_id = p.news_id)
+                ORDER BY p.news_id ASC
+            """), {"n": min(batch_size, limit - total), "days": days, "last": last_id}).fetchall()
+        if not rows:
+            break
+        last_id = int(rows[-1][0])
+        docs = list({int(nid): cleaned for nid, cleaned in rows}.items())
+        recs = assign_clusters(docs, index, shingle, min_shingles)
+        with engine.begin() as conn:
+            conn.execute(text("INSERT INTO news_dup (news_id, minhash, cluster_id) VALUES (:nid, :sig, :cid)"), recs)
+        total += len(recs)
+        dups += sum(1 for r in recs if r["cid"] != r["nid"])
+        if throttle_ms > 0:
+            time.sleep(throttle_ms / 1000.0)
+    print(f"近似重複偵測：處理 {total} 篇（索引載入 {n_idx} 筆簽章），標記重複 {dups} 篇。")
+
+if __name__ == "__main__":
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--days", type=int, default=7, help="處理最近 N 天、尚未建簽章的 news_proc")
+    ap.add_argument("--window-days", type=int, default=3, help="索引只載入最近 N 天的簽章")
+    ap.add_argument("--threshold", type=float, default=0.8, help="MinHash 估計 Jaccard >= 此值視為重複")
+    ap.add_argument("--shingle", type=int, default=3, help="字元 n-gram 長度")
+    ap.add_argument("--min-shingles", type=int, default=8, help="shingle 數少於此值（極短文）不比對")
+    ap.add_argument("--batch-size", type=int, default=1000)
+    ap.add_argument("--limit", type=int, default=200000)
+    ap.add_argument("--throttle-ms", type=int, default=0)
+    args = ap.parse_args()
+    run(days=args.days, window_days=args.window_days, threshold=args.threshold, shingle=args.shingle,
+        min_shingles=args.min_shingles, batch_size=args.batch_size, limit=args.limit, throttle_ms=args.throttle_ms)
@@ -1,7 +1,15 @@
-"""字典式實體連結（批次 + 節流）。"""
+"""字典式實體連結（批次 + 節流）。
+- 除了 news_entity.matched_json，同時寫入正規化的 news_entity_ticker(news_id, ticker, industry)，
+  供回測以 set-based SQL 直接 JOIN（不必在 Python 逐筆 json.loads）。
+- 既有資料可用 --backfill-tickers 以 OPENJSON 一次展開補齊。
+- 預設以 Aho–Corasick 自動機（src/etl/gazetteer.py）單次掃描比對所有別名，重疊時取最長；
+  --matcher regex 切回每家公司一個 regex 的舊做法（對照用）。
+"""
 import argparse, yaml, json, re, time
-from sqlalchemy import create_engine, text
+from sqlalchemy import bindparam, create_engine, text
 from src.config import DB_URL
+from src.etl.dedup_news import skip_dups_sql
+from src.etl import gazetteer
 
 def load_gaz(path):
     with open(path, "r", encoding="utf-8") as f:
@@ -30,44 +38,233 @@ def ensure_table(engine):
           Column('created_at', DateTime))
     meta.create_all(engine)
 
-def run(days:int, limit:int, gaz_path:str, batch_size:int, throttle_ms:int):
-    engine = create_engine(DB_URL, future=True)
-    ensure_table(engine)
-    ents = load_gaz(gaz_path)
+def ensure_ticker_table(engine):
+    with engine.begin() as conn:
+        conn.execute(text("""
+IF OBJECT_ID('news_entity_ticker','U') IS NULL
+BEGIN
+    CREATE TABLE news_entity_ticker (
+        news_id INT NOT NULL,
+        ticker NVARCHAR(32) NOT NULL,
+        industry NVARCHAR(64) NULL,
+        CONSTRAINT pk_news_entity_ticker PRIMARY KEY (news_id, ticker)
+    );
+    CREATE INDEX ix_news_entity_ticker_ticker ON news_entity_ticker(ticker) INCLUDE (industry);
+END
+"""))
 
+def _ticker_rows(nid: int, hits) -> list:
+    seen = {}
+    for h in hits:
+        tk = (h or {}).get("ticker") or ""
+        if tk and tk not in seen:
+            seen[tk] = {"nid": int(nid), "tk": str(tk), "ind": (h or {}).get("industry")}
+    return list(seen.values())
+
+def backfill_ticker_table(engine) -> int:
+    """把既有 news_entity.matched_json 以 OPENJSON 一次展開到 news_entity_ticker（只補缺的）。"""
+    ensure_ticker_table(engine)
     with engine.begin() as conn:
-        rows = conn.execute(text('''
-            SELECT TOP (:limit) p.news_id, p.cleaned
-            FROM news_proc p
-            WHERE p.created_at >= DATEADD(day, -:days, GETUTCDATE())
-            ORDER BY p.news_id DESC
-        '''), {"limit": limit, "days": days}).fetchall()
+        res = conn.execute(text("""
+            INSERT INTO news_entity_ticker (news_id, ticker, industry)
+            SELECT x.news_id, x.ticker, MAX(x.industry)
+            FROM (
+                SELECT e.news_id, j.ticker, j.industry
+                FROM news_entity e
+                CROSS APPLY OPENJSON(e.matched_json)
+                    WITH (ticker NVARCHAR(32) '$.ticker', industry NVARCHAR(64) '$.industry') j
+                WHERE ISJSON(e.matched_json) = 1 AND j.ticker IS NOT NULL AND j.ticker <> ''
+            ) x
+            WHERE NOT EXISTS (SELECT 1 FROM news_entity_ticker t WHERE t.news_id = x.news_id AND t.ticker = x.ticker)
+            GROUP BY x.news_id, x.ticker
+        """))
+        return int(res.rowcount or 0)
+
+def _link_regex(cleaned: str, ents) -> list:
+    hits = []
+    for e in ents:
+        m = e["regex"].findall(cleaned or "")
+        if m:
+            hits.append({
+                "ticker": e["ticker"], "name": e["name"], "industry": e["industry"],
+                "matches": list(m), "count": len(m)
+            })
+    return hits
+
+# ---------------- 增量連結 / 字典版本 ----------------
+_ALIAS_MAX = 128
+
+def ensure_link_tables(engine):
+    with engine.begin() as conn:
+        conn.execute(text("""
+IF OBJECT_ID('news_entity_linked','U') IS NULL
+BEGIN
+    CREATE TABLE news_entity_linked (
+        news_id INT NOT NULL PRIMARY KEY,
+        gaz_version CHAR(40) NOT NULL,
+        linked_at DATETIME2 NOT NULL DEFAULT SYSUTCDATETIME()
+    );
+    CREATE INDEX ix_news_entity_linked_ver ON news_entity_linked(gaz_version);
+END
+IF OBJECT_ID('news_alias_index','U') IS NULL
+BEGIN
+    CREATE TABLE news_alias_index (
+        alias NVARCHAR(128) NOT NULL,
+        news_id INT NOT NULL,
+        CONSTRAINT pk_news_alias_index PRIMARY KEY (alias, news_id)
+    );
+    CREATE INDEX ix_news_alias_index_news ON news_alias_index(news_id);
+END
+IF OBJECT_ID('gaz_versions','U') IS NULL
+BEGIN
+    CREATE TABLE gaz_versions (
+        version CHAR(40) NOT NULL PRIMARY KEY,
+        aliases_json NVARCHAR(MAX) NOT NULL,
+        created_at DATETIME2 NOT NULL DEFAULT SYSUTCDATETIME()
+    );
+END
+"""))
+
+def _in_chunks(conn, sql: str, ids, params=None, chunk_size: int = 800):
+    stmt = text(sql).bindparams(bindparam("ids", expanding=True))
+    out = []
+    ids = list(ids)
+    for i in range(0, len(ids), chunk_size):
+        out.extend(conn.execute(stmt, dict(params or {}, ids=ids[i:i + chunk_size])).fetchall())
+    return out
+
+def _write_links(conn, rows, link, version: str) -> int:
+    """rows: [(news_id, cleaned)]。先刪該批舊結果再寫入（重跑冪等），同時寫反向索引與已連結標記。"""
+    docs = {int(nid): cleaned for nid, cleaned in rows}
+    ids = list(docs)
+    for t in ("news_entity", "news_entity_ticker", "news_alias_index", "news_entity_linked"):
+        conn.execute(text(f"DELETE FROM {t} WHERE news_id IN :ids").bindparams(bindparam("ids", expanding=True)),
+                     {"ids": ids})
+    ent_rows, tk_rows, alias_rows = [], [], []
+    for nid, cleaned in docs.items():
+        hits = link(cleaned or "")
+        if not hits:
+            continue
+        ent_rows.append({"nid": nid, "m": json.dumps(hits, ensure_ascii=False)})
+        tk_rows.extend(_ticker_rows(nid, hits))
+        aliases = {m for h in hits for m in h["matches"] if m and len(m) <= _ALIAS_MAX}
+        alias_rows.extend({"a": a, "nid": nid} for a in aliases)
+    if ent_rows:
+        conn.execute(text("""
+            INSERT INTO news_entity (news_id, matched_json, created_at)
+            VALUES (:nid, :m, SYSUTCDATETIME())
+        """), ent_rows)
+    if tk_rows:
+        conn.execute(text("INSERT INTO news_entity_ticker (news_id, ticker, industry) VALUES (:nid, :tk, :ind)"), tk_rows)
+    if alias_rows:
+        conn.execute(text("INSERT INTO news_alias_index (alias, news_id) VALUES (:a, :nid)"), alias_rows)
+    conn.execute(text("INSERT INTO news_entity_linked (news_id, gaz_version) VALUES (:nid, :v)"),
+                 [{"nid": nid, "v": version} for nid in ids])
+    return len(ent_rows)
 
-    def chunks(lst, n):
-        for i in range(0, len(lst), n):
-            yield lst[i:i+n]
+def _like_escape(a: str) -> str:
+    return "%" + a.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_").replace("[", "\\[") + "%"
 
+def _affected_ids(conn, old_ver: str, removed: set, added: set, chunk_size: int = 50) -> set:
+    """舊版 old_ver 連結過的文件中，受字典變更影響者：
+    移除/變更的別名 → 反向索引；新增的別名 → 在 news_proc.cleaned 以 LIKE 搜尋（server 端過濾）。"""
+    ids = set()
+    if removed:
+        ids.update(int(r[0]) for r in _in_chunks(conn, """
+            SELECT DISTINCT x.news_id FROM news_alias_index x
+            JOIN news_entity_linked l ON l.news_id = x.news_id AND l.gaz_version = :v
+            WHERE x.alias IN :ids
+        """, [a for a in removed if len(a) <= _ALIAS_MAX], {"v": old_ver}))
+    added = sorted(added)
+    for i in range(0, len(added), chunk_size):
+        part = added[i:i + chunk_size]
+        cond = " OR ".join(f"p.cleaned LIKE :a{j} ESCAPE '\\'" for j in range(len(part)))
+        rows = conn.execute(text(f"""
+            SELECT DISTINCT p.news_id FROM news_proc p
+            JOIN news_entity_linked l ON l.news_id = p.news_id AND l.gaz_version = :v
+            WHERE {cond}
+        """), dict({"v": old_ver}, **{f"a{j}": _like_escape(a) for j, a in enumerate(part)})).fetchall()
+        ids.update(int(r[0]) for r in rows)
+    return ids
+
+def _relink_changed(engine, link, version: str, sig: dict, batch_size: int, throttle_ms: int) -> int:
+    """把以舊版字典連結的文件升到目前版本：只重連結受變更影響的，其餘直接改標版本。"""
+    with engine.begin() as conn:
+        old_vers = [r[0] for r in conn.execute(text(
+            "SELECT DISTINCT gaz_version FROM news_entity_linked WHERE gaz_version <> :v"), {"v": version})]
     total = 0
-    for batch in chunks(rows, batch_size):
+    for ov in old_vers:
+        with engine.begin() as conn:
+            old_json = conn.execute(text("SELECT aliases_json FROM gaz_versions WHERE version = :v"), {"v": ov}).scalar()
+            if old_json is None:
+                # 沒有舊版快照：無從比對，該版連結過的文件全部重做
+                ids = {int(r[0]) for r in conn.execute(text(
+                    "SELECT news_id FROM news_entity_linked WHERE gaz_version = :v"), {"v": ov})}
+            else:
+                removed, added = gazetteer.changed_aliases(json.loads(old_json), sig)
+                ids = _affected_ids(conn, ov, removed, added)
+        ids = sorted(ids)
+        for i in range(0, len(ids), batch_size):
+            with engine.begin() as conn:
+                rows = _in_chunks(conn, "SELECT news_id, cleaned FROM news_proc WHERE news_id IN :ids", ids[i:i + batch_size])
+                _write_links(conn, rows, link, version)
+            if throttle_ms > 0:
+                time.sleep(throttle_ms/1000.0)
+        with engine.begin() as conn:
+            conn.execute(text("UPDATE news_entity_linked SET gaz_version = :v WHERE gaz_version = :ov"), {"v": version, "ov": ov})
+        print(f"字典 {ov[:8]} → {version[:8]}：重連結 {len(ids)} 篇，其餘沿用。")
+        total += len(ids)
+    return total
+
+def run(days:int, limit:int, gaz_path:str, batch_size:int, throttle_ms:int,
+        matcher:str="ac", cache_dir:str=gazetteer.DEFAULT_CACHE_DIR, full:bool=False):
+    engine = create_engine(DB_URL, future=True)
+    ensure_table(engine)
+    ensure_ticker_table(engine)
+    ensure_link_tables(engine)
+    if matcher == "regex":
+        ents = load_gaz(gaz_path)
+        version = gazetteer.file_hash(gaz_path)
+        link = lambda t: _link_regex(t, ents)
+    else:
+        ents, ac, version = gazetteer.load_matcher(gaz_path, load_gaz, cache_dir)
+        link = lambda t: gazetteer.link_document(t, ents, ac)
+    sig = gazetteer.alias_signatures(ents)
+    with engine.begin() as conn:
+        conn.execute(text("""
+            INSERT INTO gaz_versions (version, aliases_json)
+            SELECT :v, :j WHERE NOT EXISTS (SELECT 1 FROM gaz_versions WHERE version = :v)
+        """), {"v": version, "j": json.dumps(sig, ensure_ascii=False)})
+        if full:
+            conn.execute(text("""
+                DELETE l FROM news_entity_linked l JOIN news_proc p ON p.news_id = l.news_id
+                WHERE p.created_at >= DATEADD(day, -:days, GETUTCDATE())
+            """), {"days": days})
+
+    # 1) 字典變更：只重連結含有新增/變更/移除別名的文件
+    _relink_changed(engine, link, version, sig, batch_size, throttle_ms)
+
+    # 2) 新文件：尚未連結過的 news_id（keyset 分頁，id 遞減）
+    total, done, last_id = 0, 0, None
+    while done < limit:
         with engine.begin() as conn:
-            for nid, cleaned in batch:
-                hits = []
-                for e in ents:
-                    m = e["regex"].findall(cleaned or "")
-                    if m:
-                        hits.append({
-                            "ticker": e["ticker"], "name": e["name"], "industry": e["industry"],
-                            "matches": list(m), "count": len(m)
-                        })
-                if hits:
-                    conn.execute(text("""
-                        INSERT INTO news_entity (news_id, matched_json, created_at)
-                        VALUES (:nid, :m, SYSUTCDATETIME())
-                    """), {"nid": int(nid), "m": json.dumps(hits, ensure_ascii=False)})
-                    total += 1
+            rows = conn.execute(text(f'''
+                SELECT TOP (:n) p.news_id, p.cleaned
+                FROM news_proc p
+                WHERE p.created_at >= DATEADD(day, -:days, GETUTCDATE())
+                  {"AND p.news_id < :last_id" if last_id is not None else ""}
+                  AND NOT EXISTS (SELECT 1 FROM news_entity_linked l WHERE l.news_id = p.news_id)
+                  {skip_dups_sql(conn, "p.news_id")}
+                ORDER BY p.news_id DESC
+            '''), {"n": min(batch_size, limit - done), "days": days, "last_id": last_id}).fetchall()
+            if not rows:
+                break
+            total += _write_links(conn, rows, link, version)
+        done += len(rows)
+        last_id = int(rows[-1][0])
         if throttle_ms > 0:
             time.sleep(throttle_ms/1000.0)
-    print(f"已建立實體連結：{total} 篇")
+    print(f"已建立實體連結：{total} 篇（新處理 {done} 篇，字典版本 {version[:8]}）")
 
 if __name__ == "__main__":
     ap = argparse.ArgumentParser()
@@ -76,5 +273,15 @@ if __name__ == "__main__":
     ap.add_argument("--gaz", type=str, default="data/entities/companies.yaml")
     ap.add_argument("--batch-size", type=int, default=200)
     ap.add_argument("--throttle-ms", type=int, default=0)
+    ap.add_argument("--matcher", choices=["ac", "regex"], default="ac", help="ac=Aho–Corasick 單次掃描；regex=逐公司 regex（對照用）")
+    ap.add_argument("--gaz-cache-dir", type=str, default=gazetteer.DEFAULT_CACHE_DIR, help="自動機快取目錄（依 YAML 雜湊命名）")
+    ap.add_argument("--full", action="store_true", help="清掉 --days 內文件的已連結標記後全部重做")
+    ap.add_argument("--backfill-tickers", action="store_true", help="只把既有 matched_json 展開到 news_entity_ticker")
     args = ap.parse_args()
-    run(days=args.days, limit=args.limit, gaz_path=args.gaz, batch_size=args.batch_size, throttle_ms=args.throttle_ms)
+    if args.backfill_tickers:
+        engine = create_engine(DB_URL, future=True)
+        ensure_table(engine)
+        print(f"已補齊 news_entity_ticker：{backfill_ticker_table(engine)} 列")
+        raise SystemExit(0)
+    run(days=args.days, limit=args.limit, gaz_path=args.gaz, batch_size=args.batch_size, throttle_ms=args.throttle_ms,
+        matcher=args.matcher, cache_dir=args.gaz_cache_dir, full=args.full)
@@ -1,19 +1,177 @@
-# RSS 爬取範例（僅骨架，實務請加入來源、重試、去重、robots 檢查）
+# RSS 擷取引擎：共用連線池 + 每主機併發上限 + 條件式 GET + 抖動退避重試 + 串流解析
+# - 所有 feed 共用同一個 httpx.AsyncClient（keep-alive 連線池），每個 host 另有 Semaphore 限流
+# - 帶上次的 ETag / Last-Modified（If-None-Match / If-Modified-Since）；304 代表沒變，不下載內文
+# - 連線錯誤 / 429 / 5xx 以指數退避 + 隨機抖動重試（有 Retry-After 秒數時優先採用）
+# - lxml XMLPullParser 邊收 bytes 邊解析，每個 <item> 結束即產出並釋放節點，記憶體與 feed 大小無關
+import asyncio, random
+from typing import AsyncIterator, Dict, List, Optional, Tuple
+from urllib.parse import urlsplit
 import httpx
-from bs4 import BeautifulSoup
-from typing import List, Dict
+from lxml import etree
+
+USER_AGENT = "finnews-rss/1.0 (+https://example.invalid)"
+RETRY_STATUS = {429, 500, 502, 503, 504}
+
+_FIELDS = ("title", "link", "pubDate", "description")
+
+class _ItemParser:
+    """增量 RSS 解析：feed(bytes) 回傳這段資料裡已完整的 item（欄位同舊版 BeautifulSoup 解析）。"""
+    def __init__(self):
+        self._p = etree.XMLPullParser(events=("end",), resolve_entities=False, no_network=True, recover=True)
+
+    def _drain(self) -> List[Dict]:
+        out = []
+        for _, el in self._p.read_events():
+            if not isinstance(el.tag, str) or etree.QName(el).localname != "item":
+                continue
+            it = dict.fromkeys(_FIELDS, "")
+            for ch in el:
+                if isinstance(ch.tag, str):
+                    name = etree.QName(ch).localname
+                    if name in it and not it[name]:
+                        it[name] = "".join(ch.itertext())
+            out.append(it)
+            # 釋放已處理節點，避免整棵樹留在記憶體
+            el.clear(keep_tail=False)
+            parent = el.getparent()
+            if parent is not None:
+                while el.getprevious() is not None:
+                    del parent[0]
+        return out
+
+    def feed(self, data: bytes) -> List[Dict]:
+        self._p.feed(data)
+        return self._drain()
+
+    def close(self) -> List[Dict]:
+        try:
+            self._p.close()
+        except etree.XMLSyntaxError:
+            pass
+        return self._drain()
+
+def parse_rss(content) -> List[Dict]:
+    p = _ItemParser()
+    items = p.feed(content.encode("utf-8") if isinstance(content, str) else content)
+    return items + p.close()
+
+def _retry_after(resp: httpx.Response) -> Optional[float]:
+    try:
+        return max(float(resp.headers.get("Retry-After", "")), 0.0)
+    except ValueError:
+        return None
+
+class RssIngestor:
+    """用法：
+        async with RssIngestor(per_host=4) as ing:
+            results = await ing.fetch_all(urls, states)   # {url: (items 或 None(未變), new_state, error)}
+    state：{"etag", "last_modified"}（其餘欄位原樣保留）。
+    """
+    def __init__(self, per_host: int = 4, max_connections: int = 64, timeout: float = 15.0,
+                 retries: int = 3, backoff_base: float = 0.5, backoff_max: float = 30.0,
+                 client: Optional[httpx.AsyncClient] = None):
+        self.per_host = max(int(per_host), 1)
+        self.retries = max(int(retries), 0)
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self._own_client = client is None
+        self.client = client or httpx.AsyncClient(
+            timeout=timeout, follow_redirects=True, headers={"User-Agent": USER_AGENT},
+            limits=httpx.Limits(max_connections=max_connections, max_keepalive_connections=max_connections))
+        self._host_sem: Dict[str, asyncio.Semaphore] = {}
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        await self.aclose()
+
+    async def aclose(self):
+        if self._own_client:
+            await self.client.aclose()
+
+    def _sem(self, url: str) -> asyncio.Semaphore:
+        host = urlsplit(url).netloc.lower()
+        if host not in self._host_sem:
+            self._host_sem[host] = asyncio.Semaphore(self.per_host)
+        return self._host_sem[host]
+
+    def _backoff(self, attempt: int, hint: Optional[float] = None) -> float:
+        if hint is not None:
+            return min(hint, self.backoff_max)
+        return min(self.backoff_max, self.backoff_base * (2 ** attempt)) * random.uniform(0.5, 1.5)
+
+    async def _open(self, url: str, state: dict) -> Optional[httpx.Response]:
+        """送出條件式 GET（含重試），回傳尚未讀 body 的串流回應；304 回傳 None。state 就地更新 status。"""
+        headers = {}
+        if state.get("etag"):
+            headers["If-None-Match"] = state["etag"]
+        if state.get("last_modified"):
+            headers["If-Modified-Since"] = state["last_modified"]
+        attempt = 0
+        while True:
+            try:
+                resp = await self.client.send(self.client.build_request("GET", url, headers=headers), stream=True)
+            except httpx.TransportError:
+                if attempt >= self.retries:
+                    raise
+                await asyncio.sleep(self._backoff(attempt))
+                attempt += 1
+                continue
+            if resp.status_code in RETRY_STATUS and attempt < self.retries:
+                await resp.aclose()
+                await asyncio.sleep(self._backoff(attempt, _retry_after(resp)))
+                attempt += 1
+                continue
+            state["status"] = resp.status_code
+            if resp.status_code == 304:
+                await resp.aclose()
+                return None
+            if resp.is_error:
+                await resp.aclose()
+                resp.raise_for_status()
+            return resp
+
+    async def stream(self, url: str, state: dict) -> AsyncIterator[Dict]:
+        """邊下載邊解析，逐筆 yield item；304 時不產出任何 item（state["status"] == 304）。
+        state 會就地更新 status；etag / last_modified 只在整個 body 讀完且解析完才換成新值，
+        中途失敗（或呼叫端提前停止）時保留舊值，下次才不會拿到 304 而永久漏掉沒讀到的 item。"""
+        async with self._sem(url):
+            resp = await self._open(url, state)
+            if resp is None:
+                return
+            try:
+                parser = _ItemParser()
+                async for chunk in resp.aiter_bytes():
+                    for it in parser.feed(chunk):
+                        yield it
+                for it in parser.close():
+                    yield it
+            finally:
+                await resp.aclose()
+            state["etag"] = resp.headers.get("ETag") or state.get("etag")
+            state["last_modified"] = resp.headers.get("Last-Modified") or state.get("last_modified")
+
+    async def fetch(self, url: str, state: Optional[dict] = None):
+        """整個 feed 收成清單；未變更（304）回傳 (None, state)。"""
+        state = dict(state or {})
+        items = [it async for it in self.stream(url, state)]
+        return (None if state.get("status") == 304 else items), state
+
+    async def fetch_all(self, urls: List[str], states: Optional[Dict[str, dict]] = None):
+        states = states or {}
+        async def one(u):
+            try:
+                items, st = await self.fetch(u, states.get(u))
+                return u, (items, st, None)
+            except Exception as e:
+                st = dict(states.get(u) or {})
+                st["status"] = getattr(getattr(e, "response", None), "status_code", None)
+                return u, (None, st, e)
+        return dict(await asyncio.gather(*[one(u) for u in urls]))
 
 async def fetch_rss(url: str) -> List[Dict]:
-    async with httpx.AsyncClient(timeout=15) as client:
-        r = await client.get(url)
-        r.raise_for_status()
-        soup = BeautifulSoup(r.text, "xml")
-        items = []
-        for item in soup.select("item"):
-            items.append({
-                "title": item.title.text if item.title else "",
-                "link": item.link.text if item.link else "",
-                "pubDate": item.pubDate.text if item.pubDate else "",
-                "description": item.description.text if item.description else "",
-            })
-        return items
+    """單一 feed 全量抓取（不帶條件式標頭）；保留給既有呼叫端。"""
+    async with RssIngestor() as ing:
+        items, _ = await ing.fetch(url)
+        return items or []
@@ -0,0 +1,127 @@
+"""公司字典比對：所有別名建成一個 Aho–Corasick 自動機，每篇文章單次掃描即可找出全部公司。
+- 取代「每家公司一個 regex、逐一 findall」的 O(公司數 × 文章數)。
+- 比對結果採 leftmost-longest：同一位置重疊的別名取最長者（例如「台積電」優先於「台積」），不重疊的全部保留。
+- 自動機以 pickle 快取在 <cache_dir>/<yaml 的 sha1>.pkl；YAML 內容不變就直接載入，不必重建。
+"""
+import hashlib, os, pickle
+from collections import deque
+from typing import Dict, List, Tuple
+
+DEFAULT_CACHE_DIR = "out/cache/gaz"
+_CACHE_VERSION = 1
+
+def file_hash(path: str) -> str:
+    with open(path, "rb") as f:
+        return hashlib.sha1(f.read()).hexdigest()
+
+class AhoCorasick:
+    def __init__(self, patterns: Dict[str, List[int]]):
+        """patterns：別名 → 對應的實體索引（同一別名可對到多家公司）。"""
+        self.goto: List[Dict[str, int]] = [{}]
+        self.fail: List[int] = [0]
+        self.term: List[int] = [-1]     # 此節點結束的別名編號（-1 表示無）
+        self.link: List[int] = [0]      # 沿 fail 鏈最近一個有別名結束的節點（0 表示無）
+        self.words: List[str] = []
+        self.payload: List[List[int]] = []
+        for w, ents in patterns.items():
+            if not w:
+                continue
+            s = 0
+            for ch in w:
+                nxt = self.goto[s].get(ch)
+                if nxt is None:
+                    nxt = len(self.goto)
+                    self.goto[s][ch] = nxt
+                    self.goto.append({}); self.fail.append(0); self.term.append(-1); self.link.append(0)
+                s = nxt
+            self.term[s] = len(self.words)
+            self.words.append(w)
+            self.payload.append(list(ents))
+        # BFS 建 fail 鏈（第一層的 fail 固定指回根）
+        q = deque(self.goto[0].values())
+        while q:
+            s = q.popleft()
+            for ch, t in self.goto[s].items():
+                q.append(t)
+                f = self.fail[s]
+                while f and ch not in self.goto[f]:
+                    f = self.fail[f]
+                self.fail[t] = self.goto[f].get(ch, 0)
+                ft = self.fail[t]
+                self.link[t] = ft if self.term[ft] >= 0 else self.link[ft]
+
+    def iter_all(self, text: str):
+        """所有（可重疊）命中：(start, end, 別名編號)。"""
+        goto, fail, term, link, words = self.goto, self.fail, self.term, self.link, self.words
+        s = 0
+        for i, ch in enumerate(text):
+            while s and ch not in goto[s]:
+                s = fail[s]
+            s = goto[s].get(ch, 0)
+            t = s if term[s] >= 0 else link[s]
+            while t:
+                p = term[t]
+                yield i + 1 - len(words[p]), i + 1, p
+                t = link[t]
+
+    def find(self, text: str) -> List[Tuple[int, int, int]]:
+        """leftmost-longest、不重疊的命中。"""
+        hits = sorted(self.iter_all(text or ""), key=lambda h: (h[0], -h[1]))
+        out, end = [], 0
+        for st, en, p in hits:
+            if st >= end:
+                out.append((st, en, p))
+                end = en
+        return out
+
+def build_matcher(ents: List[dict]) -> AhoCorasick:
+    patterns: Dict[str, List[int]] = {}
+    for i, e in enumerate(ents):
+        for a in dict.fromkeys(e["aliases"] + [e["name"]]):
+            if a and i not in patterns.setdefault(a, []):
+                patterns[a].append(i)
+    return AhoCorasick(patterns)
+
+def load_matcher(path: str, ents_loader, cache_dir: str = DEFAULT_CACHE_DIR):
+    """回傳 (ents, matcher, yaml_hash)；快取命中時不重建自動機。ents 不含 regex 欄位。"""
+    h = file_hash(path)
+    fp = os.path.join(cache_dir, f"{h}.pkl")
+    try:
+        with open(fp, "rb") as f:
+            obj = pickle.load(f)
+        if obj.get("version") == _CACHE_VERSION:
+            return obj["ents"], obj["matcher"], h
+    except (OSError, pickle.UnpicklingError, EOFError, AttributeError):
+        pass
+    ents = [{k: v for k, v in e.items() if k != "regex"} for e in ents_loader(path)]
+    matcher = build_matcher(ents)
+    os.makedirs(cache_dir, exist_ok=True)
+    with open(fp + ".tmp", "wb") as f:
+        pickle.dump({"version": _CACHE_VERSION, "ents": ents, "matcher": matcher}, f, protocol=pickle.HIGHEST_PROTOCOL)
+    os.replace(fp + ".tmp", fp)
+    return ents, matcher, h
+
+def link_document(text: str, ents: List[dict], matcher: AhoCorasick) -> List[dict]:
+    """與原 regex 版相同的 matched_json 結構：依字典順序列出命中公司、命中字串與次數。"""
+    found: Dict[int, List[str]] = {}
+    for st, en, p in matcher.find(text or ""):
+        for i in matcher.payload[p]:
+            found.setdefault(i, []).append(text[st:en])
+    return [{"ticker": ents[i]["ticker"], "name": ents[i]["name"], "industry": ents[i]["industry"],
+             "matches": found[i], "count": len(found[i])} for i in sorted(found)]
+
+# ---------------- 版本差異（增量重連結用） ----------------
+def alias_signatures(ents: List[dict]) -> Dict[str, List[list]]:
+    """別名 → 其對應公司的 [ticker, name, industry]（排序後）；兩版字典的差異以此比較。"""
+    sig: Dict[str, List[list]] = {}
+    for e in ents:
+        for a in dict.fromkeys(e["aliases"] + [e["name"]]):
+            if a:
+                sig.setdefault(a, []).append([e["ticker"], e["name"], e["industry"]])
+    return {a: sorted(v, key=lambda x: [str(y) for y in x]) for a, v in sig.items()}
+
+def changed_aliases(old: Dict[str, list], new: Dict[str, list]):
+    """回傳 (舊版中被移除/對應公司有變的別名, 新增的別名)。
+    前者命中過的文件由反向索引找到；後者以前從未命中過，需在文字中搜尋。"""
+    changed = {a for a in set(old) & set(new) if old[a] != new[a]}
+    return (set(old) - set(new)) | changed, set(new) - set(old)
@@ -1,47 +1,114 @@
-import argparse, json
+"""news → news_proc 前處理（清理 → 語言偵測 → 中文簡轉繁 → 斷句）。
+- 待處理新聞以 keyset 分頁（(published_at, id) 遞減，與舊版 ORDER BY published_at DESC 相同：--limit 先處理最新發布的）讀取，不一次 fetchall。
+- --workers > 1：切成 --chunk-size 篇一塊丟給 spawn 程序池；每個 worker 啟動時各自初始化
+  OpenCC 與 langdetect（載入語言 profile 一次），同時在途的塊數有上限，記憶體不隨總量成長。
+- 結果每滿 --commit-every 篇就以 executemany 寫入並 commit 一次，不再整批留在 session 到最後。
+"""
+import argparse, json, time
+from collections import deque
 from datetime import datetime
-from sqlalchemy import create_engine, text
-from sqlalchemy.orm import sessionmaker
+from typing import Iterator, List
+from sqlalchemy import insert, text
 from src.config import DB_URL
 from src.app.storage.models_ext import Base, NewsProc
-from src.app.storage.models import News
 from src.nlp.preprocess import preprocess_document
+from src.utils.bulk_upsert import make_engine
 
-def run(limit: int = 1000, days: int = 90, dry_run: bool = False):
-    engine = create_engine(DB_URL, future=True)
+def _iter_pending(engine, days: int, limit: int, page_size: int) -> Iterator[List[tuple]]:
+    """Keyset pagination（(published_at, id) 遞減）：每頁只取 page_size 篇尚未前處理的新聞，最新發布的先處理。"""
+    last = None
+    left = limit
+    while left > 0:
+        with engine.begin() as conn:
+            rows = conn.execute(text(f'''
+                SELECT TOP (:n) n.id, n.title, n.content, n.source, n.published_at
+                FROM news n
+                WHERE n.published_at >= DATEADD(day, -:days, GETUTCDATE())
+                  {"AND (n.published_at < :lp OR (n.published_at = :lp AND n.id < :lid))" if last else ""}
+                  AND NOT EXISTS (SELECT 1 FROM news_proc p WHERE p.news_id = n.id)
+                ORDER BY n.published_at DESC, n.id DESC
+            '''), {"n": min(page_size, left), "days": days,
+                     "lp": last[0] if last else None, "lid": last[1] if last else None}).fetchall()
+        if not rows:
+            break
+        yield [tuple(r[:4]) for r in rows]
+        last = (rows[-1][4], int(rows[-1][0]))
+        left -= len(rows)
+
+def _chunks(pages, size: int):
+    for page in pages:
+        for i in range(0, len(page), size):
+            yield page[i:i + size]
+
+def _init_worker():
+    # spawn 子程序：OpenCC 於 import 時建立；langdetect 的語言 profile 在第一次偵測時載入，這裡先暖機
+    from src.nlp import preprocess
+    preprocess.detect_lang_legacy("warm up langdetect profiles")
+
+def _preprocess_chunk(rows: List[tuple]) -> List[dict]:
+    out = []
+    now = datetime.utcnow()
+    for rid, title, content, source in rows:
+        r = preprocess_document(title, content, source)
+        out.append({"news_id": int(rid), "lang": r.lang, "cleaned": r.cleaned,
+                    "sentences_json": json.dumps(r.sentences, ensure_ascii=False), "created_at": now})
+    return out
+
+def _write(engine, recs: List[dict]):
+    with engine.begin() as conn:
+        conn.execute(insert(NewsProc.__table__), recs)
+
+def run(limit: int = 1000, days: int = 90, dry_run: bool = False, workers: int = 1,
+        page_size: int = 2000, chunk_size: int = 200, commit_every: int = 1000, throttle_ms: int = 0):
+    engine = make_engine(DB_URL)
     Base.metadata.create_all(engine)
-    Session = sessionmaker(bind=engine, future=True)
-
-    with Session() as s:
-        q = text('''
-            SELECT TOP (:limit) n.id, n.title, n.content, n.published_at
-            FROM news n
-            WHERE n.published_at >= DATEADD(day, -:days, GETUTCDATE())
-              AND NOT EXISTS (SELECT 1 FROM news_proc p WHERE p.news_id = n.id)
-            ORDER BY n.published_at DESC
-        ''')
-        rows = s.execute(q, {"limit": limit, "days": days}).all()
-        cnt = 0
-        for rid, title, content, pub in rows:
-            r = preprocess_document(title, content)
-            rec = NewsProc(
-                news_id=rid,
-                lang=r.lang,
-                cleaned=r.cleaned,
-                sentences_json=json.dumps(r.sentences, ensure_ascii=False),
-                created_at=datetime.utcnow()
-            )
-            if not dry_run:
-                s.add(rec)
-            cnt += 1
-        if not dry_run:
-            s.commit()
-        print(f"完成前處理：{cnt} 筆（dry_run={dry_run})")
+
+    chunks = _chunks(_iter_pending(engine, days, limit, page_size), max(int(chunk_size), 1))
+    cnt, buf = 0, []
+
+    def consume(recs):
+        nonlocal cnt, buf
+        cnt += len(recs)
+        if dry_run:
+            return
+        buf.extend(recs)
+        if len(buf) >= commit_every:
+            _write(engine, buf)
+            buf = []
+            if throttle_ms > 0:
+                time.sleep(throttle_ms / 1000.0)
+
+    workers = max(int(workers), 1)
+    if workers == 1:
+        for ch in chunks:
+            consume(_preprocess_chunk(ch))
+    else:
+        import multiprocessing as mp
+        max_inflight = workers * 2
+        with mp.get_context("spawn").Pool(processes=workers, initializer=_init_worker) as pool:
+            inflight = deque()
+            for ch in chunks:
+                inflight.append(pool.apply_async(_preprocess_chunk, (ch,)))
+                # 在途塊數有上限：先收最早送出的一塊（依序寫入）再繼續讀下一頁
+                while len(inflight) >= max_inflight:
+                    consume(inflight.popleft().get())
+            while inflight:
+                consume(inflight.popleft().get())
+    if buf:
+        _write(engine, buf)
+    print(f"完成前處理：{cnt} 筆（dry_run={dry_run}, workers={workers})")
 
 if __name__ == "__main__":
     ap = argparse.ArgumentParser()
     ap.add_argument("--limit", type=int, default=1000)
     ap.add_argument("--days", type=int, default=90)
     ap.add_argument("--dry-run", action="store_true")
+    ap.add_argument("--workers", type=int, default=1, help=">1 時以多程序平行前處理（spawn）")
+    ap.add_argument("--page-size", type=int, default=2000, help="每頁讀取待處理新聞數（keyset 分頁）")
+    ap.add_argument("--chunk-size", type=int, default=200, help="每個 worker 任務的篇數")
+    ap.add_argument("--commit-every", type=int, default=1000, help="每滿幾篇寫入並 commit 一次")
+    ap.add_argument("--throttle-ms", type=int, default=0)
     args = ap.parse_args()
-    run(limit=args.limit, days=args.days, dry_run=args.dry_run)
+    run(limit=args.limit, days=args.days, dry_run=args.dry_run, workers=args.workers,
+        page_size=args.page_size, chunk_size=args.chunk_size, commit_every=args.commit_every,
+        throttle_ms=args.throttle_ms)
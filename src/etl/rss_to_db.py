@@ -1,53 +1,151 @@
 import asyncio
 import argparse
+import datetime
 from dateutil import parser as dtparser
-from sqlalchemy import create_engine
+from sqlalchemy import insert, select
+from sqlalchemy.exc import IntegrityError
 from sqlalchemy.orm import sessionmaker
 from src.config import DB_URL
-from src.etl.clean import basic_clean
-from src.etl.fetchers.rss_fetcher import fetch_rss
-from src.app.storage.models import Base, News
+from src.utils.bulk_upsert import make_engine
+from src.etl.clean import basic_clean, normalize_url
+from src.etl.fetchers.rss_fetcher import RssIngestor
+from src.app.storage.models import Base, News, FeedState
 
-async def main(urls):
-    engine = create_engine(DB_URL, future=True)
+def _load_states(s, urls):
+    rows = s.execute(select(FeedState).where(FeedState.url.in_(list(urls)))).scalars().all()
+    return {r.url: {"etag": r.etag, "last_modified": r.last_modified, "fail_count": r.fail_count or 0} for r in rows}
+
+def _save_states(s, results, prev=None):
+    """prev：執行前的狀態；抓取失敗的 feed 一律沿用舊的 etag / last_modified，只更新狀態碼與失敗次數。"""
+    now = datetime.datetime.now(datetime.timezone.utc).replace(tzinfo=None)
+    prev = prev or {}
+    for url, (_, st, err) in results.items():
+        if err is not None:
+            old = prev.get(url) or {}
+            st = dict(st, etag=old.get("etag"), last_modified=old.get("last_modified"))
+        s.merge(FeedState(url=url, etag=st.get("etag"), last_modified=st.get("last_modified"),
+                          last_status=st.get("status"),
+                          fail_count=(int(st.get("fail_count") or 0) + 1) if err else 0,
+                          last_fetched_at=now))
+
+_URL_MAX = 512   # News.url 欄寬
+_IN_CHUNK = 500  # 單一 IN 查詢的參數數（SQL Server 上限 2100）
+
+def _existing_urls(s, urls) -> set:
+    urls = list(urls)
+    found = set()
+    for i in range(0, len(urls), _IN_CHUNK):
+        found.update(s.execute(select(News.url).where(News.url.in_(urls[i:i + _IN_CHUNK]))).scalars())
+    return found
+
+def _write_items(Session, batch, seen: set) -> int:
+    """batch: [(feed_url, item)]；以正規化 URL 在記憶體去重（seen 跨批次共用），
+    一個分塊一次 IN 查詢排除 DB 已有的，剩下的整批 executemany 寫入。回傳新增筆數。"""
+    rows, raw = {}, {}
+    for source, item in batch:
+        link = normalize_url(item.get("link") or "")
+        if not link or len(link) > _URL_MAX or link in seen or link in rows:
+            continue
+        pub_raw = item.get("pubDate") or ""
+        try:
+            published_at = dtparser.parse(pub_raw) if pub_raw else None
+        except Exception:
+            published_at = None
+        rows[link] = {"title": basic_clean(item.get("title", "")), "content": basic_clean(item.get("description", "")),
+                      "source": source, "url": link, "published_at": published_at}
+        raw[item["link"].strip()] = link   # 舊資料可能存的是未正規化的原始連結
+    if not rows:
+        return 0
+    seen.update(rows)
+    for attempt in range(2):
+        with Session() as s:
+            have = {raw.get(u, u) for u in _existing_urls(s, set(rows) | set(raw))}
+            new = [r for u, r in rows.items() if u not in have]
+            if not new:
+                return 0
+            try:
+                s.execute(insert(News), new)
+                s.commit()
+                return len(new)
+            except IntegrityError:
+                # 與其他寫入程序撞到同一 URL：回滾後重查一次再寫
+                s.rollback()
+                if attempt:
+                    raise
+    return 0
+
+async def main(urls, per_host:int=4, retries:int=3, timeout:float=15.0, batch_size:int=200):
+    engine = make_engine(DB_URL)
     Base.metadata.create_all(engine)
     Session = sessionmaker(bind=engine, future=True)
 
-    tasks = [fetch_rss(u) for u in urls]
-    results = await asyncio.gather(*tasks, return_exceptions=True)
+    with Session() as s:
+        states = _load_states(s, urls)
 
+    # 各 feed 邊下載邊解析，item 一到就丟進佇列；寫入端湊滿 batch_size 即寫 DB（不等所有 feed 下載完）
+    queue: asyncio.Queue = asyncio.Queue(maxsize=batch_size * 4)
+    results = {}
+    seen = set()
     total = 0
+
+    async def produce(ing, url):
+        st = dict(states.get(url) or {})
+        try:
+            async for item in ing.stream(url, st):
+                await queue.put((url, item))
+            results[url] = (None if st.get("status") == 304 else True, st, None)
+        except Exception as e:
+            st["status"] = getattr(getattr(e, "response", None), "status_code", st.get("status"))
+            results[url] = (None, st, e)
+
+    async def consume():
+        nonlocal total
+        batch = []
+        while True:
+            x = await queue.get()
+            if x is not None:
+                batch.append(x)
+            if batch and (x is None or len(batch) >= batch_size):
+                total += await asyncio.to_thread(_write_items, Session, batch, seen)
+                batch = []
+            if x is None:
+                return
+
+    async def produce_all(ing):
+        await asyncio.gather(*[produce(ing, u) for u in urls])
+        await queue.put(None)
+
+    async with RssIngestor(per_host=per_host, retries=retries, timeout=timeout) as ing:
+        # 寫入端與下載端一起等：寫 DB 失敗時取消下載端（否則它們會卡在佇列已滿的 put 上），例外照常往外拋
+        writer = asyncio.create_task(consume())
+        producers = asyncio.create_task(produce_all(ing))
+        try:
+            await asyncio.gather(writer, producers)
+        except BaseException:
+            for t in (writer, producers):
+                t.cancel()
+            await asyncio.gather(writer, producers, return_exceptions=True)
+            raise
+
+    unchanged = 0
+    for url in urls:
+        res, _, err = results[url]
+        if err is not None:
+            print(f"[WARN] {url} 抓取失敗：{err}")
+        elif res is None:
+            unchanged += 1
     with Session() as s:
-        for url, res in zip(urls, results):
-            if isinstance(res, Exception):
-                print(f"[WARN] {url} 抓取失敗：{res}")
-                continue
-            for item in res:
-                title = basic_clean(item.get("title", ""))
-                content = basic_clean(item.get("description", ""))
-                source = url
-                link = item.get("link") or ""
-                pub_raw = item.get("pubDate") or ""
-                try:
-                    published_at = dtparser.parse(pub_raw) if pub_raw else None
-                except Exception:
-                    published_at = None
-                if not link:
-                    continue
-                n = News(title=title, content=content, source=source, url=link, published_at=published_at)
-                try:
-                    s.add(n)
-                    s.flush()  # 觸發唯一鍵檢查（依賴 uq_news_url）
-                    total += 1
-                except Exception:
-                    s.rollback()
-                    s.begin()
-                    continue
+        _save_states(s, results, states)
         s.commit()
-    print(f"完成抓取，共新增 {total} 筆。")
+    print(f"完成抓取，共新增 {total} 筆（{unchanged} 個 feed 未變更）。")
 
 if __name__ == "__main__":
     ap = argparse.ArgumentParser()
     ap.add_argument("--url", action="append", required=True, help="RSS feed URL，可重複指定")
+    ap.add_argument("--per-host", type=int, default=4, help="同一主機同時連線上限")
+    ap.add_argument("--retries", type=int, default=3, help="連線錯誤 / 429 / 5xx 的重試次數（指數退避 + 抖動）")
+    ap.add_argument("--timeout", type=float, default=15.0)
+    ap.add_argument("--batch-size", type=int, default=200, help="串流解析出的 item 每湊滿幾筆寫一次 DB")
     args = ap.parse_args()
-    asyncio.run(main(args.url))
+    asyncio.run(main(args.url, per_host=args.per_host, retries=args.retries, timeout=args.timeout,
+                     batch_size=args.batch_size))
@@ -1,9 +1,9 @@
 
 from __future__ import annotations
-from dataclasses import dataclass
-from typing import List, Tuple, Dict
+from dataclasses import dataclass, field
+from typing import FrozenSet, List, Sequence, Tuple, Dict
 import yaml
-import jieba
+from src.nlp.zh_tokens import get_tokenizer
 
 @dataclass
 class RuleConfig:
@@ -12,6 +12,21 @@ class RuleConfig:
     negations: List[str]
     intensifiers: List[str]
     dampeners: List[str]
+    # 預先建好的查詢集合（不必每句重建 set）
+    positive_set: FrozenSet[str] = field(init=False, repr=False)
+    negative_set: FrozenSet[str] = field(init=False, repr=False)
+    negations_set: FrozenSet[str] = field(init=False, repr=False)
+    intensifiers_set: FrozenSet[str] = field(init=False, repr=False)
+    dampeners_set: FrozenSet[str] = field(init=False, repr=False)
+
+    def __post_init__(self):
+        for k in ("positive", "negative", "negations", "intensifiers", "dampeners"):
+            setattr(self, f"{k}_set", frozenset(getattr(self, k) or []))
+
+    def words(self) -> List[str]:
+        """詞典全部詞（加入 jieba 字典，避免被切碎）。"""
+        return sorted(self.positive_set | self.negative_set | self.negations_set
+                      | self.intensifiers_set | self.dampeners_set)
 
 def load_lexicon(path: str) -> RuleConfig:
     with open(path, "r", encoding="utf-8") as f:
@@ -24,20 +39,27 @@ def load_lexicon(path: str) -> RuleConfig:
         dampeners=y.get("dampeners", []),
     )
 
-def tokenize_zh(text: str) -> List[str]:
-    return [t.strip() for t in jieba.lcut(text) if t.strip()]
+def tokenize_zh(text: str, cfg: RuleConfig = None) -> List[str]:
+    return get_tokenizer(cfg.words() if cfg else ()).tokenize(text)
 
-def _hits(tokens: List[str], vocab: List[str]) -> List[str]:
-    vs = set(vocab)
+def _hits(tokens: List[str], vocab) -> List[str]:
+    vs = vocab if isinstance(vocab, (set, frozenset)) else set(vocab)
     return [t for t in tokens if t in vs]
 
 def score_sentence_zh(sent: str, cfg: RuleConfig) -> Tuple[int, Dict]:
-    tokens = tokenize_zh(sent)
-    pos_hits = _hits(tokens, cfg.positive)
-    neg_hits = _hits(tokens, cfg.negative)
-    negator_hits = _hits(tokens, cfg.negations)
-    intens_hits = _hits(tokens, cfg.intensifiers)
-    damp_hits = _hits(tokens, cfg.dampeners)
+    return score_tokens_zh(tokenize_zh(sent, cfg), cfg)
+
+def score_sentences_zh(sents: Sequence[str], cfg: RuleConfig, workers: int = 1) -> List[Tuple[int, Dict]]:
+    """整批斷詞（快取 + 可平行）後逐句計分。"""
+    toks = get_tokenizer(cfg.words(), workers=workers).tokenize_many(sents)
+    return [score_tokens_zh(t, cfg) for t in toks]
+
+def score_tokens_zh(tokens: List[str], cfg: RuleConfig) -> Tuple[int, Dict]:
+    pos_hits = _hits(tokens, cfg.positive_set)
+    neg_hits = _hits(tokens, cfg.negative_set)
+    negator_hits = _hits(tokens, cfg.negations_set)
+    intens_hits = _hits(tokens, cfg.intensifiers_set)
+    damp_hits = _hits(tokens, cfg.dampeners_set)
 
     score = len(pos_hits) - len(neg_hits)
     if negator_hits and score != 0:
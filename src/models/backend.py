@@ -0,0 +1,182 @@
+"""句級分類器推論後端（可插拔）：降低 CPU 延遲與常駐記憶體（RSS）。
+- torch      ：原本的 FP32 AutoModelForSequenceClassification（預設）
+- int8       ：torch 動態量化（Linear → qint8），僅 CPU
+- onnx       ：ONNX Runtime（FP32），首次使用自動匯出到 <model_dir>/onnx/model.onnx
+- onnx-int8  ：ONNX Runtime + 動態 INT8 量化（model.int8.onnx）
+各載入點（model_registry / main_strict / infer_transformer / sentence_score）以 INFER_BACKEND 或參數選擇。
+回傳的 model 與 HF 模型介面相容：model(**inputs).logits、.to()、.eval()。
+
+用法：
+  python -m src.models.backend export --model_dir models/bert_sentence_cls --quantize
+  python -m src.models.backend parity --model_dir models/bert_sentence_cls --backend onnx-int8 --split test
+"""
+import argparse, inspect, json, os, sys, time
+from types import SimpleNamespace
+from typing import Optional
+import torch
+from transformers import AutoTokenizer, AutoModelForSequenceClassification
+from src.config import INFER_BACKEND, MODEL_DIR
+
+BACKENDS = ("torch", "int8", "onnx", "onnx-int8")
+
+def _onnx_dir(model_dir: str) -> str:
+    # 本地目錄 -> 放在模型旁；Hub 名稱 -> 放到 MODEL_DIR 下
+    if os.path.isdir(model_dir):
+        return os.path.join(model_dir, "onnx")
+    return os.path.join(MODEL_DIR, model_dir.replace("/", "__"), "onnx")
+
+def onnx_path(model_dir: str, quantized: bool = False) -> str:
+    return os.path.join(_onnx_dir(model_dir), "model.int8.onnx" if quantized else "model.onnx")
+
+def export_onnx(model_dir: str, quantize: bool = False, opset: int = 17, force: bool = False) -> str:
+    """匯出 FP32 ONNX（動態 batch/seq 軸）；quantize=True 時再產生動態 INT8 版本。"""
+    fp32 = onnx_path(model_dir, quantized=False)
+    if force or not os.path.exists(fp32):
+        os.makedirs(os.path.dirname(fp32), exist_ok=True)
+        tok = AutoTokenizer.from_pretrained(model_dir)
+        mdl = AutoModelForSequenceClassification.from_pretrained(model_dir)
+        mdl.eval()
+        enc = tok(["台積電上修資本支出", "利空"], return_tensors="pt", padding=True)
+        names = [k for k in ("input_ids", "attention_mask", "token_type_ids") if k in enc]
+        axes = {k: {0: "batch", 1: "seq"} for k in names}
+        axes["logits"] = {0: "batch"}
+        kw = {}
+        if "dynamo" in inspect.signature(torch.onnx.export).parameters:
+            kw["dynamo"] = False
+        with torch.no_grad():
+            torch.onnx.export(mdl, tuple(enc[k] for k in names), fp32, input_names=names,
+                              output_names=["logits"], dynamic_axes=axes, opset_version=opset, **kw)
+    if not quantize:
+        return fp32
+    q = onnx_path(model_dir, quantized=True)
+    if force or not os.path.exists(q):
+        from onnxruntime.quantization import quantize_dynamic, QuantType
+        quantize_dynamic(fp32, q, weight_type=QuantType.QInt8)
+    return q
+
+class OrtSequenceClassifier:
+    """ONNX Runtime 包裝：介面對齊 HF 模型（只支援 CPU）。"""
+    def __init__(self, path: str, num_threads: int = 0):
+        import onnxruntime as ort
+        so = ort.SessionOptions()
+        if num_threads > 0:
+            so.intra_op_num_threads = num_threads
+        self.path = path
+        self.session = ort.InferenceSession(path, sess_options=so, providers=["CPUExecutionProvider"])
+        self.input_names = [i.name for i in self.session.get_inputs()]
+
+    def __call__(self, **inputs):
+        feed = {}
+        for k in self.input_names:
+            v = inputs.get(k)
+            if v is None and k == "token_type_ids":
+                v = torch.zeros_like(inputs["input_ids"])
+            feed[k] = v.detach().cpu().numpy() if hasattr(v, "detach") else v
+        logits = self.session.run(["logits"], feed)[0]
+        return SimpleNamespace(logits=torch.from_numpy(logits))
+
+    def to(self, *args, **kwargs):
+        return self
+
+    def eval(self):
+        return self
+
+def load_classifier(model_dir: str, backend: Optional[str] = None, num_threads: int = 0):
+    """依 backend 載入 (tokenizer, model)；backend=None 取 INFER_BACKEND。不做回退（Strict）。"""
+    backend = (backend or INFER_BACKEND or "torch").lower()
+    if backend not in BACKENDS:
+        raise ValueError(f"未知的推論後端：{backend}（可用：{', '.join(BACKENDS)}）")
+    tok = AutoTokenizer.from_pretrained(model_dir)
+    if backend in ("onnx", "onnx-int8"):
+        path = export_onnx(model_dir, quantize=(backend == "onnx-int8"))
+        return tok, OrtSequenceClassifier(path, num_threads=num_threads)
+    mdl = AutoModelForSequenceClassification.from_pretrained(model_dir)
+    mdl.eval()
+    if backend == "int8":
+        mdl = torch.ao.quantization.quantize_dynamic(mdl, {torch.nn.Linear}, dtype=torch.qint8)
+    return tok, mdl
+
+# ---------------- 準確度一致性檢查 ----------------
+def _rss_mb() -> Optional[float]:
+    try:
+        import resource
+        r = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return round(r / (1024.0 * 1024.0) if sys.platform == "darwin" else r / 1024.0, 1)
+    except Exception:
+        return None
+
+def _predict(tok, mdl, texts, max_length: int, batch_size: int):
+    probs = []
+    t0 = time.perf_counter()
+    for i in range(0, len(texts), batch_size):
+        enc = tok(texts[i:i+batch_size], return_tensors="pt", truncation=True, padding=True, max_length=max_length)
+        with torch.inference_mode():
+            probs.append(torch.softmax(mdl(**enc).logits, dim=-1))
+    dt = time.perf_counter() - t0
+    return torch.cat(probs) if probs else torch.empty(0, 3), dt
+
+def _run_backend(model_dir: str, backend: str, texts, max_length: int, batch_size: int):
+    """在獨立子程序內執行：ru_maxrss 是程序層級的高水位，兩個後端同程序量測時後者必含前者的模型。"""
+    tok, mdl = load_classifier(model_dir, backend)
+    probs, dt = _predict(tok, mdl, texts, max_length, batch_size)
+    return probs, dt, _rss_mb()
+
+def _run_isolated(model_dir: str, backend: str, texts, max_length: int, batch_size: int):
+    import multiprocessing as mp
+    from concurrent.futures import ProcessPoolExecutor
+    with ProcessPoolExecutor(max_workers=1, mp_context=mp.get_context("spawn")) as ex:
+        return ex.submit(_run_backend, model_dir, backend, texts, max_length, batch_size).result()
+
+def parity(model_dir: str, backend: str, dataset_root: str, split: str = "test",
+           max_length: int = 128, batch_size: int = 16, limit: int = 0) -> dict:
+    """候選後端 vs FP32：標註集準確度、預測一致率、機率最大差、延遲與各自子程序的峰值 RSS。"""
+    from src.models.datasets import default_paths, load_splits
+    df = load_splits(default_paths(dataset_root))[split]
+    if limit > 0:
+        df = df.head(limit)
+    texts = df["sentence"].astype(str).tolist()
+    labels = torch.tensor([int(x) + 1 for x in df["label"]])  # -1/0/1 -> 0/1/2（同 label_mapping.txt）
+
+    # 每個後端各開一個 spawn 子程序，峰值 RSS 互不干擾
+    p_ref, t_ref, rss_ref = _run_isolated(model_dir, "torch", texts, max_length, batch_size)
+    p_c, t_c, rss_c = _run_isolated(model_dir, backend, texts, max_length, batch_size)
+    n = max(len(texts), 1)
+    y_ref, y_c = p_ref.argmax(-1), p_c.argmax(-1)
+    return {
+        "backend": backend, "split": split, "n": len(texts),
+        "acc_fp32": round(float((y_ref == labels).float().mean()), 4) if len(texts) else None,
+        "acc_backend": round(float((y_c == labels).float().mean()), 4) if len(texts) else None,
+        "agreement": round(float((y_ref == y_c).float().mean()), 4) if len(texts) else None,
+        "max_abs_prob_diff": round(float((p_ref - p_c).abs().max()), 6) if len(texts) else None,
+        "ms_per_sent_fp32": round(1000.0 * t_ref / n, 3),
+        "ms_per_sent_backend": round(1000.0 * t_c / n, 3),
+        "peak_rss_mb_fp32": rss_ref,
+        "peak_rss_mb_backend": rss_c,
+    }
+
+if __name__ == "__main__":
+    ap = argparse.ArgumentParser()
+    sub = ap.add_subparsers(dest="cmd", required=True)
+    ex = sub.add_parser("export", help="匯出 ONNX（--quantize 另產生 INT8）")
+    ex.add_argument("--model_dir", type=str, default="models/bert_sentence_cls")
+    ex.add_argument("--quantize", action="store_true")
+    ex.add_argument("--opset", type=int, default=17)
+    ex.add_argument("--force", action="store_true")
+    pa = sub.add_parser("parity", help="候選後端 vs FP32 的準確度一致性檢查")
+    pa.add_argument("--model_dir", type=str, default="models/bert_sentence_cls")
+    pa.add_argument("--backend", choices=BACKENDS, default="onnx-int8")
+    pa.add_argument("--dataset_root", type=str, default="data/processed/dataset_v1")
+    pa.add_argument("--split", choices=["train", "val", "test"], default="test")
+    pa.add_argument("--max_length", type=int, default=128)
+    pa.add_argument("--batch_size", type=int, default=16)
+    pa.add_argument("--limit", type=int, default=0)
+    pa.add_argument("--min-agreement", type=float, default=0.98, help="一致率低於此值則 exit 1")
+    args = ap.parse_args()
+    if args.cmd == "export":
+        print("已匯出：", export_onnx(args.model_dir, quantize=args.quantize, opset=args.opset, force=args.force))
+    else:
+        rep = parity(args.model_dir, args.backend, args.dataset_root, args.split,
+                     args.max_length, args.batch_size, args.limit)
+        print(json.dumps(rep, ensure_ascii=False, indent=2))
+        if rep["agreement"] is not None and rep["agreement"] < args.min_agreement:
+            sys.exit(1)
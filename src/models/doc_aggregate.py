@@ -1,7 +1,17 @@
-"""文級（新聞級）分數彙總（批次 + 節流）。"""
+"""文級（新聞級）分數彙總（批次 + 節流）。
+- 全量：重算近 N 天所有 news_id。
+- 增量（--incremental）：以 news_sent.scored_at 為水位線，只重算有新打分句子的 news_id。
+- 近似重複文（news_dup.cluster_id <> news_id）不彙總，與 build_sentence_dataset / entity_link 一致。
+- 寫入：每個 chunk 先 executemany 進 #doc_stage 暫存表，再以單一 MERGE 整批 upsert。
+"""
 import argparse, time
-from sqlalchemy import create_engine, text
+from sqlalchemy import text, bindparam
 from src.config import DB_URL
+from src.utils.bulk_upsert import make_engine
+from src.utils.watermark import ensure_watermark_table, get_watermark, set_watermark
+from src.etl.dedup_news import skip_dups_sql
+
+JOB_NAME = "doc_aggregate"
 
 def ensure_table(engine):
     from sqlalchemy import Table, MetaData, Column, Integer, Float, DateTime
@@ -17,44 +27,118 @@ def ensure_table(engine):
           Column('created_at', DateTime))
     meta.create_all(engine)
 
-def run(days:int, throttle_ms:int=0):
-    engine = create_engine(DB_URL, future=True)
-    ensure_table(engine)
+def ensure_incremental(engine):
+    ensure_watermark_table(engine)
+    with engine.begin() as conn:
+        conn.execute(text("""
+            IF COL_LENGTH('news_sent', 'scored_at') IS NULL
+                ALTER TABLE news_sent ADD scored_at DATETIME2 NULL
+        """))
+        conn.execute(text("""
+            IF NOT EXISTS (SELECT 1 FROM sys.indexes WHERE name = 'ix_news_sent_scored_at' AND object_id = OBJECT_ID('news_sent'))
+                CREATE INDEX ix_news_sent_scored_at ON news_sent(scored_at) INCLUDE (news_id)
+        """))
+
+def _dirty_news_ids(engine, wm, lag_seconds: int):
+    """水位線之後有新打分句子的 news_id；往回多看 lag_seconds，涵蓋晚提交的並行 worker。"""
+    with engine.begin() as conn:
+        rows = conn.execute(text(f"""
+            SELECT DISTINCT news_id FROM news_sent
+            WHERE scored_at > DATEADD(second, -:lag, :wm)
+              {skip_dups_sql(conn, "news_sent.news_id")}
+        """), {"wm": wm, "lag": int(lag_seconds)}).fetchall()
+        new_wm = conn.execute(text("SELECT MAX(scored_at) FROM news_sent")).scalar()
+    return [int(r[0]) for r in rows], new_wm
+
+def _window_news_ids(engine, days: int):
     with engine.begin() as conn:
-        rows = conn.execute(text('''
-            SELECT s.news_id,
-                   AVG(s.prob_neg) as pneg,
-                   AVG(s.prob_neu) as pneu,
-                   AVG(s.prob_pos) as ppos,
-                   AVG(s.cont_score) as score,
-                   COUNT(*) as n
+        rows = conn.execute(text(f'''
+            SELECT DISTINCT s.news_id
             FROM news_sent s
             WHERE s.cont_score IS NOT NULL
               AND s.created_at >= DATEADD(day, -:days, GETUTCDATE())
-            GROUP BY s.news_id
+              {skip_dups_sql(conn, "s.news_id")}
         '''), {"days": days}).fetchall()
-    engine.dispose()
-    engine = create_engine(DB_URL, future=True)
-    for i, (nid, pneg, pneu, ppos, score, n) in enumerate(rows):
+    return [int(r[0]) for r in rows]
+
+_AGG_SQL = text('''
+    SELECT s.news_id,
+           AVG(s.prob_neg) as pneg,
+           AVG(s.prob_neu) as pneu,
+           AVG(s.prob_pos) as ppos,
+           AVG(s.cont_score) as score,
+           COUNT(*) as n
+    FROM news_sent s
+    WHERE s.cont_score IS NOT NULL
+      AND s.news_id IN :ids
+    GROUP BY s.news_id
+''').bindparams(bindparam('ids', expanding=True))
+
+def _upsert_chunk(conn, rows) -> int:
+    """整批 upsert：暫存表 + 單一 set-based MERGE（取代逐篇 MERGE）。"""
+    if not rows:
+        return 0
+    conn.execute(text("""
+        IF OBJECT_ID('tempdb..#doc_stage') IS NOT NULL DROP TABLE #doc_stage;
+        CREATE TABLE #doc_stage (
+            news_id INT PRIMARY KEY, doc_prob_neg FLOAT, doc_prob_neu FLOAT,
+            doc_prob_pos FLOAT, doc_score FLOAT, n_sents INT
+        );
+    """))
+    conn.execute(text("""
+        INSERT INTO #doc_stage (news_id, doc_prob_neg, doc_prob_neu, doc_prob_pos, doc_score, n_sents)
+        VALUES (:nid, :a, :b, :c, :s, :n)
+    """), [{"nid": int(nid), "a": float(pneg or 0), "b": float(pneu or 0), "c": float(ppos or 0),
+            "s": float(score or 0), "n": int(n or 0)} for nid, pneg, pneu, ppos, score, n in rows])
+    conn.execute(text("""
+        MERGE news_doc_sentiment AS t
+        USING #doc_stage AS src
+        ON (t.news_id = src.news_id)
+        WHEN MATCHED THEN UPDATE SET
+            doc_prob_neg=src.doc_prob_neg, doc_prob_neu=src.doc_prob_neu, doc_prob_pos=src.doc_prob_pos,
+            doc_score=src.doc_score, n_sents=src.n_sents, created_at=SYSUTCDATETIME()
+        WHEN NOT MATCHED THEN INSERT (news_id, doc_prob_neg, doc_prob_neu, doc_prob_pos, doc_score, n_sents, created_at)
+        VALUES (src.news_id, src.doc_prob_neg, src.doc_prob_neu, src.doc_prob_pos, src.doc_score, src.n_sents, SYSUTCDATETIME());
+    """))
+    conn.execute(text("DROP TABLE #doc_stage"))
+    return len(rows)
+
+def run(days:int, throttle_ms:int=0, incremental:bool=False, lag_seconds:int=300, chunk_size:int=1000):
+    engine = make_engine(DB_URL)
+    ensure_table(engine)
+    new_wm = None
+    if incremental:
+        ensure_incremental(engine)
+        wm = get_watermark(engine, JOB_NAME)
+        if wm is None:
+            # 第一次：先做一次近 N 天全量，之後才走水位線
+            with engine.begin() as conn:
+                new_wm = conn.execute(text("SELECT MAX(scored_at) FROM news_sent")).scalar()
+            ids = _window_news_ids(engine, days)
+        else:
+            ids, new_wm = _dirty_news_ids(engine, wm, lag_seconds)
+    else:
+        ids = _window_news_ids(engine, days)
+
+    total = 0
+    for i in range(0, len(ids), chunk_size):
+        part = ids[i:i+chunk_size]
         with engine.begin() as conn:
-            conn.execute(text("""
-                MERGE news_doc_sentiment AS t
-                USING (SELECT :nid AS news_id) AS src
-                ON (t.news_id = src.news_id)
-                WHEN MATCHED THEN UPDATE SET
-                    doc_prob_neg=:a, doc_prob_neu=:b, doc_prob_pos=:c, doc_score=:s,
-                    n_sents=:n, created_at=SYSUTCDATETIME()
-                WHEN NOT MATCHED THEN INSERT (news_id, doc_prob_neg, doc_prob_neu, doc_prob_pos, doc_score, n_sents, created_at)
-                VALUES (:nid, :a, :b, :c, :s, :n, SYSUTCDATETIME());
-            """), {"nid": int(nid), "a": float(pneg or 0), "b": float(pneu or 0), "c": float(ppos or 0),
-                     "s": float(score or 0), "n": int(n or 0)})
+            rows = conn.execute(_AGG_SQL, {"ids": part}).fetchall()
+            total += _upsert_chunk(conn, rows)
         if throttle_ms > 0:
             time.sleep(throttle_ms/1000.0)
-    print(f"已更新文級情緒 {len(rows)} 篇")
+    if incremental and new_wm is not None:
+        set_watermark(engine, JOB_NAME, new_wm)
+    print(f"已更新文級情緒 {total} 篇（{'增量' if incremental else '全量'}）")
 
 if __name__ == "__main__":
     ap = argparse.ArgumentParser()
     ap.add_argument("--days", type=int, default=120)
     ap.add_argument("--throttle-ms", type=int, default=0)
+    ap.add_argument("--incremental", action="store_true", help="只重算水位線之後有新打分句子的 news_id")
+    ap.add_argument("--lag-seconds", type=int, default=300, help="增量模式回看秒數（涵蓋晚提交的並行打分）")
+    ap.add_argument("--chunk-size", type=int, default=1000)
     args = ap.parse_args()
-    run(days=args.days, throttle_ms=args.throttle_ms)
+    run(days=args.days, throttle_ms=args.throttle_ms, incremental=args.incremental,
+        lag_seconds=args.lag_seconds, chunk_size=args.chunk_size)
@@ -1,9 +1,10 @@
 """推論：
 python -m src.models.infer_transformer --model_dir models/bert_sentence_cls --text "台積電上修資本支出"
+python -m src.models.infer_transformer --model_dir models/bert_sentence_cls --backend onnx-int8 --file samples.txt
 """
 import argparse, json
-from transformers import AutoTokenizer, AutoModelForSequenceClassification
 import torch
+from src.models.backend import BACKENDS, load_classifier
 
 ID2LABEL = {0:"neg", 1:"neu", 2:"pos"}
 
@@ -16,8 +17,7 @@ def predict_one(model, tokenizer, text: str, max_length=128):
     return {"text": text, "pred": ID2LABEL[pred], "probs": {"neg": probs[0], "neu": probs[1], "pos": probs[2]}}
 
 def main(args):
-    tok = AutoTokenizer.from_pretrained(args.model_dir)
-    mdl = AutoModelForSequenceClassification.from_pretrained(args.model_dir)
+    tok, mdl = load_classifier(args.model_dir, args.backend)
     if args.text:
         print(json.dumps(predict_one(mdl, tok, args.text, args.max_length), ensure_ascii=False))
     elif args.file:
@@ -35,5 +35,6 @@ if __name__ == "__main__":
     ap.add_argument("--text", type=str, default=None)
     ap.add_argument("--file", type=str, default=None)
     ap.add_argument("--max_length", type=int, default=128)
+    ap.add_argument("--backend", choices=BACKENDS, default=None, help="預設取 INFER_BACKEND")
     args = ap.parse_args()
     main(args)
@@ -0,0 +1,19 @@
+"""長度分桶：把文本依 token 長度排序後切批，減少 padding 浪費。
+- window：每 window 筆為一段，段內排序；可邊算邊依原順序輸出，記憶體有上限。
+- 回傳的是「原始索引」清單，呼叫端自行取文本/寫回結果。
+"""
+from typing import Iterator, List, Optional, Sequence
+
+def iter_length_buckets(lengths: Sequence[int], batch_size: int) -> Iterator[List[int]]:
+    """依長度遞增排序後，每 batch_size 筆 yield 一批原始索引。"""
+    order = sorted(range(len(lengths)), key=lambda i: lengths[i])
+    n = max(int(batch_size), 1)
+    for i in range(0, len(order), n):
+        yield order[i:i+n]
+
+def iter_windows(n_items: int, window: Optional[int]) -> Iterator[range]:
+    """把 [0, n_items) 切成連續視窗；window<=0 或 None 表示單一視窗。"""
+    if not window or window <= 0:
+        window = max(n_items, 1)
+    for s in range(0, n_items, window):
+        yield range(s, min(s + window, n_items))
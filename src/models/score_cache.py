@@ -0,0 +1,172 @@
+"""句子分數快取：同一句話在各家通訊社/轉載間大量重複，不必重算。
+- key = sha1(模型版本 + 命名空間 + 正規化文本)；換模型/後端即自動失效。
+- 兩層：程序內 LRU（OrderedDict）+ 可選的磁碟 SQLite（依檔案大小淘汰最舊的存取）。
+- 存的是 logits（list），各路徑自行轉成機率/分數；ns 參數區分 max_length 等會影響結果的設定。
+- 線上（main_strict / model_registry）與批次（sentence_score）共用同一介面與磁碟檔，並回報命中率。
+"""
+import hashlib, json, os, re, sqlite3, threading, time
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional, Sequence
+from src.config import SCORE_CACHE_DB, SCORE_CACHE_DB_MAX_MB, SCORE_CACHE_SIZE
+
+_WS_RE = re.compile(r"\s+")
+
+def normalize_text(text: str) -> str:
+    t = str(text or "").replace("\u3000", " ").replace("\xa0", " ")
+    return _WS_RE.sub(" ", t).strip()
+
+def model_version(model_dir: str, backend: str = "torch") -> str:
+    """模型版本指紋：目錄/名稱 + 後端 + 權重與 config 的大小/修改時間。"""
+    parts = [str(model_dir), str(backend)]
+    if os.path.isdir(model_dir):
+        for fn in sorted(os.listdir(model_dir)):
+            if fn.endswith((".json", ".safetensors", ".bin")):
+                st = os.stat(os.path.join(model_dir, fn))
+                parts.append(f"{fn}:{st.st_size}:{int(st.st_mtime)}")
+    return hashlib.sha1("|".join(parts).encode("utf-8")).hexdigest()[:16]
+
+class _DiskTier:
+    def __init__(self, path: str, max_mb: float):
+        d = os.path.dirname(path)
+        if d:
+            os.makedirs(d, exist_ok=True)
+        self.max_bytes = int(max_mb * 1024 * 1024)
+        self._lock = threading.Lock()
+        self._puts = 0
+        self.conn = sqlite3.connect(path, timeout=30, check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.execute("CREATE TABLE IF NOT EXISTS score_cache (k TEXT PRIMARY KEY, v TEXT NOT NULL, ts REAL NOT NULL)")
+        self.conn.execute("CREATE INDEX IF NOT EXISTS ix_score_cache_ts ON score_cache(ts)")
+        self.conn.commit()
+
+    def get_many(self, keys: List[str]) -> Dict[str, Any]:
+        out = {}
+        with self._lock:
+            for i in range(0, len(keys), 500):
+                part = keys[i:i+500]
+                q = f"SELECT k, v FROM score_cache WHERE k IN ({','.join('?' * len(part))})"
+                for k, v in self.conn.execute(q, part):
+                    out[k] = json.loads(v)
+            if out:
+                now = time.time()
+                self.conn.executemany("UPDATE score_cache SET ts=? WHERE k=?", [(now, k) for k in out])
+                self.conn.commit()
+        return out
+
+    def put_many(self, items: Dict[str, Any]):
+        if not items:
+            return
+        now = time.time()
+        with self._lock:
+            self.conn.executemany("INSERT OR REPLACE INTO score_cache(k, v, ts) VALUES (?, ?, ?)",
+                                  [(k, json.dumps(v), now) for k, v in items.items()])
+            self.conn.commit()
+            self._puts += len(items)
+            if self._puts >= 1000:
+                self._puts = 0
+                self._evict()
+
+    def _evict(self):
+        page_size = self.conn.execute("PRAGMA page_size").fetchone()[0]
+        pages = self.conn.execute("PRAGMA page_count").fetchone()[0]
+        free = self.conn.execute("PRAGMA freelist_count").fetchone()[0]
+        if (pages - free) * page_size <= self.max_bytes:
+            return
+        n = self.conn.execute("SELECT COUNT(*) FROM score_cache").fetchone()[0]
+        # 超過上限：淘汰最久未存取的 20%（被刪的頁會重用，檔案不再長大）
+        self.conn.execute("DELETE FROM score_cache WHERE k IN (SELECT k FROM score_cache ORDER BY ts ASC LIMIT ?)",
+                          (max(n // 5, 1),))
+        self.conn.commit()
+
+class ScoreCache:
+    def __init__(self, version: str, namespace: str = "logits", capacity: int = SCORE_CACHE_SIZE,
+                 disk_path: Optional[str] = None, disk_max_mb: float = SCORE_CACHE_DB_MAX_MB):
+        self.version = version
+        self.namespace = namespace
+        self.capacity = max(int(capacity), 0)
+        self._mem: "OrderedDict[str, Any]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._disk = _DiskTier(disk_path, disk_max_mb) if disk_path else None
+        self.hits_mem = 0
+        self.hits_disk = 0
+        self.misses = 0
+
+    def key(self, text: str, ns: str = "") -> str:
+        raw = f"{self.version}\x1f{self.namespace}:{ns}\x1f{normalize_text(text)}"
+        return hashlib.sha1(raw.encode("utf-8")).hexdigest()
+
+    def _mem_put(self, k: str, v: Any):
+        if self.capacity <= 0:
+            return
+        self._mem[k] = v
+        self._mem.move_to_end(k)
+        while len(self._mem) > self.capacity:
+            self._mem.popitem(last=False)
+
+    def get_many(self, texts: Sequence[str], ns: str = "") -> List[Optional[Any]]:
+        """回傳與 texts 對齊的清單；未命中為 None。"""
+        keys = [self.key(t, ns) for t in texts]
+        out: List[Optional[Any]] = [None] * len(keys)
+        miss = []
+        with self._lock:
+            for i, k in enumerate(keys):
+                if k in self._mem:
+                    self._mem.move_to_end(k)
+                    out[i] = self._mem[k]
+                    self.hits_mem += 1
+                else:
+                    miss.append(i)
+        if miss and self._disk is not None:
+            found = self._disk.get_many(list({keys[i] for i in miss}))
+            still = []
+            with self._lock:
+                for i in miss:
+                    v = found.get(keys[i])
+                    if v is None:
+                        still.append(i)
+                        continue
+                    out[i] = v
+                    self.hits_disk += 1
+                    self._mem_put(keys[i], v)
+            miss = still
+        with self._lock:
+            self.misses += len(miss)
+        return out
+
+    def put_many(self, texts: Sequence[str], values: Sequence[Any], ns: str = ""):
+        items = {self.key(t, ns): v for t, v in zip(texts, values)}
+        with self._lock:
+            for k, v in items.items():
+                self._mem_put(k, v)
+        if self._disk is not None:
+            self._disk.put_many(items)
+
+    def get(self, text: str, ns: str = "") -> Optional[Any]:
+        return self.get_many([text], ns)[0]
+
+    def put(self, text: str, value: Any, ns: str = ""):
+        self.put_many([text], [value], ns)
+
+    def stats(self) -> dict:
+        with self._lock:
+            hits = self.hits_mem + self.hits_disk
+            total = hits + self.misses
+            return {
+                "version": self.version,
+                "namespace": self.namespace,
+                "mem_items": len(self._mem),
+                "capacity": self.capacity,
+                "disk": bool(self._disk),
+                "hits_mem": self.hits_mem,
+                "hits_disk": self.hits_disk,
+                "misses": self.misses,
+                "hit_rate": round(hits / total, 4) if total else None,
+            }
+
+def from_env(model_dir: str, backend: str, namespace: str = "logits") -> Optional[ScoreCache]:
+    """依 SCORE_CACHE_SIZE / SCORE_CACHE_DB 建立快取；兩者皆為 0/空 則不啟用。"""
+    if SCORE_CACHE_SIZE <= 0 and not SCORE_CACHE_DB:
+        return None
+    return ScoreCache(model_version(model_dir, backend), namespace=namespace,
+                      capacity=SCORE_CACHE_SIZE, disk_path=SCORE_CACHE_DB or None)
@@ -1,13 +1,21 @@
 """穩定版：句級連續情緒打分（避免閃退）。
 - 小 batch 預設、裝置自動選擇與 CPU 回退、顯存比例限制、批次節流。
+- --workers N：依 id 取模分片到多個 CPU 程序，每程序固定 torch 執行緒數、各自一份模型。
+- 分數快取（模型版本 + 正規化文本雜湊）：與 API 共用 SCORE_CACHE_DB 磁碟層；頁內重複句只推論一次。
+- Keyset 分頁串流讀取待打分句子；頁內依 token 長度分桶減少 padding；每批一次 executemany 寫回。
 用法：
   python -m src.models.sentence_score --model_dir models/bert_sentence_cls --days 120 --limit 20000 --auto_tune --throttle-ms 50
+  python -m src.models.sentence_score --model_dir models/bert_sentence_cls --days 120 --limit 200000 --workers 4 --threads-per-worker 2
 """
 import argparse, time
-from sqlalchemy import create_engine, text
-from transformers import AutoTokenizer, AutoModelForSequenceClassification
+from sqlalchemy import text
 import torch
-from src.config import DB_URL
+from src.config import DB_URL, INFER_BACKEND
+from src.models.backend import BACKENDS, export_onnx, load_classifier
+from src.models import score_cache
+from src.models.length_bucket import iter_length_buckets
+from src.etl.dedup_news import skip_dups_sql
+from src.utils.bulk_upsert import make_engine
 
 def ensure_columns(engine):
     with engine.begin() as conn:
@@ -16,6 +24,11 @@ def ensure_columns(engine):
                 IF COL_LENGTH('news_sent', '{col}') IS NULL
                     ALTER TABLE news_sent ADD {col} FLOAT NULL
             """))
+        # scored_at：doc_aggregate --incremental 以此為水位線，只重算新打分的 news_id
+        conn.execute(text("""
+            IF COL_LENGTH('news_sent', 'scored_at') IS NULL
+                ALTER TABLE news_sent ADD scored_at DATETIME2 NULL
+        """))
 
 def _auto_tune(args):
     try:
@@ -46,13 +59,77 @@ def _pick_device(args):
         return torch.device("cuda" if torch.cuda.is_available() else "cpu")
     return torch.device("cuda" if torch.cuda.is_available() else "cpu")
 
+def _iter_pending(engine, days:int, limit:int, page_size:int, shard=None):
+    """Keyset pagination（id 遞減）：每次只取一頁，不一次 fetchall 全部待打分句子。
+    shard=(k, n)：只取 id % n == k 的列，多 worker 間互不重疊。
+    近似重複文（news_dup）的句子不打分：句級資料建立後才被標為重複的文也會在這裡略過。
+    """
+    last_id = None
+    shard_sql = "AND id % :n_shards = :shard" if shard else ""
+    k, n_shards = shard if shard else (0, 1)
+    with engine.begin() as conn:
+        skip_sql = skip_dups_sql(conn, "news_sent.news_id")
+    left = limit
+    while left > 0:
+        n = min(page_size, left)
+        with engine.begin() as conn:
+            rows = conn.execute(text(f'''
+                SELECT TOP (:n) id, sentence
+                FROM news_sent
+                WHERE created_at >= DATEADD(day, -:days, GETUTCDATE())
+                  AND cont_score IS NULL
+                  {"AND id < :last_id" if last_id is not None else ""}
+                  {shard_sql}
+                  {skip_sql}
+                ORDER BY id DESC
+            '''), {"n": n, "days": days, "last_id": last_id, "shard": k, "n_shards": n_shards}).fetchall()
+        if not rows:
+            break
+        yield rows
+        last_id = int(rows[-1][0])
+        left -= len(rows)
+
+def _infer_logits(tok, mdl, dev, texts, max_length:int):
+    try:
+        inputs = tok(texts, return_tensors="pt", truncation=True, padding=True, max_length=max_length)
+        inputs = {k: v.to(dev) for k, v in inputs.items()}
+        with torch.inference_mode():
+            logits = mdl(**inputs).logits.float().cpu().tolist()
+    except Exception:
+        dev = torch.device("cpu"); mdl.to(dev)
+        inputs = tok(texts, return_tensors="pt", truncation=True, padding=True, max_length=max_length)
+        with torch.inference_mode():
+            logits = mdl(**inputs).logits.float().tolist()
+    return logits, dev
+
+def _softmax(logits):
+    return torch.softmax(torch.tensor(logits, dtype=torch.float32), dim=-1).tolist() if logits else []
+
+def _write_scores(engine, ids, probs):
+    """整批一次 executemany（pyodbc 下為 fast_executemany），取代逐句 UPDATE。"""
+    params = [{"a": float(p[0]), "b": float(p[1]), "c": float(p[2]),
+               "s": float((-1)*p[0] + 0*p[1] + 1*p[2]), "rid": int(rid)}
+              for rid, p in zip(ids, probs)]
+    if not params:
+        return 0
+    with engine.begin() as conn:
+        conn.execute(text("""
+            UPDATE news_sent SET prob_neg=:a, prob_neu=:b, prob_pos=:c, cont_score=:s, scored_at=SYSUTCDATETIME()
+            WHERE id=:rid AND cont_score IS NULL
+        """), params)
+    return len(params)
+
 def run(model_dir: str, days:int, limit:int, max_length:int=128, batch_size:int=4,
-        device:str="auto", mem_fraction:float=0.0, auto_tune:bool=False, throttle_ms:int=0):
-    engine = create_engine(DB_URL, future=True)
+        device:str="auto", mem_fraction:float=0.0, auto_tune:bool=False, throttle_ms:int=0,
+        page_size:int=2000, shard=None, num_threads:int=0, backend:str=None):
+    if num_threads > 0:
+        # 固定 intra-op 執行緒數，多 worker 時避免互搶核心
+        torch.set_num_threads(num_threads)
+    engine = make_engine(DB_URL)
     ensure_columns(engine)
 
-    tok = AutoTokenizer.from_pretrained(model_dir)
-    mdl = AutoModelForSequenceClassification.from_pretrained(model_dir)
+    tok, mdl = load_classifier(model_dir, backend, num_threads=num_threads)
+    cache = score_cache.from_env(model_dir, backend or INFER_BACKEND)
 
     class _A: pass
     a = _A(); a.device=device; a.mem_fraction=mem_fraction; a.batch_size=batch_size; a.max_length=max_length
@@ -64,47 +141,72 @@ def run(model_dir: str, days:int, limit:int, max_length:int=128, batch_size:int=
     except Exception:
         dev = torch.device("cpu"); mdl.to(dev)
 
-    with engine.begin() as conn:
-        rows = conn.execute(text('''
-            SELECT TOP (:limit) id, sentence
-            FROM news_sent
-            WHERE created_at >= DATEADD(day, -:days, GETUTCDATE())
-              AND cont_score IS NULL
-            ORDER BY id DESC
-        '''), {"limit": limit, "days": days}).fetchall()
-
-    def chunks(lst, n):
-        for i in range(0, len(lst), n):
-            yield lst[i:i+n]
-
     count = 0
-    for batch in chunks(rows, a.batch_size):
-        ids = [r[0] for r in batch]
-        texts = [r[1] for r in batch]
-        try:
-            inputs = tok(texts, return_tensors="pt", truncation=True, padding=True, max_length=a.max_length)
-            inputs = {k: v.to(dev) for k, v in inputs.items()}
-            with torch.inference_mode():
-                out = mdl(**inputs)
-                probs = torch.softmax(out.logits, dim=-1).cpu().tolist()
-        except Exception:
-            dev = torch.device("cpu"); mdl.to(dev)
-            inputs = tok(texts, return_tensors="pt", truncation=True, padding=True, max_length=a.max_length)
-            with torch.inference_mode():
-                out = mdl(**inputs)
-                probs = torch.softmax(out.logits, dim=-1).tolist()
+    real_tok = padded_tok = 0
+    for rows in _iter_pending(engine, days, limit, page_size, shard=shard):
+        ids = [r[0] for r in rows]
+        texts = [r[1] or "" for r in rows]
+        # 先查快取：命中的直接寫回；頁內重複句只算一次
+        ns = str(a.max_length)
+        cached = cache.get_many(texts, ns=ns) if cache is not None else [None] * len(texts)
+        hit = [i for i, c in enumerate(cached) if c is not None]
+        count += _write_scores(engine, [ids[i] for i in hit], _softmax([cached[i] for i in hit]))
+        groups = {}
+        for i, c in enumerate(cached):
+            if c is None:
+                groups.setdefault(score_cache.normalize_text(texts[i]), []).append(i)
+        uniq = [g[0] for g in groups.values()]
+        if not uniq:
+            continue
+        # 頁內依 token 長度分桶：同批句長相近，pad token 大幅減少
+        lengths = [len(x) for x in tok([texts[i] for i in uniq], truncation=True, max_length=a.max_length)["input_ids"]]
+        for bucket in iter_length_buckets(lengths, a.batch_size):
+            b_idx = [uniq[j] for j in bucket]
+            logits, dev = _infer_logits(tok, mdl, dev, [texts[i] for i in b_idx], a.max_length)
+            if cache is not None:
+                cache.put_many([texts[i] for i in b_idx], logits, ns=ns)
+            probs = _softmax(logits)
+            w_ids, w_probs = [], []
+            for i, p in zip(b_idx, probs):
+                for k in groups[score_cache.normalize_text(texts[i])]:
+                    w_ids.append(ids[k]); w_probs.append(p)
+            count += _write_scores(engine, w_ids, w_probs)
+            ls = [lengths[j] for j in bucket]
+            real_tok += sum(ls); padded_tok += max(ls) * len(ls)
+            if throttle_ms > 0:
+                time.sleep(throttle_ms/1000.0)
+    pad = 0.0 if padded_tok == 0 else 1.0 - real_tok / padded_tok
+    tag = f"[shard {shard[0]}/{shard[1]}] " if shard else ""
+    hit_rate = (cache.stats()["hit_rate"] or 0.0) if cache is not None else 0.0
+    print(f"{tag}已更新句級連續分數：{count} 句（padding 比例 {pad:.1%}，快取命中率 {hit_rate:.1%}）")
+    return count
 
-        scores = [(-1)*p[0] + 0*p[1] + 1*p[2] for p in probs]
-        with engine.begin() as conn:
-            for rid, p, s in zip(ids, probs, scores):
-                conn.execute(text("""
-                    UPDATE news_sent SET prob_neg=:a, prob_neu=:b, prob_pos=:c, cont_score=:s
-                    WHERE id=:rid
-                """), {"a": float(p[0]), "b": float(p[1]), "c": float(p[2]), "s": float(s), "rid": int(rid)})
-                count += 1
-        if throttle_ms > 0:
-            time.sleep(throttle_ms/1000.0)
-    print(f"已更新句級連續分數：{count} 句")
+def _worker_main(kwargs):
+    # spawn 出來的子程序：各自載入一份模型、各自的 DB 連線與執行緒預算
+    return run(**kwargs)
+
+def run_parallel(workers:int, threads_per_worker:int=0, **kwargs):
+    """多程序 CPU 分片：依 id % workers 切分待打分句子，每個 worker 固定 torch 執行緒數。
+    分片互斥 + UPDATE 只寫 cont_score IS NULL，合併回 DB 不會重複打分。
+    """
+    import multiprocessing as mp, os
+    workers = max(int(workers), 1)
+    if threads_per_worker <= 0:
+        threads_per_worker = max((os.cpu_count() or 1) // workers, 1)
+    per_limit = -(-int(kwargs.pop("limit")) // workers)
+    backend = kwargs.get("backend") or INFER_BACKEND
+    if backend in ("onnx", "onnx-int8"):
+        # 先在父程序匯出一次，避免多個 worker 同時寫同一個 .onnx
+        export_onnx(kwargs["model_dir"], quantize=(backend == "onnx-int8"))
+    kwargs["device"] = "cpu"
+    jobs = [dict(kwargs, limit=per_limit, shard=(k, workers), num_threads=threads_per_worker)
+            for k in range(workers)]
+    ctx = mp.get_context("spawn")
+    with ctx.Pool(processes=workers) as pool:
+        counts = pool.map(_worker_main, jobs)
+    total = int(sum(counts))
+    print(f"已更新句級連續分數：{total} 句（{workers} workers × {threads_per_worker} threads）")
+    return total
 
 if __name__ == "__main__":
     ap = argparse.ArgumentParser()
@@ -117,7 +219,19 @@ if __name__ == "__main__":
     ap.add_argument("--mem_fraction", type=float, default=0.0)
     ap.add_argument("--auto_tune", action="store_true")
     ap.add_argument("--throttle-ms", type=int, default=0)
+    ap.add_argument("--page-size", type=int, default=2000, help="每頁讀取待打分句數（keyset 分頁）")
+    ap.add_argument("--workers", type=int, default=1, help=">1 時以多程序 CPU 分片打分")
+    ap.add_argument("--threads-per-worker", type=int, default=0, help="每個 worker 的 torch 執行緒數；0=核心數/worker 數")
+    ap.add_argument("--backend", choices=BACKENDS, default=None, help="推論後端；預設取 INFER_BACKEND")
     args = ap.parse_args()
-    run(model_dir=args.model_dir, days=args.days, limit=args.limit, max_length=args.max_length,
-        batch_size=args.batch_size, device=args.device, mem_fraction=args.mem_fraction,
-        auto_tune=args.auto_tune, throttle_ms=args.throttle_ms)
+    if args.workers > 1:
+        run_parallel(workers=args.workers, threads_per_worker=args.threads_per_worker,
+                     model_dir=args.model_dir, days=args.days, limit=args.limit, max_length=args.max_length,
+                     batch_size=args.batch_size, mem_fraction=args.mem_fraction,
+                     auto_tune=args.auto_tune, throttle_ms=args.throttle_ms, page_size=args.page_size,
+                     backend=args.backend)
+    else:
+        run(model_dir=args.model_dir, days=args.days, limit=args.limit, max_length=args.max_length,
+            batch_size=args.batch_size, device=args.device, mem_fraction=args.mem_fraction,
+            auto_tune=args.auto_tune, throttle_ms=args.throttle_ms, page_size=args.page_size,
+            backend=args.backend)
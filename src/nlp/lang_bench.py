@@ -0,0 +1,60 @@
+"""語言偵測基準測試：原做法（整篇 langdetect）vs 分層偵測（文字系統比例 → 來源快取 → langdetect 前綴）。
+輸出耗時、整體一致率、各 tier 筆數與一致率、混淆表；不一致的樣本寫到 out/nlp/lang_disagree.csv。
+
+用法：
+python -m src.nlp.lang_bench --limit 5000                 # 從 news 取最近 N 篇
+python -m src.nlp.lang_bench --csv samples.csv            # 本地檔案（欄位 title, content[, source]）
+"""
+import argparse, os, time
+import pandas as pd
+from src.nlp.preprocess import LangDetector, clean_text, detect_lang_legacy
+
+def _load_db(limit: int) -> pd.DataFrame:
+    from sqlalchemy import create_engine, text
+    from src.config import DB_URL
+    engine = create_engine(DB_URL, future=True)
+    with engine.begin() as conn:
+        rows = conn.execute(text("""
+            SELECT TOP (:n) n.title, n.content, n.source FROM news n ORDER BY n.id DESC
+        """), {"n": limit}).fetchall()
+    return pd.DataFrame(rows, columns=["title", "content", "source"])
+
+def run(limit: int = 5000, csv: str = None, outdir: str = "out/nlp") -> dict:
+    df = pd.read_csv(csv) if csv else _load_db(limit)
+    if "source" not in df.columns:
+        df["source"] = None
+    df = df.where(df.notna(), None)
+    texts = [clean_text(f"{t or ''}。{c or ''}".strip("。")) for t, c in zip(df["title"], df["content"])]
+    sources = df["source"].tolist()
+
+    t0 = time.perf_counter()
+    legacy = [detect_lang_legacy(t) if t else "unknown" for t in texts]
+    t_legacy = time.perf_counter() - t0
+
+    det = LangDetector()
+    t0 = time.perf_counter()
+    tiered = [det.classify(t, s) if t else ("unknown", "empty") for t, s in zip(texts, sources)]
+    t_tiered = time.perf_counter() - t0
+
+    res = pd.DataFrame({"source": sources, "legacy": legacy,
+                        "tiered": [x[0] for x in tiered], "tier": [x[1] for x in tiered], "text": texts})
+    res["agree"] = res["legacy"] == res["tiered"]
+    by_tier = res.groupby("tier")["agree"].agg(n="size", agreement="mean")
+    print(f"文件數：{len(res)}")
+    print(f"langdetect 全文：{t_legacy:.3f}s；分層：{t_tiered:.3f}s（{t_legacy / max(t_tiered, 1e-9):.1f}x）")
+    print(f"整體一致率：{res['agree'].mean():.4f}")
+    print(by_tier.to_string())
+    print(pd.crosstab(res["legacy"], res["tiered"]).to_string())
+
+    os.makedirs(outdir, exist_ok=True)
+    res.loc[~res["agree"], ["source", "legacy", "tiered", "tier", "text"]].assign(text=lambda d: d["text"].str[:200]) \
+       .to_csv(os.path.join(outdir, "lang_disagree.csv"), index=False, encoding="utf-8-sig")
+    return {"n": len(res), "legacy_sec": t_legacy, "tiered_sec": t_tiered, "agreement": float(res["agree"].mean())}
+
+if __name__ == "__main__":
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--limit", type=int, default=5000)
+    ap.add_argument("--csv", type=str, default=None, help="改用本地 CSV（title, content[, source]）")
+    ap.add_argument("--outdir", type=str, default="out/nlp")
+    args = ap.parse_args()
+    run(limit=args.limit, csv=args.csv, outdir=args.outdir)
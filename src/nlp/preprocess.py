@@ -19,7 +19,8 @@ def clean_text(text: str) -> str:
     t = strip_boilerplate(t)
     return t
 
-def detect_lang(text: str) -> str:
+def detect_lang_legacy(text: str) -> str:
+    """原做法：整篇丟給 langdetect（保留作為對照基準，見 src/nlp/lang_bench.py）。"""
     try:
         lg = detect(text)
         if lg.startswith("zh"):
@@ -28,6 +29,75 @@ def detect_lang(text: str) -> str:
     except Exception:
         return "unknown"
 
+# 分層語言偵測：先看前 PREFIX_CHARS 字的文字系統比例，能確定就直接回傳，模稜兩可才交給 langdetect
+PREFIX_CHARS = 1000
+_HAN = re.compile(r"[\u3400-\u4dbf\u4e00-\u9fff\uf900-\ufaff]")
+_KANA = re.compile(r"[\u3040-\u30ff]")
+_HANGUL = re.compile(r"[\uac00-\ud7af\u1100-\u11ff]")
+_LATIN = re.compile(r"[A-Za-z]")
+_EN_WORD = re.compile(r"[A-Za-z]+")
+_EN_STOP = frozenset("the a an and or of to in on for with by from at is are was were be has have that this it as".split())
+
+class LangDetector:
+    """tier：script（文字系統比例）→ source（同來源歷來判定一致）→ langdetect（只看前綴）。
+    同一來源以 script 判定過 >= source_min 篇且某語言佔 >= source_share，模稜兩可的文章直接沿用。"""
+    def __init__(self, prefix_chars: int = PREFIX_CHARS, source_min: int = 20, source_share: float = 0.95):
+        self.prefix_chars = prefix_chars
+        self.source_min = source_min
+        self.source_share = source_share
+        self._by_source = {}
+
+    def _script(self, t: str):
+        han = len(_HAN.findall(t))
+        kana = len(_KANA.findall(t))
+        hangul = len(_HANGUL.findall(t))
+        latin = len(_LATIN.findall(t))
+        total = han + kana + hangul + latin
+        if total == 0:
+            return None
+        if kana >= 0.1 * (han + kana) and kana >= 2:
+            return "ja"
+        if hangul >= 0.3 * total:
+            return "ko"
+        if han >= 0.5 * total:
+            return "zh"
+        if latin >= 40 and latin >= 0.9 * total and han == 0:
+            words = [w.lower() for w in _EN_WORD.findall(t)]
+            if words and sum(w in _EN_STOP for w in words) >= 0.1 * len(words):
+                return "en"
+        return None
+
+    def _from_source(self, source):
+        st = self._by_source.get(source)
+        if not st:
+            return None
+        n = sum(st.values())
+        lang, k = max(st.items(), key=lambda kv: kv[1])
+        return lang if n >= self.source_min and k >= self.source_share * n else None
+
+    def classify(self, text: str, source=None):
+        """回傳 (lang, tier)；tier ∈ {"script", "source", "langdetect"}。"""
+        t = (text or "")[:self.prefix_chars]
+        lang = self._script(t)
+        if lang is not None:
+            if source is not None:
+                st = self._by_source.setdefault(source, {})
+                st[lang] = st.get(lang, 0) + 1
+            return lang, "script"
+        if source is not None:
+            lang = self._from_source(source)
+            if lang is not None:
+                return lang, "source"
+        return detect_lang_legacy(t), "langdetect"
+
+    def detect(self, text: str, source=None) -> str:
+        return self.classify(text, source)[0]
+
+_detector = LangDetector()
+
+def detect_lang(text: str, source=None) -> str:
+    return _detector.detect(text, source)
+
 def convert_zh(text: str) -> str:
     try:
         return cc.convert(text)
@@ -40,10 +110,10 @@ class PreprocResult:
     cleaned: str
     sentences: List[str]
 
-def preprocess_document(title: str, content: str) -> PreprocResult:
+def preprocess_document(title: str, content: str, source=None) -> PreprocResult:
     raw = f"{title or ''}。{content or ''}".strip("。")
     raw = clean_text(raw)
-    lang = detect_lang(raw) if raw else "unknown"
+    lang = detect_lang(raw, source) if raw else "unknown"
     if lang == "zh":
         raw = convert_zh(raw)
     from .sent_tokenize import split_any
@@ -1,23 +1,47 @@
 """事件脈絡：YAKE 關鍵詞 +（可選）LDA。資源友善。
 預設不跑 LDA，並限制最大文件數與節流。
+LDA 的斷詞走共用斷詞層（src/nlp/zh_tokens.py）：以 news_proc.sentences_json 逐句斷詞，
+與 build_sentence_dataset 共用同一份句子快取（同一 --lexicon 時），不再整篇重斷。
 """
 import argparse, json, time
 from datetime import datetime
 from sqlalchemy import create_engine, text
 from src.config import DB_URL
-import jieba
+from src.nlp import zh_tokens
 
 def fetch_docs(days:int, limit:int, max_docs:int):
     engine = create_engine(DB_URL, future=True)
     with engine.begin() as conn:
         rows = conn.execute(text('''
-            SELECT TOP (:limit) news_id, cleaned
+            SELECT TOP (:limit) news_id, cleaned, sentences_json
             FROM news_proc
             WHERE created_at >= DATEADD(day, -:days, GETUTCDATE())
             ORDER BY news_id DESC
         '''), {"limit": min(limit, max_docs), "days": days}).all()
     return rows
 
+def _lexicon_words(path: str):
+    """與 build_sentence_dataset 相同的詞典詞（斷詞結果與快取版本才會一致）；檔案不存在時不加詞。"""
+    try:
+        from src.label.weak_rules import load_lexicon
+        return load_lexicon(path).words()
+    except OSError:
+        return []
+
+def _doc_tokens(rows, tok):
+    """每篇的斷詞串流 = 各句斷詞結果串接；沒有句子時退回整篇。整批一次查快取 / 斷詞。"""
+    spans, texts = [], []
+    for _, cleaned, sjson in rows:
+        try:
+            sents = json.loads(sjson) if sjson else []
+        except Exception:
+            sents = []
+        sents = [x for x in sents if x] or [cleaned or ""]
+        spans.append((len(texts), len(texts) + len(sents)))
+        texts.extend(sents)
+    toks = tok.tokenize_many(texts)
+    return [[t for part in toks[a:b] for t in part] for a, b in spans]
+
 def ensure_table(engine):
     from sqlalchemy import Table, MetaData, Column, Integer, UnicodeText, DateTime
     meta = MetaData()
@@ -29,7 +53,8 @@ def ensure_table(engine):
           Column('created_at', DateTime))
     meta.create_all(engine)
 
-def run(days:int, limit:int, do_lda:bool, topk:int, max_docs:int, lda_topics:int, lda_passes:int, throttle_ms:int):
+def run(days:int, limit:int, do_lda:bool, topk:int, max_docs:int, lda_topics:int, lda_passes:int, throttle_ms:int,
+        lexicon_path:str="data/lexicon/zh_sentiment.yaml", workers:int=1):
     rows = fetch_docs(days, limit, max_docs)
     engine = create_engine(DB_URL, future=True)
     ensure_table(engine)
@@ -41,14 +66,16 @@ def run(days:int, limit:int, do_lda:bool, topk:int, max_docs:int, lda_topics:int
     doc_topics = None
     if do_lda and rows:
         from gensim import corpora, models
-        docs_tokens = [[t for t in jieba.lcut(cleaned or "") if t.strip()] for _, cleaned in rows]
+        tok = zh_tokens.get_tokenizer(_lexicon_words(lexicon_path), workers=workers)
+        docs_tokens = _doc_tokens(rows, tok)
+        tok.close()
         dictionary = corpora.Dictionary(docs_tokens)
         corpus = [dictionary.doc2bow(toks) for toks in docs_tokens]
         lda_model = models.LdaModel(corpus=corpus, id2word=dictionary, num_topics=lda_topics, passes=lda_passes)
         doc_topics = [lda_model.get_document_topics(bow) for bow in corpus]
 
     with engine.begin() as conn:
-        for idx, (news_id, cleaned) in enumerate(rows):
+        for idx, (news_id, cleaned, _) in enumerate(rows):
             kphr = kw_extractor.extract_keywords(cleaned or "")
             kphr = [k for k,score in kphr]
             lda = None
@@ -76,6 +103,9 @@ if __name__ == "__main__":
     ap.add_argument("--lda-topics", type=int, default=6)
     ap.add_argument("--lda-passes", type=int, default=3)
     ap.add_argument("--throttle-ms", type=int, default=0)
+    ap.add_argument("--lexicon", type=str, default="data/lexicon/zh_sentiment.yaml", help="加入 jieba 字典的詞（與 build_sentence_dataset 一致才共用快取）")
+    ap.add_argument("--workers", type=int, default=1, help=">1 時未命中快取的句子以多程序斷詞")
     args = ap.parse_args()
     run(days=args.days, limit=args.limit, do_lda=(not args.no_lda), topk=args.topk,
-        max_docs=args.max_docs, lda_topics=args.lda_topics, lda_passes=args.lda_passes, throttle_ms=args.throttle_ms)
+        max_docs=args.max_docs, lda_topics=args.lda_topics, lda_passes=args.lda_passes, throttle_ms=args.throttle_ms,
+        lexicon_path=args.lexicon, workers=args.workers)
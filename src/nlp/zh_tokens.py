@@ -0,0 +1,92 @@
+"""共用中文斷詞層（jieba）：弱標註（build_sentence_dataset）與主題抽取（topic_keyphrase）共用。
+- 每組詞各用一個獨立的 jieba.Tokenizer（不動全域 jieba.dt），把情緒詞典的詞加入（不被切碎）；
+  其他模組或另一組詞對全域字典 add_word 不會改變這裡的斷詞結果，快取版本因此可信。
+- 斷詞結果以句子雜湊快取（src/models/score_cache.py 的 LRU + 可選 SQLite 磁碟層）；
+  版本 = jieba 版本 + 加入的詞，詞典一改快取自動失效。設定見 TOKEN_CACHE_SIZE / TOKEN_CACHE_DB。
+- 批次斷詞：只對未命中且去重後的句子斷詞；workers > 1 且量夠大時分塊交給 spawn 程序池。
+"""
+import hashlib
+from typing import Iterable, List, Optional, Sequence
+import jieba
+from src.config import TOKEN_CACHE_DB, TOKEN_CACHE_SIZE
+from src.models.score_cache import ScoreCache
+
+_PARALLEL_MIN = 2000  # 未命中句數少於此值時不開程序池
+
+_worker_dt: Optional[jieba.Tokenizer] = None  # 程序池 worker 內的斷詞器（_init_worker 建立）
+
+def _new_dt(words: Sequence[str]) -> jieba.Tokenizer:
+    dt = jieba.Tokenizer()
+    dt.initialize()
+    for w in words:
+        dt.add_word(w)
+    return dt
+
+def _cut(dt: jieba.Tokenizer, text: str) -> List[str]:
+    return [t.strip() for t in dt.lcut(text) if t.strip()]
+
+def _init_worker(words: Sequence[str]):
+    global _worker_dt
+    _worker_dt = _new_dt(words)
+
+def _cut_batch(texts: List[str], dt: Optional[jieba.Tokenizer] = None) -> List[List[str]]:
+    dt = dt or _worker_dt
+    return [_cut(dt, t) for t in texts]
+
+class ZhTokenizer:
+    def __init__(self, extra_words: Iterable[str] = (), workers: int = 1, chunk_size: int = 500,
+                 cache: Optional[ScoreCache] = None):
+        self.words = sorted({w for w in extra_words if w})
+        self._dt = _new_dt(self.words)
+        self.version = hashlib.sha1("\x1f".join([jieba.__version__] + self.words).encode("utf-8")).hexdigest()[:16]
+        self.cache = cache if cache is not None else ScoreCache(
+            self.version, namespace="jieba", capacity=TOKEN_CACHE_SIZE, disk_path=TOKEN_CACHE_DB or None)
+        self.workers = max(int(workers), 1)
+        self.chunk_size = max(int(chunk_size), 1)
+        self._pool = None
+
+    def _segment(self, texts: List[str]) -> List[List[str]]:
+        if self.workers == 1 or len(texts) < _PARALLEL_MIN:
+            return _cut_batch(texts, self._dt)
+        if self._pool is None:
+            import multiprocessing as mp
+            self._pool = mp.get_context("spawn").Pool(processes=self.workers, initializer=_init_worker,
+                                                      initargs=(self.words,))
+        chunks = [texts[i:i + self.chunk_size] for i in range(0, len(texts), self.chunk_size)]
+        return [toks for part in self._pool.map(_cut_batch, chunks) for toks in part]
+
+    def tokenize_many(self, texts: Sequence[str]) -> List[List[str]]:
+        texts = [t or "" for t in texts]
+        out = self.cache.get_many(texts)
+        miss = list(dict.fromkeys(t for t, v in zip(texts, out) if v is None))
+        if miss:
+            toks = self._segment(miss)
+            self.cache.put_many(miss, toks)
+            got = dict(zip(miss, toks))
+            out = [v if v is not None else got[t] for t, v in zip(texts, out)]
+        return out
+
+    def tokenize(self, text: str) -> List[str]:
+        return self.tokenize_many([text])[0]
+
+    def close(self):
+        if self._pool is not None:
+            self._pool.close()
+            self._pool.join()
+            self._pool = None
+
+_shared = {}
+
+def get_tokenizer(extra_words: Iterable[str] = (), workers: int = 1) -> ZhTokenizer:
+    """同一組詞在同一程序內共用一個 tokenizer（字典只載一次、快取共用）。"""
+    words = tuple(sorted({w for w in extra_words if w}))
+    tok = _shared.get(words)
+    if tok is None:
+        tok = _shared[words] = ZhTokenizer(words, workers=workers)
+    else:
+        tok.workers = max(tok.workers, int(workers))
+    return tok
+
+def close_all():
+    for tok in _shared.values():
+        tok.close()
@@ -3,13 +3,22 @@
 - 修掉 pandas KeyError: 'ticker'：不再使用 groupby.apply(include_groups=False)，改以 transform 實作去噪；不會丟失分組鍵。
 - 修正 zscore_30 計算：改為 (mean_score - rolling_mean) / rolling_std。
 - 移除 utcnow() 警告：改用 timezone-aware `datetime.datetime.now(datetime.timezone.utc).date()`。
+- 預設走向量化引擎（src/signals/vectorized.py）；--engine legacy 可切回逐組 lambda 版對照。
+- --incremental：每個 key 的滾動狀態存於 signals_state（src/signals/incremental.py），只併入水位線之後的新文件。
+- 近似重複文（news_dup.cluster_id <> news_id，見 src/etl/dedup_news.py）預設不計入；--keep-dups 保留。
+- 寫回改走 src/utils/bulk_upsert.py：暫存表 + 單一 MERGE（pyodbc 開 fast_executemany），三個層級共用。
 - 其他功能不變：加權聚合 / 新鮮度衰減 / 驚奇度 / NaN 清洗 / GETUTCDATE() / 分批查詢寫入 / CPU-only / 自動補欄位與建索引（若你用的是 ensure-tables2 版）。
 """
 import argparse, json, time, math, datetime, yaml
 from typing import List, Dict
 import pandas as pd
-from sqlalchemy import create_engine, text, bindparam
+from sqlalchemy import text, bindparam
 from src.config import DB_URL
+from src.signals import vectorized as vec
+from src.signals import incremental as inc
+from src.utils.bulk_upsert import bulk_upsert, make_engine
+from src.utils.watermark import ensure_watermark_table, get_watermark, set_watermark
+from src.etl.dedup_news import has_table as has_dup_table
 
 # ----------------------------- helpers -----------------------------
 def _now_utc_date():
@@ -91,14 +100,16 @@ BEGIN
 END
 """))
 
-def _fetch_docs(engine, days:int, limit:int):
+def _fetch_docs(engine, days:int, limit:int, hi=None):
+    """hi：只取 created_at <= hi（增量模式建狀態時與水位線對齊）。"""
     with engine.begin() as conn:
-        rows = conn.execute(text('''
+        rows = conn.execute(text(f'''
             SELECT TOP (:limit) d.news_id, CAST(d.created_at AS DATE) as ds, d.doc_score
             FROM news_doc_sentiment d
             WHERE d.created_at >= DATEADD(day, -:days, GETUTCDATE())
+              {"AND d.created_at <= :hi" if hi is not None else ""}
             ORDER BY d.news_id DESC
-        '''), {'limit': limit, 'days': days}).fetchall()
+        '''), {'limit': limit, 'days': days, 'hi': hi}).fetchall()
     return rows
 
 def _fetch_entities_for_ids(engine, ids: List[int], chunk_size=800, throttle_ms=0):
@@ -138,6 +149,40 @@ def _fetch_meta_for_ids(engine, ids: List[int], chunk_size=800, throttle_ms=0):
                 continue
     return out
 
+def _drop_dups(engine, docs, chunk_size=800):
+    """依 news_dup 去掉近似重複文（cluster_id <> news_id），同一則轉載只算一次 n_docs；表不存在時原樣回傳。"""
+    if not docs: return docs
+    with engine.begin() as conn:
+        if not has_dup_table(conn):
+            return docs
+        stmt = text("""
+            SELECT news_id FROM news_dup
+            WHERE news_id IN :ids AND cluster_id <> news_id
+        """).bindparams(bindparam('ids', expanding=True))
+        ids = [int(r[0]) for r in docs]
+        dup = set()
+        for i in range(0, len(ids), chunk_size):
+            dup.update(int(x) for x in conn.execute(stmt, {'ids': ids[i:i+chunk_size]}).scalars())
+    return [r for r in docs if int(r[0]) not in dup]
+
+def _max_dup_ts(engine):
+    with engine.begin() as conn:
+        if not has_dup_table(conn):
+            return None
+        return conn.execute(text("SELECT MAX(created_at) FROM news_dup")).scalar()
+
+def _fetch_new_dups(engine, wm, hi, days:int, lag_seconds:int=0) -> List[int]:
+    """wm - lag_seconds < created_at <= hi 之間標為重複文的 news_id（news_dup 只插入不更新）；
+    回看 lag_seconds 涵蓋晚提交、created_at 卻較早的列。wm 為 None（尚無水位線）時改看回溯窗內全部。
+    已不在狀態內的 id 扣除時自然略過，重複回看不會多扣。"""
+    with engine.begin() as conn:
+        rows = conn.execute(text(f'''
+            SELECT news_id FROM news_dup
+            WHERE cluster_id <> news_id AND created_at <= :hi
+              AND {"created_at > DATEADD(second, -:lag, :wm)" if wm is not None else "created_at >= DATEADD(day, -:days, SYSUTCDATETIME())"}
+        '''), {'hi': hi, 'wm': wm, 'days': days, 'lag': int(lag_seconds)}).scalars().all()
+    return [int(x) for x in rows]
+
 # ----------------------------- core calc -----------------------------
 def _apply_weights(df_join: pd.DataFrame, auth_default:float, auth_table:Dict[str,float], tau_days:float) -> pd.Series:
     def auth(s):
@@ -176,17 +221,50 @@ def _calc_surprise(df_daily: pd.DataFrame, key_cols: List[str]) -> pd.DataFrame:
     out = df_daily.assign(surprise_src7=z).groupby(key_cols + ['ds'], as_index=False)['surprise_src7'].mean()
     return out
 
-# ----------------------------- main -----------------------------
-def run(days:int, limit:int, throttle_ms:int, tau_days:float, wl:float, wh:float, med:int, nan_policy:str, auth_yaml:str):
-    engine = create_engine(DB_URL, future=True)
-    ensure_tables(engine)
+def _build_level_legacy(df: pd.DataFrame, key, wl:float, wh:float, med:int) -> pd.DataFrame:
+    """逐組 lambda 版（保留作為向量化引擎的對照基準）。key=None 為市場層。"""
+    if key is not None:
+        agg = df.groupby([key,'ds'], as_index=False).agg(
+            n_docs=('doc_score','size'),
+            mean_score=('doc_score','mean'),
+            weighted_mean=('doc_score', lambda s: float((s * df.loc[s.index, 'w']).sum() / max(df.loc[s.index, 'w'].sum(), 1e-9)))
+        )
+        agg = _denoise_inplace(agg, key, wl, wh, med)
+        agg = _calc_rollings(agg, key)
+        tmp = df.groupby([key,'source','ds'], as_index=False)['doc_score'].mean().rename(columns={'doc_score':'mean_score'})
+        sps = _calc_surprise(tmp, [key])
+        return agg.merge(sps, on=[key,'ds'], how='left')
+    agg = df.groupby(['ds'], as_index=False).agg(
+        n_docs=('doc_score','size'),
+        mean_score=('doc_score','mean'),
+        weighted_mean=('doc_score', lambda s: float((s * df.loc[s.index, 'w']).sum() / max(df.loc[s.index, 'w'].sum(), 1e-9)))
+    ).sort_values('ds')
+    # 去噪（市場層無 key）
+    agg['mean_score'] = _median_filter(_winsorize(agg['mean_score'], wl, wh), med)
+    # rolling 與 zscore
+    rm = agg['mean_score'].rolling(30, min_periods=5).mean()
+    rs = agg['mean_score'].rolling(30, min_periods=5).std().replace(0, pd.NA)
+    agg['ewma_20']   = agg['mean_score'].ewm(span=20, adjust=False).mean()
+    agg['zscore_30'] = (agg['mean_score'] - rm) / rs
+    agg['cum30']     = agg['mean_score'].rolling(30, min_periods=1).sum()
+    # 驚奇度 by source
+    tmp = df.groupby(['source','ds'], as_index=False)['doc_score'].mean().rename(columns={'doc_score':'mean_score'})
+    sps = _calc_surprise(tmp, [])
+    return agg.merge(sps, on=['ds'], how='left')
 
-    # 讀資料
-    docs = _fetch_docs(engine, days, limit)
-    if not docs: print('沒有可用的文級數據。'); return
-    df_docs = pd.DataFrame(docs, columns=['news_id','ds','doc_score'])
+def _build_level(df: pd.DataFrame, key, wl:float, wh:float, med:int, engine_kind:str) -> pd.DataFrame:
+    if engine_kind == 'legacy':
+        return _build_level_legacy(df, key, wl, wh, med)
+    return vec.build_level(df, key, wl, wh, med)
+
+# ----------------------------- load & write -----------------------------
+_LEVELS = [('entity', 'ticker', 'signals_entity_daily'),
+           ('industry', 'industry', 'signals_industry_daily'),
+           ('market', None, 'signals_market_daily')]
 
-    ents = _fetch_entities_for_ids(engine, df_docs['news_id'].tolist(), chunk_size=800, throttle_ms=min(throttle_ms, 10))
+def _entity_frame(engine, ids: List[int], throttle_ms:int) -> pd.DataFrame:
+    """news_id → ticker/industry 對照（一篇可對到多列）。"""
+    ents = _fetch_entities_for_ids(engine, ids, chunk_size=800, throttle_ms=min(throttle_ms, 10))
     rows = []
     for nid, mjson in ents:
         try:
@@ -195,7 +273,12 @@ def run(days:int, limit:int, throttle_ms:int, tau_days:float, wl:float, wh:float
             arr = []
         for it in arr:
             rows.append({'news_id': int(nid), 'ticker': it.get('ticker') or '', 'industry': it.get('industry') or ''})
-    df_map = pd.DataFrame(rows) if rows else pd.DataFrame(columns=['news_id','ticker','industry'])
+    return pd.DataFrame(rows) if rows else pd.DataFrame(columns=['news_id','ticker','industry'])
+
+def _load_frame(engine, docs, throttle_ms:int, tau_days:float, auth_yaml:str, engine_kind:str):
+    """文級分數 → 併上來源/發布日與權重（df_join），另回傳 news_id → ticker/industry 對照（df_map）。"""
+    df_docs = pd.DataFrame(docs, columns=['news_id','ds','doc_score'])
+    df_map = _entity_frame(engine, df_docs['news_id'].tolist(), throttle_ms)
 
     meta = _fetch_meta_for_ids(engine, df_docs['news_id'].tolist(), chunk_size=800, throttle_ms=min(throttle_ms, 10))
     df_meta = pd.DataFrame(meta, columns=['news_id','source','pub_date']) if meta else pd.DataFrame(columns=['news_id','source','pub_date'])
@@ -203,115 +286,172 @@ def run(days:int, limit:int, throttle_ms:int, tau_days:float, wl:float, wh:float
     # join & weights
     df_join = df_docs.merge(df_meta, on='news_id', how='left')
     auth_default, auth_table = _load_authority(auth_yaml)
-    df_join['w'] = _apply_weights(df_join, auth_default, auth_table, tau_days)
+    if engine_kind == 'legacy':
+        df_join['w'] = _apply_weights(df_join, auth_default, auth_table, tau_days)
+    else:
+        df_join['w'] = vec.apply_weights(df_join, auth_default, auth_table, tau_days)
+    return df_join, df_map
 
-    # ---------- Entity 層 ----------
-    df_ent = df_join.merge(df_map[['news_id','ticker']], on='news_id', how='left').dropna(subset=['ticker'])
-    if not df_ent.empty:
-        agg_ent = df_ent.groupby(['ticker','ds'], as_index=False).agg(
-            n_docs=('doc_score','size'),
-            mean_score=('doc_score','mean'),
-            weighted_mean=('doc_score', lambda s: float((s * df_ent.loc[s.index, 'w']).sum() / max(df_ent.loc[s.index, 'w'].sum(), 1e-9)))
-        )
-        agg_ent = _denoise_inplace(agg_ent, 'ticker', wl, wh, med)
-        agg_ent = _calc_rollings(agg_ent, 'ticker')
-        tmp = df_ent.groupby(['ticker','source','ds'], as_index=False)['doc_score'].mean().rename(columns={'doc_score':'mean_score'})
-        sps = _calc_surprise(tmp, ['ticker'])
-        agg_ent = agg_ent.merge(sps, on=['ticker','ds'], how='left')
-        with engine.begin() as conn:
-            for _, r in agg_ent.iterrows():
-                payload = {
-                    'tk': r['ticker'], 'ds': r['ds'], 'n': int(r['n_docs']),
-                    'm': _san(r['mean_score'], nan_policy),
-                    'wm': _san(r.get('weighted_mean'), nan_policy),
-                    'e': _san(r['ewma_20'], nan_policy),
-                    'z': _san(r['zscore_30'], nan_policy),
-                    'c': _san(r['cum30'], nan_policy),
-                    'sp': _san(r.get('surprise_src7'), nan_policy),
-                }
-                conn.execute(text("""
-                    MERGE signals_entity_daily AS t
-                    USING (SELECT :tk AS ticker, :ds AS ds) AS src
-                    ON (t.ticker=src.ticker AND t.ds=src.ds)
-                    WHEN MATCHED THEN UPDATE SET n_docs=:n, mean_score=:m, weighted_mean=:wm, ewma_20=:e, zscore_30=:z, cum30=:c, surprise_src7=:sp
-                    WHEN NOT MATCHED THEN INSERT (ticker, ds, n_docs, mean_score, weighted_mean, ewma_20, zscore_30, cum30, surprise_src7)
-                    VALUES (:tk, :ds, :n, :m, :wm, :e, :z, :c, :sp);
-                """), payload)
-                if throttle_ms>0: time.sleep(throttle_ms/1000.0)
-
-    # ---------- Industry 層 ----------
-    df_ind = df_join.merge(df_map[['news_id','industry']], on='news_id', how='left').dropna(subset=['industry'])
-    if not df_ind.empty:
-        agg_ind = df_ind.groupby(['industry','ds'], as_index=False).agg(
-            n_docs=('doc_score','size'),
-            mean_score=('doc_score','mean'),
-            weighted_mean=('doc_score', lambda s: float((s * df_ind.loc[s.index, 'w']).sum() / max(df_ind.loc[s.index, 'w'].sum(), 1e-9)))
-        )
-        agg_ind = _denoise_inplace(agg_ind, 'industry', wl, wh, med)
-        agg_ind = _calc_rollings(agg_ind, 'industry')
-        tmp = df_ind.groupby(['industry','source','ds'], as_index=False)['doc_score'].mean().rename(columns={'doc_score':'mean_score'})
-        sps = _calc_surprise(tmp, ['industry'])
-        agg_ind = agg_ind.merge(sps, on=['industry','ds'], how='left')
+def _level_frame(df_join: pd.DataFrame, df_map: pd.DataFrame, key):
+    if key is None:
+        return df_join
+    return df_join.merge(df_map[['news_id', key]], on='news_id', how='left').dropna(subset=[key])
+
+_VALUE_COLS = ['n_docs', 'mean_score', 'weighted_mean', 'ewma_20', 'zscore_30', 'cum30', 'surprise_src7']
+
+def _level_rows(agg: pd.DataFrame, key, nan_policy:str) -> List[dict]:
+    """DataFrame → upsert 參數列；數值欄一律經 _san 套用 NaN 政策（n_docs 維持整數）。"""
+    out = []
+    cols = ([key] if key else []) + ['ds'] + _VALUE_COLS
+    for rec in agg.reindex(columns=cols).to_dict('records'):
+        row = {'ds': rec['ds'], 'n_docs': int(rec['n_docs'])}
+        if key:
+            row[key] = rec[key]
+        for c in _VALUE_COLS[1:]:
+            row[c] = _san(rec.get(c), nan_policy)
+        out.append(row)
+    return out
+
+def _write_level(engine, table:str, key, agg: pd.DataFrame, nan_policy:str, throttle_ms:int) -> int:
+    """整批寫回 signals_*_daily（暫存表 + 單一 MERGE）；key=None 為市場層（只以 ds 對齊）。"""
+    keys = ([key] if key else []) + ['ds']
+    return bulk_upsert(engine, table, _level_rows(agg, key, nan_policy), keys, _VALUE_COLS, throttle_ms=throttle_ms)
+
+# ----------------------------- incremental -----------------------------
+# 逐篇貢獻移到 signals_state_doc（見 incremental.py）；換 job 名讓舊格式的狀態第一次自動走全量重建
+JOB_NAME = 'build_signals_v3'
+# news_dup.created_at 的水位線：文件併入狀態後才被標為重複文時，下次增量從狀態扣掉
+DUP_JOB_NAME = 'build_signals_v3_dups'
+
+def _fetch_docs_since(engine, wm, hi, limit:int, lag_seconds:int=0, page_size:int=5000):
+    """讀 wm - lag_seconds < created_at <= hi 的文件，以 (created_at, news_id) keyset 分頁，同一時間點跨頁也不漏。
+    回看 lag_seconds：上界快照之後才提交、created_at 卻較早的 doc_aggregate MERGE 下次仍讀得到；
+    merge_docs 逐篇取代舊貢獻，重讀重疊區不會重複計數。limit 只計 created_at > wm 的新列，
+    達 limit 後會讀完最後一個 created_at 的同值列（同一個 MERGE 的列共用時間），水位線停在完整的時間點上。
+    回傳 (rows, 新水位線)。"""
+    out, last, n_new, cut = [], None, 0, False
+    while True:
         with engine.begin() as conn:
-            for _, r in agg_ind.iterrows():
-                payload = {
-                    'ik': r['industry'], 'ds': r['ds'], 'n': int(r['n_docs']),
-                    'm': _san(r['mean_score'], nan_policy),
-                    'wm': _san(r.get('weighted_mean'), nan_policy),
-                    'e': _san(r['ewma_20'], nan_policy),
-                    'z': _san(r['zscore_30'], nan_policy),
-                    'c': _san(r['cum30'], nan_policy),
-                    'sp': _san(r.get('surprise_src7'), nan_policy),
-                }
-                conn.execute(text("""
-                    MERGE signals_industry_daily AS t
-                    USING (SELECT :ik AS industry, :ds AS ds) AS src
-                    ON (t.industry=src.industry AND t.ds=src.ds)
-                    WHEN MATCHED THEN UPDATE SET n_docs=:n, mean_score=:m, weighted_mean=:wm, ewma_20=:e, zscore_30=:z, cum30=:c, surprise_src7=:sp
-                    WHEN NOT MATCHED THEN INSERT (industry, ds, n_docs, mean_score, weighted_mean, ewma_20, zscore_30, cum30, surprise_src7)
-                    VALUES (:ik, :ds, :n, :m, :wm, :e, :z, :c, :sp);
-                """), payload)
-                if throttle_ms>0: time.sleep(throttle_ms/1000.0)
-
-    # ---------- Market 層 ----------
-    agg_mkt = df_join.groupby(['ds'], as_index=False).agg(
-        n_docs=('doc_score','size'),
-        mean_score=('doc_score','mean'),
-        weighted_mean=('doc_score', lambda s: float((s * df_join.loc[s.index, 'w']).sum() / max(df_join.loc[s.index, 'w'].sum(), 1e-9)))
-    ).sort_values('ds')
-    # 去噪（市場層無 key）
-    agg_mkt['mean_score'] = _median_filter(_winsorize(agg_mkt['mean_score'], wl, wh), med)
-    # rolling 與 zscore
-    rm = agg_mkt['mean_score'].rolling(30, min_periods=5).mean()
-    rs = agg_mkt['mean_score'].rolling(30, min_periods=5).std().replace(0, pd.NA)
-    agg_mkt['ewma_20']   = agg_mkt['mean_score'].ewm(span=20, adjust=False).mean()
-    agg_mkt['zscore_30'] = (agg_mkt['mean_score'] - rm) / rs
-    agg_mkt['cum30']     = agg_mkt['mean_score'].rolling(30, min_periods=1).sum()
-    # 驚奇度 by source
-    tmp = df_join.groupby(['source','ds'], as_index=False)['doc_score'].mean().rename(columns={'doc_score':'mean_score'})
-    sps = _calc_surprise(tmp, [])
-    agg_mkt = agg_mkt.merge(sps, on=['ds'], how='left')
+            rows = conn.execute(text(f'''
+                SELECT TOP (:n) d.news_id, CAST(d.created_at AS DATE) as ds, d.doc_score, d.created_at
+                FROM news_doc_sentiment d
+                WHERE d.created_at > DATEADD(second, -:lag, :wm) AND d.created_at <= :hi
+                  {"AND (d.created_at > :lts OR (d.created_at = :lts AND d.news_id > :lid))" if last else ""}
+                ORDER BY d.created_at ASC, d.news_id ASC
+            '''), {'n': page_size, 'wm': wm, 'hi': hi, 'lag': int(lag_seconds),
+                     'lts': last[0] if last else None, 'lid': last[1] if last else None}).fetchall()
+        if not rows:
+            break
+        out.extend(r[:3] for r in rows)
+        n_new += sum(1 for r in rows if r[3] > wm)
+        last = (rows[-1][3], int(rows[-1][0]))
+        if n_new >= limit and not cut:
+            hi, cut = last[0], True  # 只再讀完同一時間點剩下的列
+    return out, max(hi, wm)
+
+def _max_doc_ts(engine):
     with engine.begin() as conn:
-        for _, r in agg_mkt.iterrows():
-            payload = {
-                'ds': r['ds'], 'n': int(r['n_docs']),
-                'm': _san(r['mean_score'], nan_policy),
-                'wm': _san(r.get('weighted_mean'), nan_policy),
-                'e': _san(r['ewma_20'], nan_policy),
-                'z': _san(r['zscore_30'], nan_policy),
-                'c': _san(r['cum30'], nan_policy),
-                'sp': _san(r.get('surprise_src7'), nan_policy),
-            }
-            conn.execute(text("""
-                MERGE signals_market_daily AS t
-                USING (SELECT :ds AS ds) AS src
-                ON (t.ds=src.ds)
-                WHEN MATCHED THEN UPDATE SET n_docs=:n, mean_score=:m, weighted_mean=:wm, ewma_20=:e, zscore_30=:z, cum30=:c, surprise_src7=:sp
-                WHEN NOT MATCHED THEN INSERT (ds, n_docs, mean_score, weighted_mean, ewma_20, zscore_30, cum30, surprise_src7)
-                VALUES (:ds, :n, :m, :wm, :e, :z, :c, :sp);
-            """), payload)
-            if throttle_ms>0: time.sleep(throttle_ms/1000.0)
+        return conn.execute(text("SELECT MAX(created_at) FROM news_doc_sentiment")).scalar()
+
+def _seed_states(engine, df_join, df_map, aggs: Dict[str, pd.DataFrame], days:int):
+    """全量跑完後以其結果建立/覆蓋每個 key 的滾動狀態。"""
+    for level, key, _ in _LEVELS:
+        df = _level_frame(df_join, df_map, key)
+        agg = aggs.get(level)
+        if df.empty or agg is None:
+            continue
+        inc.save_states(engine, level, inc.seed_state(df, agg, key, hist_days=days), replace_docs=True)
+
+def _run_incremental(engine, docs, days:int, throttle_ms:int, tau_days:float, wl:float, wh:float, med:int,
+                     nan_policy:str, auth_yaml:str, engine_kind:str, removed_ids: List[int] = ()) -> int:
+    """把水位線之後新增/重新彙總的文件併入各 key 狀態（逐篇取代舊貢獻），重算受影響的 (key, ds) 並寫回。
+    removed_ids：事後被標為重複文的 news_id，從各 key 狀態扣掉其貢獻。
+    只讀寫本批 news_id 的逐篇貢獻（signals_state_doc）；某篇原本在的 key 這次已對不到（重標實體、被標為重複）時一併扣除。"""
+    if docs:
+        df_join, df_map = _load_frame(engine, docs, throttle_ms, tau_days, auth_yaml, engine_kind)
+    else:
+        df_join, df_map = pd.DataFrame(columns=['news_id', 'ds', 'doc_score', 'source', 'pub_date', 'w']), None
+    ids = {int(r[0]) for r in docs} | {int(x) for x in removed_ids}
+    total = 0
+    for level, key, table in _LEVELS:
+        df = _level_frame(df_join, df_map, key) if docs else df_join
+        now = set(zip(df[key].astype(str) if key else [inc.MARKET_KEY] * len(df), df['news_id'].astype(int))) if not df.empty else set()
+        removed = {}
+        for k, nids in inc.doc_keys(engine, level, ids).items():
+            gone = [n for n in nids if (k, n) not in now]
+            if gone:
+                removed[k] = gone
+        if df.empty and not removed:
+            continue
+        touched = sorted({k for k, _ in now} | set(removed))
+        states = inc.load_states(engine, level, touched, ids=ids)
+        out = inc.update_level(states, df, key, wl, wh, med, hist_days=days, removed=removed)
+        if out.empty:
+            continue
+        out['ds'] = pd.to_datetime(out['ds']).dt.date
+        out = out.rename(columns={'key': key}) if key else out.drop(columns=['key'])
+        _write_level(engine, table, key, out, nan_policy, throttle_ms)
+        inc.save_states(engine, level, {k: v for k, v in states.items() if k in set(touched)})
+        inc.prune_docs(engine, level, hist_days=days)
+        total += len(out)
+    return total
+
+# ----------------------------- main -----------------------------
+def run(days:int, limit:int, throttle_ms:int, tau_days:float, wl:float, wh:float, med:int, nan_policy:str, auth_yaml:str,
+        engine_kind:str='vectorized', incremental:bool=False, dedup:bool=True, lag_seconds:int=300):
+    engine = make_engine(DB_URL)
+    ensure_tables(engine)
+
+    new_wm = None
+    if incremental:
+        ensure_watermark_table(engine)
+        inc.ensure_state_table(engine)
+        wm = get_watermark(engine, JOB_NAME)
+        # 本次的上界先取快照；讀取一律 created_at <= 上界，之後寫入的列留給下一次
+        new_wm = _max_doc_ts(engine)
+        dup_hi = _max_dup_ts(engine) if dedup else None
+        if wm is not None and inc.has_states(engine):
+            # 水位線只推進到本批實際讀到的位置（limit 截斷時下次接著讀）
+            docs, new_wm = _fetch_docs_since(engine, wm, new_wm, limit, lag_seconds) if new_wm is not None else ([], wm)
+            removed = []
+            if dedup:
+                docs = _drop_dups(engine, docs)
+                if dup_hi is not None:
+                    removed = _fetch_new_dups(engine, get_watermark(engine, DUP_JOB_NAME), dup_hi, days, lag_seconds)
+            if docs or removed:
+                n = _run_incremental(engine, docs, days, throttle_ms, tau_days, wl, wh, med, nan_policy, auth_yaml, engine_kind,
+                                     removed_ids=removed)
+                print(f'增量更新 {len(docs)} 篇新增/重新彙總的文件、扣除 {len(removed)} 篇新標記的重複文，寫回 {n} 列。')
+            else:
+                print('水位線之後沒有新的文級數據。')
+            if new_wm is not None:
+                set_watermark(engine, JOB_NAME, new_wm)
+            if dup_hi is not None:
+                set_watermark(engine, DUP_JOB_NAME, dup_hi)
+            return
+        # 第一次：先全量計算，並以結果建立狀態，之後才走增量
+
+    # 讀資料
+    docs = _fetch_docs(engine, days, limit, hi=new_wm)
+    if dedup:
+        docs = _drop_dups(engine, docs)
+    if not docs: print('沒有可用的文級數據。'); return
+    df_join, df_map = _load_frame(engine, docs, throttle_ms, tau_days, auth_yaml, engine_kind)
+
+    aggs = {}
+    for level, key, table in _LEVELS:
+        df = _level_frame(df_join, df_map, key)
+        if df.empty:
+            continue
+        aggs[level] = _build_level(df, key, wl, wh, med, engine_kind)
+        _write_level(engine, table, key, aggs[level], nan_policy, throttle_ms)
 
+    if incremental:
+        _seed_states(engine, df_join, df_map, aggs, days)
+        if new_wm is not None:
+            set_watermark(engine, JOB_NAME, new_wm)
+        if dup_hi is not None:
+            set_watermark(engine, DUP_JOB_NAME, dup_hi)
     print('Signals 已更新完成。')
 
 if __name__ == '__main__':
@@ -325,7 +465,12 @@ if __name__ == '__main__':
     ap.add_argument('--median-window', type=int, default=3)
     ap.add_argument('--nan-policy', choices=['null','zero'], default='null')
     ap.add_argument('--authority-yaml', type=str, default='data/sources/authority.yaml')
+    ap.add_argument('--engine', choices=['vectorized','legacy'], default='vectorized', help='計算引擎；legacy 為逐組 lambda 版（對照用）')
+    ap.add_argument('--incremental', action='store_true', help='以持久化的滾動狀態只併入水位線之後的新文件（首次自動全量建狀態）')
+    ap.add_argument('--keep-dups', action='store_true', help='不依 news_dup 去除近似重複文（預設去除）')
+    ap.add_argument('--lag-seconds', type=int, default=300, help='增量模式回看秒數（涵蓋晚提交的 doc_aggregate / dedup_news）')
     args = ap.parse_args()
     run(days=args.days, limit=args.limit, throttle_ms=args.throttle_ms,
         tau_days=args.tau_days, wl=args.winsor_low, wh=args.winsor_high, med=args.median_window,
-        nan_policy=args.nan_policy, auth_yaml=args.authority_yaml)
+        nan_policy=args.nan_policy, auth_yaml=args.authority_yaml, engine_kind=args.engine,
+        incremental=args.incremental, dedup=not args.keep_dups, lag_seconds=args.lag_seconds)
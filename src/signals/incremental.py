@@ -0,0 +1,346 @@
+"""Step 5 增量引擎：持久化每個 key 的滾動狀態，只把新文件併入，不再重掃整個回溯窗。
+狀態（signals_state.state_json，每個 level × key 一列）：
+- days：近 hist_days 天的日度累加量 [ds, n, cnt, ssum, sw, swx, den, ewma]
+        （den = 去噪後 mean_score、ewma = 當日 EWMA 累加器），供 winsorize 上下界、30 日 rolling、EWMA 接續。
+- src ：各來源最近 SRC_KEEP 筆日度 [ds, cnt, ssum]，供 surprise_src7（同來源 7 筆 Z-score）。
+逐篇貢獻另存關聯表 signals_state_doc（level, skey, news_id → ds, source, n, cnt, ssum, sw, swx），
+不放進 state_json：每次只讀寫本批新增 / 重新彙總 / 移除的 news_id，成本與回溯窗大小無關。
+記憶體中的 state["docs"] 只含本批載入的貢獻 {news_id: [ds, source, n, cnt, ssum, sw, swx]}（None = 待刪除）；
+同一篇被 doc_aggregate 重新彙總（created_at 更新）時先扣舊貢獻再加新的，不會重複計數。
+語意為「時點值」（point-in-time）：每一天只用當時已知資料計算，之後不回頭改寫舊日；
+與全量模式相比，winsorize 上下界取自狀態內的歷史、EWMA 從狀態起點一路接續。
+"""
+import datetime, json, math
+from typing import Dict, Iterable, List, Optional, Tuple
+import numpy as np
+import pandas as pd
+
+SRC_KEEP = 14
+EWMA_ALPHA = 2.0 / (20 + 1.0)
+MARKET_KEY = "__market__"
+
+def _iso(d) -> str:
+    if isinstance(d, datetime.datetime):
+        d = d.date()
+    if isinstance(d, pd.Timestamp):
+        d = d.date()
+    return d.isoformat() if hasattr(d, "isoformat") else str(d)[:10]
+
+def empty_state() -> dict:
+    return {"days": [], "src": {}, "docs": {}}
+
+def _nan(x) -> Optional[float]:
+    return None if x is None or (isinstance(x, float) and math.isnan(x)) else float(x)
+
+def _f(x) -> float:
+    return float("nan") if x is None else float(x)
+
+# ----------------------------- 累加 -----------------------------
+def daily_sums(df: pd.DataFrame, key: Optional[str]) -> Tuple[pd.DataFrame, pd.DataFrame]:
+    """文件 → (key, ds) 與 (key, source, ds) 兩張累加表。key=None 時以 MARKET_KEY 代表市場層。"""
+    df = df.assign(_k=df[key].astype(str) if key else MARKET_KEY, _wx=df['doc_score'] * df['w'])
+    day = df.groupby(['_k', 'ds'], as_index=False).agg(
+        n=('doc_score', 'size'), cnt=('doc_score', 'count'), ssum=('doc_score', 'sum'),
+        sw=('w', 'sum'), swx=('_wx', 'sum'))
+    src = df.groupby(['_k', 'source', 'ds'], as_index=False).agg(
+        cnt=('doc_score', 'count'), ssum=('doc_score', 'sum'))
+    return day, src
+
+def doc_sums(df: pd.DataFrame, key: Optional[str]) -> pd.DataFrame:
+    """文件 → 每個 (key, news_id) 的貢獻量（同一篇在同一 key 可有多列，例如同產業兩家公司）。"""
+    df = df.assign(_k=df[key].astype(str) if key else MARKET_KEY, _wx=df['doc_score'] * df['w'])
+    return df.groupby(['_k', 'news_id'], as_index=False, sort=False).agg(
+        ds=('ds', 'first'), source=('source', 'first'),
+        n=('doc_score', 'size'), cnt=('doc_score', 'count'), ssum=('doc_score', 'sum'),
+        sw=('w', 'sum'), swx=('_wx', 'sum'))
+
+def _apply(state: dict, days: dict, c: list, sign: int):
+    """把一篇文件的貢獻 c = [ds, source, n, cnt, ssum, sw, swx] 加入（sign=1）或扣除（sign=-1）。"""
+    ds, source, n, cnt, ssum, sw, swx = c
+    d = days.get(ds)
+    if d is None:
+        if sign < 0:
+            return  # 該日已滑出回溯窗
+        d = [ds, 0, 0, 0.0, 0.0, 0.0, None, None]
+    d = [ds, d[1] + sign * n, d[2] + sign * cnt, d[3] + sign * ssum, d[4] + sign * sw, d[5] + sign * swx, None, None]
+    if d[1] > 0:
+        days[ds] = d
+    else:
+        days.pop(ds, None)
+    if source is None:
+        return
+    ent = {e[0]: e for e in state["src"].get(source, [])}
+    old = ent.get(ds)
+    if old is None and sign < 0:
+        return
+    old = old or [ds, 0, 0.0]
+    ent[ds] = [ds, old[1] + sign * cnt, old[2] + sign * ssum]
+    if sign < 0 and ent[ds][1] <= 0:
+        del ent[ds]
+    state["src"][source] = [ent[x] for x in sorted(ent)][-SRC_KEEP:]
+
+def merge_docs(state: dict, rows: List[tuple], removed: Iterable[int] = ()) -> Optional[int]:
+    """以文件為單位併入狀態：rows 為 (news_id, ds, source, n, cnt, ssum, sw, swx)。
+    同一 news_id 再次出現（doc_aggregate 重新彙總）時先扣掉舊貢獻再加新的，不會重複計數；
+    removed 內的 news_id 只扣不加（例如事後被標為重複文）。回傳最早被動到的日索引（之後都要重算）。"""
+    days = {d[0]: d for d in state["days"]}
+    docs = state.setdefault("docs", {})
+    touched = set()
+    for nid in removed:
+        old = docs.get(str(int(nid)))
+        if old:
+            _apply(state, days, old, -1)
+            touched.add(old[0])
+            docs[str(int(nid))] = None  # save_states 時自 signals_state_doc 刪除
+    for nid, ds, source, n, cnt, ssum, sw, swx in rows:
+        src = None if source is None or (isinstance(source, float) and math.isnan(source)) else str(source)
+        new = [_iso(ds), src, int(n), int(cnt), float(ssum), float(sw), float(swx)]
+        old = docs.get(str(int(nid)))
+        if old:
+            _apply(state, days, old, -1)
+            touched.add(old[0])
+        _apply(state, days, new, 1)
+        docs[str(int(nid))] = new
+        touched.add(new[0])
+    state["days"] = [days[k] for k in sorted(days)]
+    if not touched:
+        return None
+    first = min(touched)
+    return next((i for i, d in enumerate(state["days"]) if d[0] >= first), len(state["days"]))
+
+# ----------------------------- 重算 -----------------------------
+def _surprise(state: dict, ds: str) -> Optional[float]:
+    zs = []
+    for ent in state["src"].values():
+        idx = next((i for i, e in enumerate(ent) if e[0] == ds), None)
+        if idx is None:
+            continue
+        xs = [e[2] / e[1] if e[1] else float("nan") for e in ent[max(0, idx - 6):idx + 1]]
+        arr = np.array(xs, dtype=float)
+        arr = arr[~np.isnan(arr)]
+        if len(arr) < 3 or math.isnan(xs[-1]):
+            continue
+        sd = float(np.std(arr, ddof=1))
+        if sd == 0:
+            continue
+        zs.append((xs[-1] - float(np.mean(arr))) / sd)
+    return float(np.mean(zs)) if zs else None
+
+def recompute(state: dict, start: int, wl: float, wh: float, med: int, hist_days: int,
+              today: datetime.date) -> List[dict]:
+    """從 start 起重算 den / ewma / zscore / cum30 / surprise，回傳這些日的輸出列。"""
+    cutoff = (today - datetime.timedelta(days=hist_days)).isoformat()
+    days = state["days"]
+    raw = np.array([d[3] / d[2] if d[2] else np.nan for d in days], dtype=float)
+    valid = raw[~np.isnan(raw)]
+    lo = float(np.quantile(valid, wl)) if len(valid) else None
+    hi = float(np.quantile(valid, wh)) if len(valid) else None
+    wins = pd.Series(raw).clip(lower=lo, upper=hi)
+    out = []
+    for i in range(start, len(days)):
+        d = days[i]
+        # 時點值：中位數濾波只看到當天為止（與全量模式在該日的計算相同）
+        den = float(wins.iloc[:i + 1].rolling(med, min_periods=1, center=True).median().iloc[-1]) if med > 1 else float(wins.iloc[i])
+        prev = _f(days[i - 1][7]) if i > 0 else float("nan")
+        if math.isnan(den):
+            ewma = prev
+        elif math.isnan(prev):
+            ewma = den
+        else:
+            ewma = EWMA_ALPHA * den + (1 - EWMA_ALPHA) * prev
+        d[6], d[7] = _nan(den), _nan(ewma)
+        win = np.array([_f(x[6]) for x in days[max(0, i - 29):i + 1]], dtype=float)
+        nn = win[~np.isnan(win)]
+        z = None
+        if len(nn) >= 5:
+            sd = float(np.std(nn, ddof=1))
+            if sd != 0 and not math.isnan(den):
+                z = (den - float(np.mean(nn))) / sd
+        out.append({
+            "ds": d[0], "n_docs": d[1],
+            "mean_score": d[6],
+            "weighted_mean": d[5] / max(d[4], 1e-9),
+            "ewma_20": d[7],
+            "zscore_30": z,
+            "cum30": float(nn.sum()) if len(nn) else None,
+            "surprise_src7": _surprise(state, d[0]),
+        })
+    # 狀態只保留回溯窗內的日子（逐篇貢獻由 prune_docs 在資料庫端清掉）
+    state["days"] = [d for d in days if d[0] >= cutoff] or days[-1:]
+    return out
+
+def update_level(states: Dict[str, dict], df: pd.DataFrame, key: Optional[str],
+                 wl: float, wh: float, med: int, hist_days: int,
+                 today: Optional[datetime.date] = None, removed: Optional[Dict[str, List[int]]] = None) -> pd.DataFrame:
+    """把新/重新彙總文件的貢獻併入各 key 狀態（states 就地更新），回傳需要寫回的 (key, ds) 列。
+    removed：key → 要從該 key 扣除的 news_id。"""
+    today = today or datetime.datetime.now(datetime.timezone.utc).date()
+    removed = removed or {}
+    contrib = doc_sums(df, key) if not df.empty else pd.DataFrame(columns=['_k'])
+    by_key = {str(k): g for k, g in contrib.groupby('_k')}
+    rows = []
+    for k in sorted(set(by_key) | set(removed)):
+        g = by_key.get(k)
+        st = states.setdefault(k, empty_state())
+        start = merge_docs(st,
+                           list(g[['news_id', 'ds', 'source', 'n', 'cnt', 'ssum', 'sw', 'swx']].itertuples(index=False, name=None)) if g is not None else [],
+                           removed.get(k, ()))
+        if start is None:
+            continue
+        for r in recompute(st, start, wl, wh, med, hist_days, today):
+            r["key"] = k
+            rows.append(r)
+    return pd.DataFrame(rows)
+
+def seed_state(df: pd.DataFrame, level_df: pd.DataFrame, key: Optional[str],
+               hist_days: int, today: Optional[datetime.date] = None) -> Dict[str, dict]:
+    """全量計算完後，用其結果（den / ewma）與逐篇貢獻初始化狀態，之後即可走增量。"""
+    today = today or datetime.datetime.now(datetime.timezone.utc).date()
+    cutoff = (today - datetime.timedelta(days=hist_days)).isoformat()
+    day, src = daily_sums(df, key)
+    lv = level_df.assign(_k=level_df[key].astype(str) if key else MARKET_KEY, _ds=level_df['ds'].map(_iso))
+    lv = lv.set_index(['_k', '_ds'])[['mean_score', 'ewma_20']]
+    states: Dict[str, dict] = {}
+    for k, g in day.groupby('_k'):
+        st = states.setdefault(str(k), empty_state())
+        for ds, n, cnt, ssum, sw, swx in g.sort_values('ds')[['ds', 'n', 'cnt', 'ssum', 'sw', 'swx']].itertuples(index=False, name=None):
+            iso = _iso(ds)
+            if iso < cutoff:
+                continue
+            den, ewma = (lv.loc[(k, iso)].tolist() if (k, iso) in lv.index else (None, None))
+            st["days"].append([iso, int(n), int(cnt), float(ssum), float(sw), float(swx),
+                               _nan(pd.to_numeric(den, errors='coerce')), _nan(pd.to_numeric(ewma, errors='coerce'))])
+    for (k, source), g in src.groupby(['_k', 'source']):
+        st = states.setdefault(str(k), empty_state())
+        ent = [[_iso(ds), int(cnt), float(ssum)] for ds, cnt, ssum in g.sort_values('ds')[['ds', 'cnt', 'ssum']].itertuples(index=False, name=None)]
+        st["src"][str(source)] = ent[-SRC_KEEP:]
+    for nid, k, ds, source, n, cnt, ssum, sw, swx in doc_sums(df, key)[
+            ['news_id', '_k', 'ds', 'source', 'n', 'cnt', 'ssum', 'sw', 'swx']].itertuples(index=False, name=None):
+        iso = _iso(ds)
+        if iso < cutoff:
+            continue
+        src_ = None if source is None or (isinstance(source, float) and math.isnan(source)) else str(source)
+        states[str(k)]["docs"][str(int(nid))] = [iso, src_, int(n), int(cnt), float(ssum), float(sw), float(swx)]
+    return states
+
+# ----------------------------- 持久化 -----------------------------
+_DOC_COLS = ['ds', 'source', 'n', 'cnt', 'ssum', 'sw', 'swx']
+
+def ensure_state_table(engine):
+    from sqlalchemy import text
+    with engine.begin() as conn:
+        conn.execute(text("""
+IF OBJECT_ID('signals_state','U') IS NULL
+BEGIN
+    CREATE TABLE signals_state (
+        level NVARCHAR(16) NOT NULL,
+        skey NVARCHAR(64) NOT NULL,
+        state_json NVARCHAR(MAX) NOT NULL,
+        updated_at DATETIME2 NOT NULL DEFAULT SYSUTCDATETIME(),
+        CONSTRAINT pk_signals_state PRIMARY KEY (level, skey)
+    );
+END
+"""))
+        conn.execute(text("""
+IF OBJECT_ID('signals_state_doc','U') IS NULL
+BEGIN
+    CREATE TABLE signals_state_doc (
+        level NVARCHAR(16) NOT NULL,
+        skey NVARCHAR(64) NOT NULL,
+        news_id INT NOT NULL,
+        ds DATE NOT NULL,
+        source NVARCHAR(128) NULL,
+        n INT NOT NULL,
+        cnt INT NOT NULL,
+        ssum FLOAT NOT NULL,
+        sw FLOAT NOT NULL,
+        swx FLOAT NOT NULL,
+        CONSTRAINT pk_signals_state_doc PRIMARY KEY (level, skey, news_id)
+    );
+    CREATE INDEX ix_signals_state_doc_nid ON signals_state_doc(level, news_id);
+    CREATE INDEX ix_signals_state_doc_ds ON signals_state_doc(level, ds);
+END
+"""))
+
+def _id_chunks(ids: Iterable[int], chunk_size: int):
+    ids = sorted({int(x) for x in ids})
+    for i in range(0, len(ids), chunk_size):
+        yield ids[i:i+chunk_size]
+
+def doc_keys(engine, level: str, ids: Iterable[int], chunk_size: int = 800) -> Dict[str, List[int]]:
+    """這些 news_id 目前在哪些 key 有貢獻：key → [news_id]（走 (level, news_id) 索引）。"""
+    from sqlalchemy import text, bindparam
+    out: Dict[str, List[int]] = {}
+    stmt = text("SELECT skey, news_id FROM signals_state_doc WHERE level=:lv AND news_id IN :ids").bindparams(
+        bindparam('ids', expanding=True))
+    with engine.begin() as conn:
+        for part in _id_chunks(ids, chunk_size):
+            for k, nid in conn.execute(stmt, {"lv": level, "ids": part}).fetchall():
+                out.setdefault(str(k), []).append(int(nid))
+    return out
+
+def load_states(engine, level: str, keys: List[str], ids: Iterable[int] = (), chunk_size: int = 800) -> Dict[str, dict]:
+    """讀 keys 的日度 / 來源狀態，並只載入 ids 這幾篇的逐篇貢獻到 state["docs"]。"""
+    from sqlalchemy import text, bindparam
+    out: Dict[str, dict] = {}
+    stmt = text("SELECT skey, state_json FROM signals_state WHERE level=:lv AND skey IN :ks").bindparams(
+        bindparam('ks', expanding=True))
+    doc_stmt = text(f"""
+        SELECT skey, news_id, {', '.join(_DOC_COLS)} FROM signals_state_doc
+        WHERE level=:lv AND news_id IN :ids
+    """).bindparams(bindparam('ids', expanding=True))
+    with engine.begin() as conn:
+        for i in range(0, len(keys), chunk_size):
+            for k, js in conn.execute(stmt, {"lv": level, "ks": keys[i:i+chunk_size]}).fetchall():
+                try:
+                    st = json.loads(js)
+                except Exception:
+                    continue
+                out[str(k)] = {"days": st.get("days", []), "src": st.get("src", {}), "docs": {}}
+        for part in _id_chunks(ids, chunk_size):
+            for k, nid, ds, source, n, cnt, ssum, sw, swx in conn.execute(doc_stmt, {"lv": level, "ids": part}).fetchall():
+                if str(k) in out:
+                    out[str(k)]["docs"][str(int(nid))] = [_iso(ds), source, int(n), int(cnt), float(ssum), float(sw), float(swx)]
+    return out
+
+def save_states(engine, level: str, states: Dict[str, dict], replace_docs: bool = False):
+    """寫回 state_json（只含 days / src），逐篇貢獻 upsert / 刪除到 signals_state_doc。
+    replace_docs=True（全量建狀態時）先清掉該 level 全部舊貢獻。"""
+    from sqlalchemy import text
+    from src.utils.bulk_upsert import bulk_upsert
+    if not states:
+        return
+    now = datetime.datetime.now(datetime.timezone.utc).replace(tzinfo=None)
+    bulk_upsert(engine, 'signals_state',
+                [{"level": level, "skey": k, "updated_at": now,
+                  "state_json": json.dumps({"days": v["days"], "src": v["src"]}, ensure_ascii=False)}
+                 for k, v in states.items()],
+                ['level', 'skey'], ['state_json', 'updated_at'])
+    puts, dels = [], []
+    for k, v in states.items():
+        for nid, c in v.get("docs", {}).items():
+            if c is None:
+                dels.append({"lv": level, "k": k, "nid": int(nid)})
+            else:
+                puts.append(dict(zip(_DOC_COLS, c), level=level, skey=k, news_id=int(nid)))
+    if replace_docs:
+        with engine.begin() as conn:
+            conn.execute(text("DELETE FROM signals_state_doc WHERE level=:lv"), {"lv": level})
+    bulk_upsert(engine, 'signals_state_doc', puts, ['level', 'skey', 'news_id'], _DOC_COLS)
+    if dels:
+        with engine.begin() as conn:
+            conn.execute(text("DELETE FROM signals_state_doc WHERE level=:lv AND skey=:k AND news_id=:nid"), dels)
+
+def prune_docs(engine, level: str, hist_days: int, today: Optional[datetime.date] = None) -> int:
+    """刪掉已滑出回溯窗的逐篇貢獻（走 (level, ds) 索引，每篇只會被刪一次）。"""
+    from sqlalchemy import text
+    today = today or datetime.datetime.now(datetime.timezone.utc).date()
+    cutoff = today - datetime.timedelta(days=hist_days)
+    with engine.begin() as conn:
+        return conn.execute(text("DELETE FROM signals_state_doc WHERE level=:lv AND ds < :c"),
+                            {"lv": level, "c": cutoff}).rowcount
+
+def has_states(engine) -> bool:
+    from sqlalchemy import text
+    with engine.begin() as conn:
+        return conn.execute(text("SELECT COUNT(*) FROM signals_state")).scalar() > 0
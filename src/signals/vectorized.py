@@ -0,0 +1,97 @@
+"""Step 5 向量化引擎：與 build_signals 的逐組 lambda 版輸出一致，但全部走 pandas 原生 kernel。
+- 加權平均：先算 w*score 欄，再以 groupby sum 相除（不再在 lambda 內回查 df.loc[s.index, 'w']）。
+- 去噪：groupby quantile 做 winsorize 上下界 + groupby rolling median。
+- rolling / EWMA / 累積 / 驚奇度：groupby().rolling()/ewm() 原生實作，不經 transform(lambda)。
+key=None 代表市場層（無分組鍵）。
+"""
+import datetime
+from typing import Dict, List, Optional
+import numpy as np
+import pandas as pd
+
+def apply_weights(df_join: pd.DataFrame, auth_default: float, auth_table: Dict[str, float],
+                  tau_days: float, today: Optional[datetime.date] = None) -> pd.Series:
+    """權威度 × 新鮮度（exp(-Δt/τ)）；缺來源用 default、缺日期新鮮度為 1。"""
+    src = df_join['source']
+    w_auth = src.astype(str).map(auth_table).astype(float)
+    w_auth = w_auth.where(src.notna(), np.nan).fillna(auth_default)
+    today = today or datetime.datetime.now(datetime.timezone.utc).date()
+    d = pd.to_datetime(df_join['pub_date'], errors='coerce').dt.normalize()
+    days = (pd.Timestamp(today) - d).dt.days.clip(lower=0)
+    w_fresh = np.exp(-days / max(tau_days, 1e-6)).fillna(1.0)
+    return (w_auth * w_fresh).astype(float)
+
+def aggregate_daily(df: pd.DataFrame, key: Optional[str]) -> pd.DataFrame:
+    """(key, ds) 聚合：n_docs / mean_score / weighted_mean。"""
+    keys = ([key] if key else []) + ['ds']
+    tmp = df.assign(_wx=df['doc_score'] * df['w'])
+    out = tmp.groupby(keys, as_index=False).agg(
+        n_docs=('doc_score', 'size'),
+        mean_score=('doc_score', 'mean'),
+        _sw=('w', 'sum'),
+        _swx=('_wx', 'sum'),
+    )
+    out['weighted_mean'] = out['_swx'] / out['_sw'].clip(lower=1e-9)
+    out = out.drop(columns=['_sw', '_swx'])
+    return out.sort_values(keys).reset_index(drop=True) if not key else out
+
+def _grouped_rolling(s: pd.Series, by, window: int, min_periods: int, center: bool = False):
+    if by is None:
+        return s.rolling(window, min_periods=min_periods, center=center)
+    return s.groupby(by, sort=False).rolling(window, min_periods=min_periods, center=center)
+
+def _realign(r: pd.Series, by) -> pd.Series:
+    # groupby().rolling() 會在前面多一層分組鍵索引
+    return r if by is None else r.droplevel(list(range(r.index.nlevels - 1)))
+
+def denoise(df: pd.DataFrame, key: Optional[str], wl: float, wh: float, med: int) -> pd.DataFrame:
+    s = df['mean_score']
+    if s.empty:
+        return df
+    if key is None:
+        lo, hi = s.quantile(wl), s.quantile(wh)
+    else:
+        g = s.groupby(df[key])
+        lo, hi = g.transform('quantile', wl), g.transform('quantile', wh)
+    wins = s.clip(lower=lo, upper=hi)
+    if med > 1:
+        by = None if key is None else df[key]
+        wins = _realign(_grouped_rolling(wins, by, med, 1, center=True).median(), by)
+    df['mean_score'] = wins
+    return df
+
+def rollings(df: pd.DataFrame, key: Optional[str]) -> pd.DataFrame:
+    df = df.sort_values(([key] if key else []) + ['ds']).copy()
+    s = df['mean_score']
+    by = None if key is None else df[key]
+    rm = _realign(_grouped_rolling(s, by, 30, 5).mean(), by)
+    rs = _realign(_grouped_rolling(s, by, 30, 5).std(), by)
+    rs = rs.where(rs != 0)
+    ewm = s.ewm(span=20, adjust=False) if by is None else s.groupby(by, sort=False).ewm(span=20, adjust=False)
+    df['ewma_20'] = _realign(ewm.mean(), by)
+    df['zscore_30'] = (s - rm) / rs
+    df['cum30'] = _realign(_grouped_rolling(s, by, 30, 1).sum(), by)
+    return df
+
+def surprise(df_daily: pd.DataFrame, key_cols: List[str]) -> pd.DataFrame:
+    """同來源 7 日 Z-score，再對 (key, ds) 取平均。"""
+    if 'source' not in df_daily.columns:
+        df_daily = df_daily.assign(source='NA')
+    df_daily = df_daily.sort_values(key_cols + ['source', 'ds']).copy()
+    s = df_daily['mean_score']
+    by = [df_daily[c] for c in key_cols + ['source']]
+    r = s.groupby(by, sort=False).rolling(7, min_periods=3)
+    mu = _realign(r.mean(), by)
+    sd = _realign(r.std(), by)
+    z = (s - mu) / sd.where(sd != 0)
+    return df_daily.assign(surprise_src7=z).groupby(key_cols + ['ds'], as_index=False)['surprise_src7'].mean()
+
+def build_level(df: pd.DataFrame, key: Optional[str], wl: float, wh: float, med: int) -> pd.DataFrame:
+    """單一層級（entity/industry/market）的完整日度指標表。"""
+    agg = aggregate_daily(df, key)
+    agg = denoise(agg, key, wl, wh, med)
+    agg = rollings(agg, key)
+    keys = [key] if key else []
+    tmp = df.groupby(keys + ['source', 'ds'], as_index=False)['doc_score'].mean().rename(columns={'doc_score': 'mean_score'})
+    sps = surprise(tmp, keys)
+    return agg.merge(sps, on=keys + ['ds'], how='left')
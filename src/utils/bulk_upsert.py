@@ -0,0 +1,59 @@
+"""整批 upsert：取代「每列一次 MERGE」。
+- SQL Server：SELECT TOP 0 ... INTO #stage 複製目標欄位型別 → executemany 進暫存表
+  （引擎開 fast_executemany 時為單次陣列綁定）→ 單一 set-based MERGE。
+- 其他方言（SQLite 等）：分塊 executemany 先 UPDATE 再 INSERT ... WHERE NOT EXISTS。
+呼叫端負責把值整理好（例如 NaN → NULL/0 的政策），這裡只負責搬運。
+"""
+import time
+from typing import Dict, List, Sequence
+from sqlalchemy import create_engine, text
+
+def make_engine(db_url: str, **kw):
+    """批次寫入共用的引擎：pyodbc 開 fast_executemany（executemany 一次陣列綁定，不逐列往返）。
+    kw 直接轉給 create_engine（例如連線池大小）。"""
+    if db_url.startswith("mssql+pyodbc"):
+        kw.setdefault("fast_executemany", True)
+    return create_engine(db_url, future=True, **kw)
+
+def _mssql_upsert(conn, table: str, rows: List[Dict], key_cols: Sequence[str], value_cols: Sequence[str]):
+    cols = list(key_cols) + list(value_cols)
+    stage = f"#stage_{table}"
+    conn.execute(text(f"""
+        IF OBJECT_ID('tempdb..{stage}') IS NOT NULL DROP TABLE {stage};
+        SELECT TOP 0 {', '.join(cols)} INTO {stage} FROM {table};
+    """))
+    conn.execute(text(f"INSERT INTO {stage} ({', '.join(cols)}) VALUES ({', '.join(':' + c for c in cols)})"), rows)
+    on = " AND ".join(f"t.{c}=src.{c}" for c in key_cols)
+    sets = ", ".join(f"{c}=src.{c}" for c in value_cols)
+    conn.execute(text(f"""
+        MERGE {table} AS t
+        USING {stage} AS src
+        ON ({on})
+        WHEN MATCHED THEN UPDATE SET {sets}
+        WHEN NOT MATCHED THEN INSERT ({', '.join(cols)})
+        VALUES ({', '.join('src.' + c for c in cols)});
+    """))
+    conn.execute(text(f"DROP TABLE {stage}"))
+
+def _generic_upsert(conn, table: str, rows: List[Dict], key_cols: Sequence[str], value_cols: Sequence[str]):
+    cols = list(key_cols) + list(value_cols)
+    where = " AND ".join(f"{c}=:{c}" for c in key_cols)
+    conn.execute(text(f"UPDATE {table} SET {', '.join(f'{c}=:{c}' for c in value_cols)} WHERE {where}"), rows)
+    conn.execute(text(f"""
+        INSERT INTO {table} ({', '.join(cols)})
+        SELECT {', '.join(':' + c for c in cols)}
+        WHERE NOT EXISTS (SELECT 1 FROM {table} WHERE {where})
+    """), rows)
+
+def bulk_upsert(engine, table: str, rows: List[Dict], key_cols: Sequence[str], value_cols: Sequence[str],
+                chunk_size: int = 5000, throttle_ms: int = 0) -> int:
+    """rows 的 key 需涵蓋 key_cols + value_cols；每個 chunk 一個交易，throttle_ms 為 chunk 間的休息。"""
+    if not rows:
+        return 0
+    fn = _mssql_upsert if engine.dialect.name == "mssql" else _generic_upsert
+    for i in range(0, len(rows), chunk_size):
+        with engine.begin() as conn:
+            fn(conn, table, rows[i:i+chunk_size], key_cols, value_cols)
+        if throttle_ms > 0 and i + chunk_size < len(rows):
+            time.sleep(throttle_ms / 1000.0)
+    return len(rows)
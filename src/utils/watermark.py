@@ -0,0 +1,28 @@
+"""增量作業的水位線（etl_watermark）：每個 job 一列，記錄上次處理到的時間點。"""
+from sqlalchemy import text
+
+def ensure_watermark_table(engine):
+    with engine.begin() as conn:
+        conn.execute(text("""
+            IF OBJECT_ID('etl_watermark','U') IS NULL
+            BEGIN
+                CREATE TABLE etl_watermark (
+                    job NVARCHAR(64) PRIMARY KEY,
+                    wm DATETIME2 NULL,
+                    updated_at DATETIME2 NOT NULL DEFAULT SYSUTCDATETIME()
+                );
+            END
+        """))
+
+def get_watermark(engine, job: str):
+    with engine.begin() as conn:
+        return conn.execute(text("SELECT wm FROM etl_watermark WHERE job=:j"), {"j": job}).scalar()
+
+def set_watermark(engine, job: str, wm):
+    with engine.begin() as conn:
+        conn.execute(text("""
+            MERGE etl_watermark AS t
+            USING (SELECT :j AS job) AS src ON (t.job = src.job)
+            WHEN MATCHED THEN UPDATE SET wm=:wm, updated_at=SYSUTCDATETIME()
+            WHEN NOT MATCHED THEN INSERT (job, wm) VALUES (:j, :wm);
+        """), {"j": job, "wm": wm})
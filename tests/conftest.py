@@ -0,0 +1,41 @@
+import datetime
+import numpy as np
+import pandas as pd
+import pytest
+
+
+@pytest.fixture
+def backtest_data():
+    """合成的 (訊號, 價格)：回測面板 / sweep 測試共用。"""
+    n_days, n_tk, seed = 120, 40, 3
+    rng = np.random.default_rng(seed)
+    days = [datetime.date(2024, 1, 1) + datetime.timedelta(days=i) for i in range(n_days)]
+    tks = [f"{1000 + i}" for i in range(n_tk)]
+    px = pd.DataFrame([(t, d, float(p)) for t in tks for d, p in zip(days, 100 * np.exp(np.cumsum(rng.normal(0, 0.02, n_days))))],
+                      columns=["ticker", "ds", "px"])
+    px = px.sample(frac=0.9, random_state=1)  # 缺價日：前瞻報酬依列位移
+    sig = pd.DataFrame({"ticker": rng.choice(tks, 3000), "ds": rng.choice(np.array(days, dtype=object), 3000),
+                        "mean_score": rng.choice([-0.5, 0.0, 0.5, 1.0], 3000) + rng.normal(0, 0.1, 3000) * (rng.random(3000) > 0.3)})
+    return sig.drop_duplicates(subset=["ticker", "ds"]), px
+
+
+@pytest.fixture
+def make_signal_docs():
+    """合成文級資料（含 ticker / industry / 來源權重）的產生器：make_signal_docs(n, seed)。"""
+    from src.signals import build_signals as bs
+
+    def build(n=3000, seed=7):
+        rng = np.random.default_rng(seed)
+        base = datetime.date(2025, 1, 1)
+        df = pd.DataFrame({
+            'news_id': np.arange(n),
+            'ds': [base + datetime.timedelta(days=int(d)) for d in rng.integers(0, 90, n)],
+            'doc_score': rng.uniform(-1, 1, n),
+            'source': rng.choice(['Reuters', 'CNA', 'UDN', None], n),
+            'pub_date': [base + datetime.timedelta(days=int(d)) for d in rng.integers(0, 90, n)],
+            'ticker': rng.choice(['2330', '2317', '2454', '2882', '3008'], n),
+            'industry': rng.choice(['半導體', '電子', '金融'], n),
+        })
+        df['w'] = bs._apply_weights(df, 1.0, {'Reuters': 1.5, 'CNA': 1.2}, 30.0)
+        return df
+    return build
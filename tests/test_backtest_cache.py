@@ -0,0 +1,18 @@
+import datetime
+import pandas as pd
+from src.backtest.cache import ColumnarCache
+
+
+def test_cache_roundtrip_and_staleness(tmp_path):
+    cache = ColumnarCache(str(tmp_path))
+    df = pd.DataFrame({"ticker": ["2330", "2317"], "ds": [datetime.date(2024, 1, 2)] * 2, "px": [600.0, 100.5]})
+    calls = []
+    load = lambda: calls.append(1) or df
+    params = {"table": "prices_daily", "price_col": "close"}
+    a = cache.get_or_load("prices", params, "year=2024", ["2024-01-02", 2], load)
+    b = cache.get_or_load("prices", params, "year=2024", ["2024-01-02", 2], load)
+    assert len(calls) == 1 and cache.hits == 1
+    assert b["ds"].tolist() == df["ds"].tolist() and b["px"].tolist() == df["px"].tolist()
+    cache.get_or_load("prices", params, "year=2024", ["2024-01-03", 3], load)  # 指紋改變 → 重新載入
+    cache.get_or_load("prices", dict(params, price_col="adj_close"), "year=2024", ["2024-01-02", 2], load)
+    assert len(calls) == 3
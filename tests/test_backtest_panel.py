@@ -0,0 +1,35 @@
+import datetime
+import numpy as np
+import pandas as pd
+from src.backtest import align_and_backtest as ab
+
+
+def test_panel_metrics_match_legacy(backtest_data):
+    sig, px = backtest_data
+    a = ab._calc_daily_cs_metrics(sig, px, [1, 5, 10])
+    b = ab._calc_daily_cs_metrics_legacy(sig, px, [1, 5, 10])
+    assert a["horizon"].tolist() == b["horizon"].tolist()
+    for c in ["ic", "ic_p", "ric", "ric_p", "hitrate", "n_days", "n_pairs"]:
+        np.testing.assert_allclose(a[c].to_numpy(dtype=float), b[c].to_numpy(dtype=float), rtol=1e-9, atol=1e-12, err_msg=c)
+
+
+def test_shared_panel_slice_matches_direct(tmp_path, backtest_data):
+    from src.backtest import panel
+    sig, px = backtest_data
+    fwd = panel.forward_returns(px, [1, 5])
+    meta = panel.save_shared(fwd, [1, 5], str(tmp_path))
+    part = sig[sig["ds"] >= datetime.date(2024, 2, 1)]
+    a = ab._calc_daily_cs_metrics(part, None, [1, 5], fwd_df=panel.load_shared(meta, "2024-02-01"))
+    b = ab._calc_daily_cs_metrics(part, px, [1, 5])
+    np.testing.assert_allclose(a["ic"].to_numpy(), b["ic"].to_numpy(), rtol=1e-12)
+
+
+def test_event_study_matches_legacy(backtest_data):
+    sig, px = backtest_data
+    evt, car = ab._event_study(sig, px, [1, 5], [0.9, 0.95], car_days=5)
+    for p in [0.9, 0.95]:
+        a = evt[evt["pct"] == p].reset_index(drop=True)
+        b = ab._event_study_legacy(sig, px, [1, 5], p)
+        assert a[["side", "horizon", "n_events"]].values.tolist() == b[["side", "horizon", "n_events"]].values.tolist()
+        np.testing.assert_allclose(a["mean_ret"].to_numpy(), b["mean_ret"].to_numpy(), rtol=1e-12)
+    assert sorted(car["k"].unique().tolist()) == [1, 2, 3, 4, 5]
@@ -0,0 +1,53 @@
+import itertools
+import numpy as np
+import pandas as pd
+from src.backtest import align_and_backtest as ab
+from src.backtest import panel, sweep
+
+
+def test_sweep_rows_filtered_per_combination(monkeypatch, backtest_data):
+    sig, px = backtest_data
+    rng = np.random.default_rng(5)
+    sig = sig.assign(n_docs=rng.integers(1, 5, len(sig)))
+    calls = []
+
+    def fake_load(engine, cache, part, st, en, cutoff, chunk_size, throttle_ms, min_docs, **kw):
+        calls.append((part, cutoff, min_docs))
+        return sig
+    monkeypatch.setattr(ab, "_load_aligned_signals_cached", fake_load)
+
+    all_h, pcts = [1, 5, 10], [0.9, 0.95]
+    fwd = panel.forward_returns(px, all_h)
+    fold = ("F1", 2024, "2024-01-01", "2024-04-30")
+    res = sweep._eval_cutoff_fold(None, fold, fwd, "13:30", [1, 3], all_h, pcts, 1000, 0, None, sig_table="news_doc_sentiment")
+    # 訊號每個 (cutoff, fold) 只讀一次（min_docs=1），min_docs 在下游過濾
+    assert calls == [("F1", "13:30", 1)]
+    assert [r["min_docs"] for r in res] == [1, 3]
+
+    for hs, p, r in itertools.product([[1, 5], [10]], pcts, res):
+        combo = {"cutoff": "13:30", "horizons": hs, "percentile": p, "min_docs": r["min_docs"]}
+        rows = sweep._tidy_rows("SWX", 7, combo, r)
+        assert rows and all(x["pid"] == 7 and x["f"] == "F1" and x["y"] == 2024 for x in rows)
+        assert {x["h"] for x in rows} == set(hs)
+        cs = [x for x in rows if x["s"] is None]
+        evt = [x for x in rows if x["s"] is not None]
+        assert len(cs) == len(hs) * len(sweep._CS_METRICS)
+        assert {x["m"] for x in evt} == {"mean_ret"}
+
+        # 與只用該組合參數直接計算的結果一致（min_docs 過濾、horizon 與分位不會被錯標）
+        part = sig[sig["n_docs"] >= r["min_docs"]]
+        met = ab._calc_daily_cs_metrics(part, None, hs, fwd_df=fwd).set_index("horizon")
+        for x in cs:
+            exp = ab._to_db_float(met.loc[x["h"], x["m"]])
+            assert (x["v"] is None and exp is None) or np.isclose(x["v"], exp, rtol=1e-12), (x, exp)
+            # n：IC 類為有效日數；n_pairs / n_days 本身即筆數，不再附 n
+            assert x["n"] == (None if x["m"] in ("n_pairs", "n_days") else int(met.loc[x["h"], "n_days"])), x
+        ev, _ = ab._event_study(part, None, hs, [p], fwd_df=fwd)
+        exp_evt = {(int(e["horizon"]), e["side"]): (ab._to_db_float(e["mean_ret"]), int(e["n_events"]))
+                   for e in ev.to_dict("records")}
+        got_evt = {(x["h"], x["s"]): (x["v"], x["n"]) for x in evt}
+        assert got_evt.keys() == exp_evt.keys()
+        for k, (v, n) in got_evt.items():
+            ev_v, ev_n = exp_evt[k]
+            assert n == ev_n
+            assert (v is None and ev_v is None) or np.isclose(v, ev_v, rtol=1e-12)
@@ -0,0 +1,62 @@
+import threading
+import time
+
+import pytest
+
+from src.app.batcher import MicroBatcher
+
+
+def _submit_all(b, texts):
+    out, errs = [None] * len(texts), [None] * len(texts)
+
+    def call(i, t):
+        try:
+            out[i] = b.submit(t, timeout=5)
+        except Exception as e:
+            errs[i] = e
+    ths = [threading.Thread(target=call, args=(i, t)) for i, t in enumerate(texts)]
+    for th in ths:
+        th.start()
+    for th in ths:
+        th.join()
+    return out, errs
+
+
+def test_coalesce_and_max_wait_flush():
+    calls = []
+
+    def fn(texts):
+        calls.append(list(texts))
+        return [float(len(t)) for t in texts]
+    b = MicroBatcher(fn, max_batch=3, max_wait_ms=300)
+    try:
+        out, errs = _submit_all(b, ["a", "bb", "ccc"])
+        assert out == [1.0, 2.0, 3.0] and errs == [None] * 3
+        # 三筆併發請求湊成一批
+        assert len(calls) == 1 and sorted(calls[0]) == ["a", "bb", "ccc"]
+        # 未湊滿 max_batch 時，等到 max_wait_ms 就送出
+        t0 = time.perf_counter()
+        assert b.submit("dddd", timeout=5) == 4.0
+        assert 0.25 <= time.perf_counter() - t0 < 3.0
+    finally:
+        b.close()
+
+
+def test_errors_propagate_to_every_caller():
+    def boom(texts):
+        raise ValueError("model down")
+    b = MicroBatcher(boom, max_batch=4, max_wait_ms=50)
+    try:
+        _, errs = _submit_all(b, ["a", "b"])
+        assert all(isinstance(e, ValueError) for e in errs)
+    finally:
+        b.close()
+
+
+def test_short_result_fails_instead_of_hanging():
+    b = MicroBatcher(lambda texts: [0.5] * (len(texts) - 1), max_batch=4, max_wait_ms=100)
+    try:
+        _, errs = _submit_all(b, ["a", "b", "c"])
+        assert all(isinstance(e, RuntimeError) for e in errs)
+    finally:
+        b.close()
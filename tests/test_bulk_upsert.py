@@ -0,0 +1,22 @@
+import datetime
+import numpy as np
+import pandas as pd
+from sqlalchemy import create_engine, text
+from src.signals import build_signals as bs
+
+
+def test_write_level_upserts_and_applies_nan_policy():
+    eng = create_engine("sqlite://", future=True)
+    with eng.begin() as conn:
+        conn.execute(text("""CREATE TABLE signals_entity_daily (id INTEGER PRIMARY KEY, ticker TEXT, ds DATE,
+            n_docs INT, mean_score FLOAT, weighted_mean FLOAT, ewma_20 FLOAT, zscore_30 FLOAT, cum30 FLOAT, surprise_src7 FLOAT)"""))
+    d = datetime.date(2025, 3, 1)
+    agg = pd.DataFrame({'ticker': ['2330', '2317'], 'ds': [d, d], 'n_docs': [3, 1], 'mean_score': [0.5, np.nan],
+                        'weighted_mean': [0.4, 0.1], 'ewma_20': [0.3, np.inf], 'zscore_30': [np.nan, np.nan],
+                        'cum30': [1.0, 2.0], 'surprise_src7': [np.nan, 0.2]})
+    assert bs._write_level(eng, 'signals_entity_daily', 'ticker', agg, 'null', 0) == 2
+    agg.loc[0, 'n_docs'] = 5
+    bs._write_level(eng, 'signals_entity_daily', 'ticker', agg, 'zero', 0)
+    with eng.begin() as conn:
+        rows = conn.execute(text("SELECT ticker, n_docs, mean_score, ewma_20, zscore_30 FROM signals_entity_daily ORDER BY ticker")).fetchall()
+    assert [tuple(r) for r in rows] == [('2317', 1, 0.0, 0.0, 0.0), ('2330', 5, 0.5, 0.3, 0.0)]
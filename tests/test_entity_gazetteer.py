@@ -0,0 +1,26 @@
+import os
+import yaml
+from src.etl import gazetteer
+from src.etl.entity_link import load_gaz
+
+GAZ = {"companies": [
+    {"ticker": "2330", "name": "台積電", "industry": "半導體", "aliases": ["台積", "TSMC"]},
+    {"ticker": "9999", "name": "台積", "industry": "其他", "aliases": []},
+    {"ticker": "2317", "name": "鴻海", "industry": "電子代工", "aliases": ["Foxconn"]},
+]}
+
+
+def test_longest_match_and_matched_json_shape(tmp_path):
+    p = tmp_path / "g.yaml"
+    p.write_text(yaml.safe_dump(GAZ, allow_unicode=True), encoding="utf-8")
+    cache = str(tmp_path / "cache")
+    ents, ac, h = gazetteer.load_matcher(str(p), load_gaz, cache)
+    hits = gazetteer.link_document("台積電與鴻海合作，TSMC 股價上漲；台積表示…Foxconn", ents, ac)
+    assert hits == [
+        {"ticker": "2330", "name": "台積電", "industry": "半導體", "matches": ["台積電", "TSMC", "台積"], "count": 3},
+        {"ticker": "9999", "name": "台積", "industry": "其他", "matches": ["台積"], "count": 1},
+        {"ticker": "2317", "name": "鴻海", "industry": "電子代工", "matches": ["鴻海", "Foxconn"], "count": 2},
+    ]
+    assert os.listdir(cache) == [f"{h}.pkl"]
+    _, ac2, _ = gazetteer.load_matcher(str(p), lambda _: (_ for _ in ()).throw(AssertionError("rebuilt")), cache)
+    assert ac2.find("台積電") == ac.find("台積電")
@@ -0,0 +1,39 @@
+from sqlalchemy import create_engine, event, text
+from src.etl import gazetteer
+from src.etl.entity_link import _affected_ids, _write_links
+
+V1 = [{"ticker": "2330", "name": "台積電", "industry": "半導體", "aliases": ["TSMC"]},
+      {"ticker": "2317", "name": "鴻海", "industry": "電子代工", "aliases": []}]
+V2 = [{"ticker": "2330", "name": "台積電", "industry": "半導體", "aliases": []},          # 移除 TSMC
+      {"ticker": "2317", "name": "鴻海", "industry": "電子代工", "aliases": ["Foxconn"]},  # 新增 Foxconn
+      {"ticker": "2454", "name": "聯發科", "industry": "IC設計", "aliases": []}]          # 新公司
+
+DOCS = {1: "TSMC 法說會", 2: "鴻海 Foxconn 擴產", 3: "聯發科新晶片", 4: "台積電與鴻海", 5: "大盤收紅"}
+
+
+def _engine():
+    eng = create_engine("sqlite://", future=True)
+    event.listen(eng, "connect", lambda c, _: c.create_function("SYSUTCDATETIME", 0, lambda: "now"))
+    with eng.begin() as c:
+        c.execute(text("CREATE TABLE news_proc (news_id INT, cleaned TEXT)"))
+        c.execute(text("CREATE TABLE news_entity (id INTEGER PRIMARY KEY, news_id INT, matched_json TEXT, created_at TEXT)"))
+        c.execute(text("CREATE TABLE news_entity_ticker (news_id INT, ticker TEXT, industry TEXT)"))
+        c.execute(text("CREATE TABLE news_alias_index (alias TEXT, news_id INT)"))
+        c.execute(text("CREATE TABLE news_entity_linked (news_id INT PRIMARY KEY, gaz_version TEXT)"))
+        c.execute(text("INSERT INTO news_proc VALUES (:i, :t)"), [{"i": i, "t": t} for i, t in DOCS.items()])
+    return eng
+
+
+def test_only_docs_with_changed_aliases_are_relinked():
+    eng = _engine()
+    ac1 = gazetteer.build_matcher(V1)
+    with eng.begin() as c:
+        n = _write_links(c, list(DOCS.items()), lambda t: gazetteer.link_document(t, V1, ac1), "v1")
+        assert n == 3
+        # 重跑同一批：先刪後寫，不會重複
+        _write_links(c, list(DOCS.items()), lambda t: gazetteer.link_document(t, V1, ac1), "v1")
+        assert c.execute(text("SELECT COUNT(*) FROM news_entity")).scalar() == 3
+        assert c.execute(text("SELECT COUNT(*) FROM news_entity_linked")).scalar() == 5
+        removed, added = gazetteer.changed_aliases(gazetteer.alias_signatures(V1), gazetteer.alias_signatures(V2))
+        assert removed == {"TSMC"} and added == {"Foxconn", "聯發科"}
+        assert _affected_ids(c, "v1", removed, added) == {1, 2, 3}
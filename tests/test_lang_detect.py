@@ -0,0 +1,18 @@
+from src.nlp.preprocess import LangDetector
+
+
+def test_script_tier_decides_obvious_text():
+    d = LangDetector()
+    assert d.classify("央行理監事會決議維持利率不變，並宣布調整選擇性信用管制措施。") == ("zh", "script")
+    assert d.classify("AI 伺服器") == ("zh", "script")
+    assert d.classify("The Federal Reserve held rates steady on Wednesday and signaled no hurry to cut.") == ("en", "script")
+    assert d.classify("今日は晴れです。東京の株価は上昇しました。")[0] == "ja"
+
+
+def test_ambiguous_text_uses_source_history():
+    d = LangDetector(source_min=3)
+    assert d.classify("TSMC 2330", "cnyes")[1] == "langdetect"
+    for _ in range(3):
+        d.classify("台積電法說會釋出利多，訂單可見度上修。", "cnyes")
+    assert d.classify("TSMC 2330", "cnyes") == ("zh", "source")
+    assert d.classify("TSMC 2330", "other")[1] == "langdetect"
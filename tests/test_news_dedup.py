@@ -0,0 +1,26 @@
+import random
+from src.etl.dedup_news import MinHashIndex, assign_clusters, minhash
+
+
+def _doc(rng, n=400):
+    return "".join(chr(0x4E00 + rng.randrange(3000)) for _ in range(n))
+
+
+def test_reposts_join_first_cluster():
+    rng = random.Random(7)
+    a, c = _doc(rng), _doc(rng)
+    repost = "【財經快訊】" + a[:200] + "，" + a[200:] + "（記者報導）"
+    recs = assign_clusters([(10, a), (11, c), (12, repost), (13, "短訊")], MinHashIndex(0.8))
+    assert [(r["nid"], r["cid"]) for r in recs] == [(10, 10), (11, 11), (12, 10), (13, 13)]
+    assert recs[3]["sig"] is None
+
+
+def test_signature_roundtrip_is_stable():
+    import numpy as np
+    rng = random.Random(1)
+    a = _doc(rng)
+    sig = minhash(a)
+    idx = MinHashIndex(0.8)
+    idx.add(np.frombuffer(sig.tobytes(), dtype=np.uint32), 5)
+    assert idx.query(minhash(a)) == 5
+    assert idx.query(minhash(_doc(rng))) is None
@@ -0,0 +1,45 @@
+import json
+from sqlalchemy import create_engine
+from src.etl import preprocess_news as pn
+from src.nlp.preprocess import preprocess_document
+
+_ROWS = [(i, f"台積電第{i}季營收創新高", "法人看好後市，外資連續買超。" * (i % 3 + 1), "cna") if i % 2 else
+         (i, f"Apple quarter {i} revenue beats estimates", "Analysts raised their targets. Shares rose today. " * (i % 3 + 1), "reuters")
+         for i in range(1, 48)]
+
+
+def _pages(rows, size):
+    return [rows[i:i + size] for i in range(0, len(rows), size)]
+
+
+def test_chunked_preprocess_matches_document_loop():
+    got = [r for ch in pn._chunks(_pages(_ROWS, 10), 7) for r in pn._preprocess_chunk(ch)]
+    exp = []
+    for rid, title, content, source in _ROWS:
+        r = preprocess_document(title, content, source)
+        exp.append({"news_id": rid, "lang": r.lang, "cleaned": r.cleaned,
+                    "sentences_json": json.dumps(r.sentences, ensure_ascii=False)})
+    assert [{k: v for k, v in x.items() if k != "created_at"} for x in got] == exp
+
+
+def test_run_flushes_in_bounded_batches(monkeypatch):
+    events = []
+
+    def fake_pending(engine, days, limit, page_size):
+        for page in _pages(_ROWS, page_size):
+            events.append(("read", len(page)))
+            yield page
+    monkeypatch.setattr(pn, "make_engine", lambda url: create_engine("sqlite://", future=True))
+    monkeypatch.setattr(pn, "_iter_pending", fake_pending)
+    monkeypatch.setattr(pn, "_write", lambda engine, recs: events.append(("write", len(recs))))
+    pn.run(limit=1000, page_size=10, chunk_size=4, commit_every=12)
+
+    writes = [n for e, n in events if e == "write"]
+    assert sum(writes) == len(_ROWS)
+    # 每批滿 commit_every 即寫（最多多出一個 chunk），最後一批為剩餘
+    assert all(12 <= n < 12 + 4 for n in writes[:-1]) and writes[-1] <= 12 + 4
+    # 邊讀邊寫：未寫入的篇數任何時候都不超過 commit_every + 一頁
+    pending = 0
+    for e, n in events:
+        pending += n if e == "read" else -n
+        assert pending < 12 + 10
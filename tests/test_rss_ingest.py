@@ -0,0 +1,176 @@
+import asyncio, threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from src.etl.fetchers.rss_fetcher import RssIngestor
+
+FEED = b"""<?xml version="1.0"?><rss><channel>
+<item><title>A</title><link>https://x.test/a</link><pubDate>Mon, 01 Sep 2025 08:00:00 GMT</pubDate><description>aa</description></item>
+<item><title>B</title><link>https://x.test/b</link></item>
+</channel></rss>"""
+
+
+class _Stub(BaseHTTPRequestHandler):
+    hits = {}
+
+    def do_GET(self):
+        n = _Stub.hits[self.path] = _Stub.hits.get(self.path, 0) + 1
+        if self.path == "/flaky" and n == 1:
+            self.send_response(503); self.send_header("Retry-After", "0"); self.end_headers(); return
+        if self.headers.get("If-None-Match") == '"v1"':
+            self.send_response(304); self.end_headers(); return
+        self.send_response(200)
+        self.send_header("ETag", '"v1"')
+        self.send_header("Content-Type", "application/rss+xml")
+        self.end_headers()
+        self.wfile.write(FEED)
+
+    def log_message(self, *a):
+        pass
+
+
+def test_conditional_get_and_retry():
+    srv = ThreadingHTTPServer(("127.0.0.1", 0), _Stub)
+    threading.Thread(target=srv.serve_forever, daemon=True).start()
+    base = f"http://127.0.0.1:{srv.server_port}"
+    urls = [base + "/feed", base + "/flaky"]
+
+    async def go():
+        async with RssIngestor(per_host=2, retries=2, backoff_base=0.01) as ing:
+            first = await ing.fetch_all(urls)
+            second = await ing.fetch_all(urls, {u: st for u, (_, st, _) in first.items()})
+        return first, second
+    try:
+        first, second = asyncio.run(go())
+    finally:
+        srv.shutdown()
+    for u in urls:
+        items, st, err = first[u]
+        assert err is None and [i["link"] for i in items] == ["https://x.test/a", "https://x.test/b"]
+        assert st["etag"] == '"v1"' and st["status"] == 200
+        items, st, err = second[u]
+        assert err is None and items is None and st["status"] == 304
+    assert _Stub.hits["/flaky"] == 3
+
+
+def test_stream_yields_before_download_completes():
+    gate = threading.Event()
+
+    class _Slow(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def do_GET(self):
+            self.send_response(200)
+            self.send_header("Transfer-Encoding", "chunked")
+            self.end_headers()
+            head, rest = FEED.split(b"<item><title>B")
+            for part in (head, b"<item><title>B" + rest):
+                self.wfile.write(b"%x\r\n%s\r\n" % (len(part), part)); self.wfile.flush()
+                gate.wait(5)
+            self.wfile.write(b"0\r\n\r\n")
+
+        def log_message(self, *a):
+            pass
+
+    srv = ThreadingHTTPServer(("127.0.0.1", 0), _Slow)
+    threading.Thread(target=srv.serve_forever, daemon=True).start()
+
+    async def go():
+        got = []
+        async with RssIngestor() as ing:
+            st = {}
+            async for it in ing.stream(f"http://127.0.0.1:{srv.server_port}/", st):
+                got.append((it["title"], gate.is_set()))
+                gate.set()
+        return got
+    try:
+        got = asyncio.run(go())
+    finally:
+        gate.set(); srv.shutdown()
+    assert got == [("A", False), ("B", True)]
+
+
+def test_write_items_dedups_by_normalized_url():
+    from sqlalchemy import create_engine, select
+    from sqlalchemy.orm import sessionmaker
+    from src.app.storage.models import Base, News
+    from src.etl.rss_to_db import _write_items
+
+    engine = create_engine("sqlite://", future=True)
+    Base.metadata.create_all(engine)
+    Session = sessionmaker(bind=engine, future=True)
+    with Session() as s:
+        s.add(News(title="old", url="https://X.test/old?utm_source=rss")); s.commit()
+    batch = [("f", {"title": "A", "link": "https://x.test/a?utm_source=rss#top"}),
+             ("f", {"title": "A2", "link": "https://X.test:443/a"}),
+             ("f", {"title": "O", "link": "https://X.test/old?utm_source=rss"}),
+             ("f", {"title": "B", "link": "https://x.test/b"}),
+             ("f", {"title": "-", "link": ""})]
+    assert _write_items(Session, batch, set()) == 2
+    assert _write_items(Session, batch, set()) == 0
+    with Session() as s:
+        assert sorted(s.execute(select(News.url)).scalars()) == [
+            "https://X.test/old?utm_source=rss", "https://x.test/a", "https://x.test/b"]
+
+
+def test_validators_kept_when_body_is_cut():
+    class _Cut(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def do_GET(self):
+            self.send_response(200)
+            self.send_header("ETag", '"v2"')
+            self.send_header("Content-Length", str(len(FEED) + 100))
+            self.end_headers()
+            self.wfile.write(FEED.split(b"<item><title>B")[0]); self.wfile.flush()
+            self.close_connection = True
+
+        def log_message(self, *a):
+            pass
+
+    srv = ThreadingHTTPServer(("127.0.0.1", 0), _Cut)
+    threading.Thread(target=srv.serve_forever, daemon=True).start()
+
+    st = {"etag": '"v1"'}
+
+    async def go():
+        got = []
+        async with RssIngestor(retries=0) as ing:
+            try:
+                async for it in ing.stream(f"http://127.0.0.1:{srv.server_port}/", st):
+                    got.append(it["title"])
+            except Exception as e:
+                return got, e
+        return got, None
+    try:
+        got, err = asyncio.run(go())
+    finally:
+        srv.shutdown()
+    # 內文沒讀完：已讀到的 item 照常產出，但不可換成新的 ETag，否則下次 304 會永久漏掉後半的 item
+    assert got == ["A"] and err is not None
+    assert st["etag"] == '"v1"' and st["status"] == 200
+
+
+def test_main_raises_when_writer_fails(monkeypatch):
+    from sqlalchemy import create_engine
+    from sqlalchemy.pool import StaticPool
+    from src.etl import rss_to_db
+
+    def boom(*a, **kw):
+        raise RuntimeError("db down")
+    monkeypatch.setattr(rss_to_db, "make_engine",
+                        lambda url: create_engine("sqlite://", future=True, poolclass=StaticPool,
+                                                  connect_args={"check_same_thread": False}))
+    monkeypatch.setattr(rss_to_db, "_write_items", boom)
+    _Stub.hits = {}
+    srv = ThreadingHTTPServer(("127.0.0.1", 0), _Stub)
+    threading.Thread(target=srv.serve_forever, daemon=True).start()
+    urls = [f"http://127.0.0.1:{srv.server_port}/feed{i}" for i in range(20)]
+    try:
+        # batch_size=1 → 佇列上限 4，寫入端掛掉後下載端必定塞在 put；不可卡住，例外要拋出
+        err = None
+        try:
+            asyncio.run(asyncio.wait_for(rss_to_db.main(urls, batch_size=1), 10))
+        except Exception as e:
+            err = e
+    finally:
+        srv.shutdown()
+    assert isinstance(err, RuntimeError) and str(err) == "db down"
@@ -0,0 +1,58 @@
+import json
+import types
+from fastapi.testclient import TestClient
+from src.app import api
+from src.models.length_bucket import iter_length_buckets, iter_windows
+
+
+def test_buckets_cover_each_window_sorted_by_length():
+    lengths = [5, 1, 9, 3, 3, 7, 2]
+    buckets = list(iter_length_buckets(lengths, 3))
+    assert sorted(i for b in buckets for i in b) == list(range(len(lengths)))
+    flat = [lengths[i] for b in buckets for i in b]
+    assert flat == sorted(lengths) and all(len(b) <= 3 for b in buckets)
+    assert [list(w) for w in iter_windows(7, 3)] == [[0, 1, 2], [3, 4, 5], [6]]
+    assert [list(w) for w in iter_windows(3, 0)] == [[0, 1, 2]]
+
+
+def _stub_runtime(monkeypatch, fail_on=None):
+    calls = []
+
+    def score_texts(texts):
+        calls.append(list(texts))
+        if fail_on is not None and fail_on in texts:
+            raise RuntimeError("boom")
+        return [len(t) / 100.0 for t in texts]
+    rt = types.ModuleType("src.models.runtime")
+    rt.score_text = lambda t: score_texts([t])[0]
+    rt.score_texts = score_texts
+    monkeypatch.setitem(__import__("sys").modules, "src.models.runtime", rt)
+    monkeypatch.setenv("TRANSFORMER_READY", "1")
+    monkeypatch.setattr(api, "SCORE_BATCH_WINDOW", 4)
+    monkeypatch.setattr(api, "SCORE_BATCH_CHUNK", 2)
+    return calls
+
+
+def test_score_batch_keeps_input_order_across_windows_and_buckets(monkeypatch):
+    calls = _stub_runtime(monkeypatch)
+    texts = ["x" * n for n in [9, 1, 7, 3, 8, 2, 6, 4, 5, 10]]
+    client = TestClient(api.app)
+    lines = [json.loads(x) for x in client.post("/score/batch", json={"texts": texts}).text.splitlines()]
+    assert [x["i"] for x in lines] == list(range(len(texts)))
+    assert [x["score"] for x in lines] == [len(t) / 100.0 for t in texts]
+    # 3 個視窗（4+4+2），每窗依長度排序後 2 筆一批
+    assert len(calls) == 5 and all(len(c) <= 2 and len(c[0]) <= len(c[-1]) for c in calls)
+    got = client.post("/score/batch", json={"texts": texts, "stream": False}).json()
+    assert got["scores"] == [x["score"] for x in lines]
+
+
+def test_score_batch_stream_reports_error_line(monkeypatch):
+    _stub_runtime(monkeypatch, fail_on="x" * 8)
+    texts = ["x" * n for n in [1, 2, 3, 4, 8, 9]]
+    client = TestClient(api.app)
+    lines = [json.loads(x) for x in client.post("/score/batch", json={"texts": texts}).text.splitlines()]
+    # 第一個視窗（4 筆）完整輸出，第二個視窗失敗 → 最後一行為 error
+    assert [x.get("i") for x in lines[:-1]] == [0, 1, 2, 3]
+    assert "boom" in lines[-1]["error"]
+    r = client.post("/score/batch", json={"texts": ["x" * 8001]})
+    assert r.status_code == 422
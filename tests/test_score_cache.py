@@ -0,0 +1,18 @@
+from src.models.score_cache import ScoreCache, normalize_text
+
+
+def test_normalize_text():
+    assert normalize_text("  台積電　上修\n資本支出 ") == "台積電 上修 資本支出"
+
+
+def test_lru_and_disk_tier(tmp_path):
+    db = str(tmp_path / "cache.sqlite")
+    c = ScoreCache("v1", capacity=2, disk_path=db)
+    c.put_many(["a", "b", "c"], [[1.0], [2.0], [3.0]], ns="128")
+    # 記憶體層只留最近 2 筆，"a" 需從磁碟層取回
+    assert c.get_many(["a", "c", "zzz"], ns="128") == [[1.0], [3.0], None]
+    st = c.stats()
+    assert (st["hits_mem"], st["hits_disk"], st["misses"]) == (1, 1, 1)
+    # 不同 ns / 模型版本不共用
+    assert c.get("a", ns="512") is None
+    assert ScoreCache("v2", disk_path=db).get("a", ns="128") is None
@@ -0,0 +1,146 @@
+import datetime, json
+import numpy as np
+import pandas as pd
+from src.signals import incremental as inc
+from src.signals import vectorized as vec
+
+
+def test_incremental_matches_full_on_new_day(make_signal_docs):
+    # 不做 winsorize / 中位數濾波時，增量結果應與全量在新的一天完全一致
+    df = make_signal_docs(3000)
+    last = df['ds'].max()
+    old, new = df[df['ds'] < last], df[df['ds'] == last]
+    today = last + datetime.timedelta(days=1)
+    for key in ['ticker', None]:
+        full = vec.build_level(df, key, 0.0, 1.0, 1)
+        states = inc.seed_state(old, vec.build_level(old, key, 0.0, 1.0, 1), key, hist_days=365, today=today)
+        out = inc.update_level(states, new, key, 0.0, 1.0, 1, hist_days=365, today=today)
+        exp = full[full['ds'] == last].assign(key=(full[key].astype(str) if key else inc.MARKET_KEY))
+        a = out.sort_values('key').reset_index(drop=True)
+        b = exp.sort_values('key').reset_index(drop=True)
+        assert a['key'].tolist() == b['key'].tolist()
+        for c in ['n_docs', 'mean_score', 'weighted_mean', 'ewma_20', 'zscore_30', 'cum30', 'surprise_src7']:
+            np.testing.assert_allclose(pd.to_numeric(a[c]).to_numpy(dtype=float),
+                                       pd.to_numeric(b[c]).to_numpy(dtype=float),
+                                       rtol=1e-9, atol=1e-9, equal_nan=True, err_msg=c)
+
+
+def _n_docs(states):
+    return {k: sum(d[1] for d in st["days"]) for k, st in states.items()}
+
+
+def test_reaggregated_doc_replaces_old_contribution(make_signal_docs):
+    # doc_aggregate 重新彙總會更新 created_at（新的 ds）與分數：只能換掉舊貢獻，不能重複計數
+    df = make_signal_docs(3000)
+    last = df['ds'].max()
+    today = last + datetime.timedelta(days=1)
+    for key in ['ticker', None]:
+        states = inc.seed_state(df, vec.build_level(df, key, 0.0, 1.0, 1), key, hist_days=365, today=today)
+        before = _n_docs(states)
+        doc = df[df['ds'] < last].head(1).assign(ds=last, doc_score=0.9)
+        k = str(doc[key].iloc[0]) if key else inc.MARKET_KEY
+        old_ds = df.loc[df['news_id'] == doc['news_id'].iloc[0], 'ds'].iloc[0].isoformat()
+        old_day_n = next(d[1] for d in states[k]["days"] if d[0] == old_ds)
+        for _ in range(2):  # 同一篇再併一次也不變
+            out = inc.update_level(states, doc, key, 0.0, 1.0, 1, hist_days=365, today=today)
+            assert _n_docs(states) == before
+        assert next((d[1] for d in states[k]["days"] if d[0] == old_ds), 0) == old_day_n - 1
+        assert set(out['ds']) >= {last.isoformat()}
+        # 扣掉舊貢獻後，重算結果與用新資料全量計算一致
+        df2 = df.copy()
+        df2.loc[df2['news_id'] == doc['news_id'].iloc[0], ['ds', 'doc_score']] = [last, 0.9]
+        full = vec.build_level(df2, key, 0.0, 1.0, 1)
+        exp = full[full['ds'] == last]
+        exp = exp[exp[key].astype(str) == k] if key else exp
+        got = out[out['ds'] == last.isoformat()]
+        np.testing.assert_allclose(got['weighted_mean'].to_numpy(dtype=float), exp['weighted_mean'].to_numpy(dtype=float), rtol=1e-9)
+        assert got['n_docs'].tolist() == exp['n_docs'].tolist()
+
+
+def test_removed_dup_is_subtracted_from_state(make_signal_docs):
+    # 文件已併入狀態後才被 dedup_news 標為重複文：只扣不加，結果與去掉該篇後全量計算一致
+    df = make_signal_docs(3000)
+    last = df['ds'].max()
+    today = last + datetime.timedelta(days=1)
+    for key in ['ticker', None]:
+        states = inc.seed_state(df, vec.build_level(df, key, 0.0, 1.0, 1), key, hist_days=365, today=today)
+        before = _n_docs(states)
+        nid = int(df[df['ds'] == last]['news_id'].iloc[0])
+        k = str(df.loc[df['news_id'] == nid, key].iloc[0]) if key else inc.MARKET_KEY
+        n = states[k]["docs"][str(nid)][2]
+        for _ in range(2):  # 重複扣除不會扣成負的
+            out = inc.update_level(states, df.iloc[:0], key, 0.0, 1.0, 1, hist_days=365, today=today,
+                                   removed={k: [nid]})
+        assert _n_docs(states) == dict(before, **{k: before[k] - n})
+        out = inc.update_level(states, df.iloc[:0], key, 0.0, 1.0, 1, hist_days=365, today=today, removed={k: []})
+        assert out.empty
+        states = inc.seed_state(df, vec.build_level(df, key, 0.0, 1.0, 1), key, hist_days=365, today=today)
+        out = inc.update_level(states, df.iloc[:0], key, 0.0, 1.0, 1, hist_days=365, today=today, removed={k: [nid]})
+        full = vec.build_level(df[df['news_id'] != nid], key, 0.0, 1.0, 1)
+        exp = full[full['ds'] == last]
+        exp = exp[exp[key].astype(str) == k] if key else exp
+        got = out[out['ds'] == last.isoformat()]
+        assert got['n_docs'].tolist() == exp['n_docs'].tolist()
+        np.testing.assert_allclose(got['weighted_mean'].to_numpy(dtype=float), exp['weighted_mean'].to_numpy(dtype=float), rtol=1e-9)
+
+
+def _state_engine():
+    from sqlalchemy import create_engine, text
+    engine = create_engine("sqlite://", future=True)
+    with engine.begin() as conn:  # ensure_state_table 為 T-SQL，這裡用等價的 SQLite 表
+        conn.execute(text("CREATE TABLE signals_state (level TEXT, skey TEXT, state_json TEXT, updated_at TIMESTAMP, "
+                          "PRIMARY KEY (level, skey))"))
+        conn.execute(text("CREATE TABLE signals_state_doc (level TEXT, skey TEXT, news_id INT, ds DATE, source TEXT, "
+                          "n INT, cnt INT, ssum FLOAT, sw FLOAT, swx FLOAT, PRIMARY KEY (level, skey, news_id))"))
+    return engine
+
+
+def _by_key(m):
+    return sorted((k, n) for k, v in m.items() for n in v)
+
+
+def test_doc_contributions_persist_per_row(make_signal_docs):
+    # 逐篇貢獻存在 signals_state_doc：state_json 不含 docs，增量只載入 / 改寫本批 news_id 的列
+    from sqlalchemy import text
+    df = make_signal_docs(3000)
+    last = df['ds'].max()
+    today = last + datetime.timedelta(days=1)
+    key = 'ticker'
+    engine = _state_engine()
+    seeded = inc.seed_state(df, vec.build_level(df, key, 0.0, 1.0, 1), key, hist_days=365, today=today)
+    inc.save_states(engine, 'entity', seeded, replace_docs=True)
+    with engine.begin() as conn:
+        assert conn.execute(text("SELECT COUNT(*) FROM signals_state_doc")).scalar() == len(df)
+        assert all('docs' not in json.loads(js) for js in conn.execute(text("SELECT state_json FROM signals_state")).scalars())
+
+    # 一篇換 key（重新連結實體）、一篇重新彙總、一篇被標為重複
+    moved, reagg, dup = (int(x) for x in df[df['ds'] < last]['news_id'].iloc[:3])
+    old_k = df.loc[df['news_id'] == moved, key].iloc[0]
+    new_k = next(t for t in ['2330', '2317'] if t != old_k)
+    batch = df[df['news_id'].isin([moved, reagg])].copy()
+    batch.loc[batch['news_id'] == moved, key] = new_k
+    batch.loc[batch['news_id'] == reagg, ['ds', 'doc_score']] = [last, 0.9]
+    ids = {moved, reagg, dup}
+    now = set(zip(batch[key].astype(str), batch['news_id'].astype(int)))
+    removed = {k: [n for n in v if (k, n) not in now] for k, v in inc.doc_keys(engine, 'entity', ids).items()}
+    removed = {k: v for k, v in removed.items() if v}
+    assert _by_key(removed) == sorted([(str(old_k), moved), (str(df.loc[df['news_id'] == dup, key].iloc[0]), dup)])
+    touched = sorted({k for k, _ in now} | set(removed))
+    states = inc.load_states(engine, 'entity', touched, ids=ids)
+    assert sum(len(st["docs"]) for st in states.values()) == 3
+    out = inc.update_level(states, batch, key, 0.0, 1.0, 1, hist_days=365, today=today, removed=removed)
+    inc.save_states(engine, 'entity', states)
+
+    # 與「在記憶體裡持有全部貢獻」的結果一致
+    df2 = df[df['news_id'] != dup].copy()
+    df2.loc[df2['news_id'] == moved, key] = new_k
+    df2.loc[df2['news_id'] == reagg, ['ds', 'doc_score']] = [last, 0.9]
+    assert _by_key(inc.doc_keys(engine, 'entity', ids)) == sorted(now)
+    full = vec.build_level(df2, key, 0.0, 1.0, 1)
+    got = out[out['ds'] == last.isoformat()].sort_values('key')
+    exp = full[(full['ds'] == last) & full[key].astype(str).isin(got['key'])].sort_values(key)
+    assert got['n_docs'].tolist() == exp['n_docs'].tolist()
+    np.testing.assert_allclose(got['weighted_mean'].to_numpy(dtype=float), exp['weighted_mean'].to_numpy(dtype=float), rtol=1e-9)
+    with engine.begin() as conn:
+        assert conn.execute(text("SELECT COUNT(*) FROM signals_state_doc")).scalar() == len(df) - 1
+    assert inc.prune_docs(engine, 'entity', hist_days=0, today=last) == int((df2['ds'] < last).sum())
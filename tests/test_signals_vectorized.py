@@ -0,0 +1,28 @@
+import datetime
+import numpy as np
+import pandas as pd
+from src.signals import build_signals as bs
+from src.signals import vectorized as vec
+
+
+def _assert_same(a, b, keys):
+    a = a.sort_values(keys).reset_index(drop=True)
+    b = b.sort_values(keys).reset_index(drop=True)
+    assert list(a[keys].astype(str).itertuples(index=False)) == list(b[keys].astype(str).itertuples(index=False))
+    for c in ['n_docs', 'mean_score', 'weighted_mean', 'ewma_20', 'zscore_30', 'cum30', 'surprise_src7']:
+        x = pd.to_numeric(a[c], errors='coerce').to_numpy(dtype=float)
+        y = pd.to_numeric(b[c], errors='coerce').to_numpy(dtype=float)
+        np.testing.assert_allclose(x, y, rtol=1e-9, atol=1e-9, equal_nan=True, err_msg=c)
+
+
+def test_weights_match(make_signal_docs):
+    df = make_signal_docs(500)
+    w = vec.apply_weights(df, 1.0, {'Reuters': 1.5, 'CNA': 1.2}, 30.0)
+    np.testing.assert_allclose(w.to_numpy(), df['w'].to_numpy(), rtol=1e-12)
+
+
+def test_levels_match_legacy(make_signal_docs):
+    df = make_signal_docs()
+    for key in ['ticker', 'industry']:
+        _assert_same(bs._build_level_legacy(df, key, 0.05, 0.95, 3), vec.build_level(df, key, 0.05, 0.95, 3), [key, 'ds'])
+    _assert_same(bs._build_level_legacy(df, None, 0.05, 0.95, 3), vec.build_level(df, None, 0.05, 0.95, 3), ['ds'])
@@ -0,0 +1,34 @@
+from src.label.weak_rules import RuleConfig, score_sentence_zh, score_sentences_zh
+from src.models.score_cache import ScoreCache
+from src.nlp.zh_tokens import ZhTokenizer
+
+
+def test_lexicon_words_kept_whole_and_cached():
+    tok = ZhTokenizer(["展望樂觀"], cache=ScoreCache("t", capacity=100))
+    out = tok.tokenize_many(["公司下季展望樂觀", "公司下季展望樂觀", "  "])
+    assert "展望樂觀" in out[0] and out[0] == out[1] and out[2] == []
+    assert tok.cache.misses == 3
+    tok.tokenize_many(["公司下季展望樂觀"])
+    assert tok.cache.stats()["hits_mem"] == 1
+
+
+def test_batch_scoring_matches_single():
+    cfg = RuleConfig(positive=["成長", "看好"], negative=["下修"], negations=["不"], intensifiers=["大幅"], dampeners=["略"])
+    assert cfg.positive_set == frozenset({"成長", "看好"})
+    sents = ["營收大幅成長，法人看好", "財測下修", "獲利不成長", "大盤略漲"]
+    assert score_sentences_zh(sents, cfg) == [score_sentence_zh(s, cfg) for s in sents]
+    assert [lbl for lbl, _ in score_sentences_zh(sents, cfg)] == [1, -1, -1, 0]
+
+
+def test_global_jieba_words_do_not_leak_into_cached_tokens():
+    # 其他程式對全域 jieba 字典 add_word 不可改變同版本（同一組詞）的斷詞結果，否則快取會被污染
+    import jieba
+    sent = "這家公司推出量子晶片平台"
+    before = ZhTokenizer(["展望樂觀"], cache=ScoreCache("t", capacity=10)).tokenize(sent)
+    jieba.add_word("量子晶片平台")
+    try:
+        tok = ZhTokenizer(["展望樂觀"], cache=ScoreCache("t", capacity=10))
+        assert "量子晶片平台" in jieba.lcut(sent)
+        assert tok.tokenize(sent) == before and "量子晶片平台" not in before
+    finally:
+        jieba.del_word("量子晶片平台")